@@ -8,43 +8,68 @@ bigfiximport.py
 Created by Matt Hansen (mah60@psu.edu) on 2015-02-28.
 
 A utility for creating IBM Endpoint Manager (BigFix) tasks.
+
+The import pipeline can also be used as a library:
+
+    importer = Importer()
+    job = importer.run(ImportJob('/path/to/installer.exe'))
+    importer.post(job)
+
+Each kind of installer is handled by an ImportHandler subclass registered
+with register_handler().
+
+`bigfiximport.py serve` keeps an Importer running and accepts jobs as JSON
+over localhost HTTP or a Unix socket (see ImportRequestHandler). It has no
+authentication, so it refuses to listen on anything but loopback.
+
+Imported tasks are remembered in a task index keyed by the installer's
+sha256, so importing the same file again updates or skips the existing task
+instead of creating a duplicate. `bigfiximport.py refresh-index` rebuilds the
+index from the tasks already on the server; --force always creates a new task.
 """
 
 import os
 import re
+import csv
 import sys
-import shutil
+import glob
+import json
 import string
+import Queue
 import argparse
+import threading
+import collections
+import socket
+import SocketServer
+import BaseHTTPServer
+import itertools
 import getpass
+import hashlib
+import time
+import zlib
+import random
 import zipfile
-import tempfile
 import datetime
 import mimetypes
 import plistlib
-import hashlib
-import pkg_resources
 
 from time import gmtime, strftime
 from xml.etree import ElementTree as ET
+from xml.parsers.expat import ExpatError
 from ConfigParser import SafeConfigParser
 
-import requests
-try:
-    requests.packages.urllib3.disable_warnings()
-except:
-    pass
-
 # Needed to ignore some import errors
-import __builtin__
+import imp
 from types import ModuleType
 
-# -----------------------------------------------------------------------------
-# Templates
-# -----------------------------------------------------------------------------
-
-from jinja2 import Environment, FileSystemLoader
-env = Environment(loader=FileSystemLoader('templates'))
+# Pure-python helpers, safe to import on every platform
+from munkilib import bplist
+from munkilib import digests
+from munkilib import dmgfile
+from munkilib import filetypes
+from munkilib import hfsplus
+from munkilib import msiinfo
+from munkilib import peinfo
 
 # -----------------------------------------------------------------------------
 # Variables
@@ -54,167 +79,397 @@ __version__ = VERSION = '1.0'
 MUNKI_ZIP = 'munki-master.zip'
 MUNKILIB_PATH = os.path.join('munki-master', 'code', 'client', 'munkilib')
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Templates are looked up in ./templates first, then next to this script
+TEMPLATE_PATHS = ['templates', os.path.join(BASE_DIR, 'templates')]
+TEMPLATE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.bigfiximport', 'bytecode')
+TEMPLATE_MODULES_DIR = os.path.join(BASE_DIR, 'templates_compiled')
+TASK_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.bigfiximport', 'tasks.db')
+
+# Approximate size of each chunk of a streamed request body
+STREAM_CHUNK_SIZE = 2**16
+
 # -----------------------------------------------------------------------------
-# Argument Parsing
+# Lazy Imports
+# Backends are only imported once a handler actually uses them, so that
+# --version, custom templates and serve mode start quickly.
 # -----------------------------------------------------------------------------
 
-parser = argparse.ArgumentParser(description='bigfiximport')
-parser.add_argument('-v', '--verbose', action='count', dest='verbosity',
-                    help='increase output verbosity', default=0)
-parser.add_argument('--adobe', action='store_true', default=False,
-                    help='process an Adobe CC update file')
-parser.add_argument('--copyfromdmg', action='store_true', default=False,
-                    help='process an OS X copy from dmg installer')
-parser.add_argument('--package', action='store_true', default=False,
-                    help='process an OS X package installer')
-parser.add_argument('--key', action='append', dest='variables',
-                      default=[], help='Provide key=value pairs for input.'),
-parser.add_argument('--template', action='store', dest='template',
-                      default=[], help='Use an alternative template.'),
-parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
-
-args, extra_args = parser.parse_known_args()
+def module_available(name):
+    """Returns True if a top-level module can be found, without importing it."""
+    if name in sys.modules:
+        return not isinstance(sys.modules[name], DummyModule)
+    try:
+        imp.find_module(name)
+        return True
+    except ImportError:
+        return False
+
+# Used to ignore some import errors
+class DummyModule(ModuleType):
+    def __getattr__(self, key):
+        return None
+    __all__ = []   # support wildcard imports
+
+# Modules the munkilib modules import that only exist on OS X. Where they
+# are missing, DummyModule stands in for them so munkilib still loads.
+DARWIN_MODULES = ['Foundation', 'CoreFoundation', 'AppKit', 'LaunchServices',
+                  'SystemConfiguration', 'objc', 'xattr', 'OpenSSL', 'OpenSSL.crypto']
+
+def stub_missing_modules(names):
+    """
+    Puts a DummyModule in sys.modules for each of names that can't be
+    imported. Only those modules are affected; every other import, now or
+    later and in any thread, behaves normally.
+    """
+    for name in names:
+        if name in sys.modules:
+            continue
+        (parent, dummy_dot, child) = name.rpartition('.')
+        if not isinstance(sys.modules.get(parent), DummyModule):
+            try:
+                __import__(name)
+                continue
+            except ImportError:
+                pass
+        module = DummyModule(name)
+        sys.modules[name] = module
+        if parent in sys.modules:
+            setattr(sys.modules[parent], child, module)
+
+IMPORT_LOCK = threading.Lock()
+
+class LazyModule(ModuleType):
+    """
+    Stands in for a module until one of its attributes is used, then
+    imports it (and any listed submodules). With ignore_import_errors,
+    missing DARWIN_MODULES are stubbed first, so the munkilib modules load
+    on platforms without PyObjC.
+    """
+
+    def __init__(self, name, submodules=(), ignore_import_errors=False):
+        ModuleType.__init__(self, name)
+        self.__dict__['_lazy_names'] = (name,) + tuple(submodules)
+        self.__dict__['_lazy_ignore_errors'] = ignore_import_errors
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        if self.__dict__['_lazy_module'] is None:
+            with IMPORT_LOCK:
+                if self.__dict__['_lazy_ignore_errors'] and not DARWIN_FOUNDATION_AVAILABLE:
+                    stub_missing_modules(DARWIN_MODULES)
+                for name in self.__dict__['_lazy_names']:
+                    __import__(name)
+            self.__dict__['_lazy_module'] = sys.modules[self.__name__]
+        return self.__dict__['_lazy_module']
+
+    def __getattr__(self, key):
+        return getattr(self._load(), key)
 
 # -----------------------------------------------------------------------------
 # Platform Checks
 # -----------------------------------------------------------------------------
 
-# Predefine Flags - these will be set to true if imported
-DARWIN_FOUNDATION_AVAILABLE = False
-BESAPI_AVAILABLE = False
-HACHOIR_AVAILABLE = False
-MUNKILIB_AVAILABLE = False
-
 if sys.platform.startswith('darwin'):
     PLATFORM = 'darwin'
-    
-    try:
-        import Foundation
-        DARWIN_FOUNDATION_AVAILABLE = True
-    except ImportError:
-        DARWIN_FOUNDATION_AVAILABLE = False
-    
-    # Used to read and parse filesystem attributes
-    import json
-    import xattr
-
 elif sys.platform.startswith('win'):
     PLATFORM = 'win'
 elif sys.platform.startswith('linux'):
     PLATFORM = 'linux'
 
-try:
-    import besapi
-    BESAPI_AVAILABLE = True
-    besapi_version = pkg_resources.get_distribution("besapi").version
-except ImportError:
-    BESAPI_AVAILABLE = False
-
-try:
-    import hachoir_core
-    import hachoir_core.cmd_line
-    import hachoir_metadata
-    import hachoir_parser
-    HACHOIR_AVAILABLE = True
-    hachoir_version = pkg_resources.get_distribution("hachoir_core").version
-except ImportError:
-    HACHOIR_AVAILABLE = False
-
-# Used to ignore some import errors
-class DummyModule(ModuleType):
-    def __getattr__(self, key):
-        return None
-    __all__ = []   # support wildcard imports
-
-def tryimport(name, globals={}, locals={}, fromlist=[], level=-1):
-    try:
-        return realimport(name, globals, locals, fromlist, level)
-    except ImportError:
-        return DummyModule(name)
-
-# Start ignoring import errors
-if not DARWIN_FOUNDATION_AVAILABLE:
-    realimport, __builtin__.__import__ = __builtin__.__import__, tryimport
-
-if os.path.isdir('munkilib'):
-    MUNKILIB_AVAILABLE = True
-    munkilib_version = plistlib.readPlist(os.path.join('munkilib', 'version.plist')).get('CFBundleShortVersionString')
-
-    from munkilib import utils
-    from munkilib import munkicommon
-    from munkilib import adobeutils
-
-    if DARWIN_FOUNDATION_AVAILABLE:
-        from munkilib import FoundationPlist
-        from munkilib import appleupdates
-        from munkilib import profiles
-        from munkilib import fetch
-
-# Verbose environment output
-if args.verbosity > 1:
-    for p in ['PLATFORM', 'BESAPI_AVAILABLE', 'MUNKILIB_AVAILABLE', 'DARWIN_FOUNDATION_AVAILABLE', 'HACHOIR_AVAILABLE']:
-        print "%s: %s" % (p, eval(p))
-
-    if BESAPI_AVAILABLE:
-        print "besapi version: %s" % besapi_version
-    if HACHOIR_AVAILABLE:
-        print "hachoir_core version: %s" % hachoir_version
+DARWIN_FOUNDATION_AVAILABLE = PLATFORM == 'darwin' and module_available('Foundation')
+HACHOIR_AVAILABLE = all(module_available(name) for name in
+                        ['hachoir_core', 'hachoir_metadata', 'hachoir_parser'])
+MUNKILIB_AVAILABLE = os.path.isdir(os.path.join(BASE_DIR, 'munkilib'))
+
+hachoir_core = LazyModule('hachoir_core', ['hachoir_core.cmd_line', 'hachoir_core.error'])
+hachoir_metadata = LazyModule('hachoir_metadata')
+hachoir_parser = LazyModule('hachoir_parser')
+
+# Used to read and parse filesystem attributes
+xattr = LazyModule('xattr')
+
+munkicommon = LazyModule('munkilib.munkicommon', ignore_import_errors=True)
+adobeutils = LazyModule('munkilib.adobeutils', ignore_import_errors=True)
+FoundationPlist = LazyModule('munkilib.FoundationPlist', ignore_import_errors=True)
+
+def get_versions():
+    """Returns the versions of the optional backends that are installed."""
+    import pkg_resources
+
+    versions = {}
+    for (flag, label, distribution) in [(True, 'requests', 'requests'),
+                                        (HACHOIR_AVAILABLE, 'hachoir_core', 'hachoir_core')]:
+        if flag:
+            try:
+                versions[label] = pkg_resources.get_distribution(distribution).version
+            except pkg_resources.DistributionNotFound:
+                versions[label] = 'unknown'
     if MUNKILIB_AVAILABLE:
-        print "munkilib version: %s" % munkilib_version
+        versions['munkilib'] = plistlib.readPlist(os.path.join(BASE_DIR, 'munkilib', 'version.plist')).get('CFBundleShortVersionString')
+    return versions
 
 # -----------------------------------------------------------------------------
 # besapi Config
 # TODO: Make config paths work cross platform
 # -----------------------------------------------------------------------------
 
-# Read Config File
-CONFPARSER = SafeConfigParser({'VERBOSE': 'True'})
-if PLATFORM is 'win':
-    system_wide_conf_path = os.path.join(os.environ['ALLUSERSPROFILE'], 'besapi.conf')
-    CONFPARSER.read([system_wide_conf_path,
+def read_config(paths=None):
+    """Reads besapi.conf from the usual system, user and local locations."""
+    confparser = SafeConfigParser({'VERBOSE': 'True'})
+    if paths is None:
+        if PLATFORM is 'win':
+            system_wide_conf_path = os.path.join(os.environ['ALLUSERSPROFILE'], 'besapi.conf')
+            paths = [system_wide_conf_path,
                      os.path.expanduser('~/besapi.conf'),
-                     'besapi.conf'])
-else:
-    CONFPARSER.read(['/etc/besapi.conf',
+                     'besapi.conf']
+        else:
+            paths = ['/etc/besapi.conf',
                      os.path.expanduser('~/besapi.conf'),
-                     'besapi.conf'])
+                     'besapi.conf']
+    confparser.read(paths)
+    return confparser
 
-BES_ROOT_SERVER = CONFPARSER.get('besapi', 'BES_ROOT_SERVER')
-BES_USER_NAME = CONFPARSER.get('besapi', 'BES_USER_NAME')
-BES_PASSWORD = CONFPARSER.get('besapi', 'BES_PASSWORD')
+# -----------------------------------------------------------------------------
+# BigFix REST Connection
+# -----------------------------------------------------------------------------
 
-if 'bigfiximport' in CONFPARSER.sections():
-    BES_DEFAULTSITE = CONFPARSER.get('bigfiximport', 'BES_DEFAULTSITE')
-else:
-    BES_DEFAULTSITE = "master"
+class BigFixSession(object):
+    """
+    Keep-alive connection to the BigFix REST API. Requests share a pooled
+    requests.Session, connection errors and 5xx responses are retried with
+    jittered exponential backoff, and the latency of every request is kept
+    in `latencies` as (method, path, status, seconds).
+
+    Only idempotent requests are retried once they may have reached the
+    server: a POST that failed with a 5xx or a dropped connection may
+    already have created its task, so it is only retried if it could not
+    connect at all.
+    """
 
-if 'besarchiver' in CONFPARSER.sections():
-    VERBOSE = CONFPARSER.getboolean('besarchiver', 'VERBOSE')
-else:
-    VERBOSE = True
-    
-B = besapi.BESConnection(BES_USER_NAME, BES_PASSWORD, BES_ROOT_SERVER)
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    def __init__(self, username, password, rootserver, verify=False,
+                 pool_size=10, retries=3, backoff=0.5):
+        import requests
+
+        self.rootserver = rootserver.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.latencies = collections.deque(maxlen=1000)
+
+        if not verify:
+            try:
+                from requests.packages.urllib3.exceptions import InsecureRequestWarning
+                requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+            except ImportError:
+                pass
+
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.verify = verify
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        if path.startswith(self.rootserver):
+            return path
+        return "%s/api/%s" % (self.rootserver, path)
+
+    def request(self, method, path, data=None, **kwargs):
+        """
+        Sends a request and returns the requests.Response. data may be a
+        callable returning a fresh request body, so streamed bodies can be
+        sent again on retry; a plain iterator is never retried.
+        """
+        import requests
+
+        retries = self.retries
+        if data is not None and not callable(data) and not isinstance(data, basestring):
+            retries = 0
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            body = data() if callable(data) else data
+            started = time.time()
+            try:
+                response = self.session.request(method, self.url(path), data=body, **kwargs)
+            except requests.ConnectionError, err:
+                self.latencies.append((method, path, None, time.time() - started))
+                if attempt >= retries or not (idempotent or request_not_sent(err)):
+                    raise
+            else:
+                self.latencies.append((method, path, response.status_code, time.time() - started))
+                if (response.status_code not in self.RETRY_STATUS_CODES
+                        or not idempotent or attempt >= retries):
+                    return response
+
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, data, **kwargs):
+        return self.request('POST', path, data=data, **kwargs)
+
+    def put(self, path, data, **kwargs):
+        return self.request('PUT', path, data=data, **kwargs)
+
+    def latency_summary(self):
+        """Returns the count, mean and maximum of the recorded latencies."""
+        seconds = [latency[3] for latency in list(self.latencies)]
+        if not seconds:
+            return {'count': 0, 'mean': None, 'max': None}
+        return {'count': len(seconds), 'mean': sum(seconds) / len(seconds),
+                'max': max(seconds)}
+
+def request_not_sent(err):
+    """
+    Returns True if a requests.ConnectionError was raised before any of
+    the request reached the server: the connection was refused, could not
+    be resolved or timed out while connecting.
+    """
+    from requests.packages.urllib3.exceptions import ConnectTimeoutError
+
+    reason = getattr(err.args[0], 'reason', None) if err.args else None
+    # NewConnectionError (refused, unresolvable) is a ConnectTimeoutError
+    return isinstance(reason, ConnectTimeoutError)
+
+# -----------------------------------------------------------------------------
+# Task Index
+# -----------------------------------------------------------------------------
+
+# Template values that change on every run and so don't count as a change
+VOLATILE_VALUES = ['today', 'strftime', 'user']
+
+def task_hash(job):
+    """
+    Returns a hash of everything that determines a job's task except the
+    values in VOLATILE_VALUES, so re-importing an unchanged installer with
+    the same template and variables gives the same hash.
+    """
+    values = dict((k, v) for (k, v) in job.info.items() if k not in VOLATILE_VALUES)
+    content = json.dumps([job.template, values], sort_keys=True, default=repr)
+    return hashlib.sha256(content).hexdigest()
+
+class TaskIndex(object):
+    """
+    Persistent sqlite map from (site, installer sha256) to the task that
+    was imported for it, used to avoid importing duplicate tasks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            import sqlite3
+
+            indexdir = os.path.dirname(self.path)
+            if indexdir and not os.path.isdir(indexdir):
+                os.makedirs(indexdir)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                'site TEXT, sha256 TEXT, task_id TEXT, task_name TEXT, '
+                'template TEXT, task_hash TEXT, PRIMARY KEY (site, sha256))')
+            self._conn.commit()
+        return self._conn
+
+    def get(self, site, sha256):
+        """Returns the entry for an installer as a dictionary, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT task_id, task_name, template, task_hash FROM tasks '
+                'WHERE site = ? AND sha256 = ?', (site, sha256)).fetchone()
+        if row is None:
+            return None
+        return {'task_id': row[0], 'task_name': row[1], 'template': row[2],
+                'task_hash': row[3]}
+
+    def put(self, site, sha256, task_id, task_name=None, template=None, task_hash=None):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)',
+                         (site, sha256, task_id, task_name, template, task_hash))
+            conn.commit()
+
+    def task_ids(self, site):
+        """Returns the set of task IDs indexed for a site."""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT task_id FROM tasks WHERE site = ?', (site,)).fetchall()
+        return set(row[0] for row in rows)
+
+    def remove_tasks(self, site, task_ids):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany('DELETE FROM tasks WHERE site = ? AND task_id = ?',
+                             [(site, task_id) for task_id in task_ids])
+            conn.commit()
+
+# Finds the sha256 of the prefetched file in a task's action script
+TASK_SHA256 = re.compile(r'sha256:([0-9a-fA-F]{64})')
+
+def refresh_task_index(importer, site=None):
+    """
+    Brings the task index up to date with tasks/<site>. Tasks that are new
+    to the index are fetched once to read the sha256 of the file they
+    prefetch; tasks that no longer exist are dropped. Tasks found this way
+    have no recorded values, so the first re-import of one updates it.
+    """
+    site = site or importer.default_site
+    index = importer.task_index
+    listing = importer.connection.get('tasks/%s' % site)
+    if not listing.ok:
+        raise BigFixImportError("Unable to list tasks/%s: %s" % (site, response_error(listing)))
+    listed = dict((task_id, name) for (name, task_id) in parse_task_results(listing))
+
+    known = index.task_ids(site)
+    index.remove_tasks(site, known - set(listed))
+
+    added = 0
+    for task_id in sorted(set(listed) - known):
+        task = importer.connection.get('task/%s/%s' % (site, task_id))
+        if not task.ok:
+            raise BigFixImportError("Unable to read task/%s/%s: %s"
+                                    % (site, task_id, response_error(task)))
+        match = TASK_SHA256.search(task.text)
+        if match:
+            index.put(site, match.group(1).lower(), task_id, listed[task_id])
+            added += 1
+
+    print "Indexed %d new tasks, %d tasks in tasks/%s" % (added, len(listed), site)
 
 # -----------------------------------------------------------------------------
 # Helper Functions
 # -----------------------------------------------------------------------------
 
+class BigFixImportError(Exception):
+    """A file could not be turned into a task."""
+    pass
+
+def response_error(response):
+    """Describes a REST response that was not successful."""
+    return "HTTP %d %s from %s" % (response.status_code, response.reason or '', response.url)
+
 def guess_file_type(url, use_strict=False):
-    return mimetypes.guess_type(file_path, use_strict)
+    return mimetypes.guess_type(url, use_strict)
     
 def getkMDItemWhereFroms(file_path, default):
-    
-    from subprocess import Popen, PIPE
 
     if u'com.apple.metadata:kMDItemWhereFroms' in xattr.listxattr(file_path):
         bplist_data = xattr.getxattr(file_path, 'com.apple.metadata:kMDItemWhereFroms')
-        
-        args = ["/usr/bin/plutil", "-convert", "json", "-o", "-", "--", "-"]
-        p = Popen(args, stdin=PIPE, stdout=PIPE)
-        p.stdin.write(bplist_data)
-        out, err = p.communicate()
-        
-        return str(json.loads(out)[0])
+
+        return str(bplist.readplist(bplist_data)[0])
     else:
         return default
 
@@ -236,12 +491,8 @@ def get_env_source_mime_data():
                 'user'      : getpass.getuser()
             }
 
-def get_sha_size(file_path):
-    return {
-                'sha1'  : hashlib.sha1(file(file_path).read()).hexdigest(),
-                'size'  : os.path.getsize(file_path),
-                'sha256': hashlib.sha256(file(file_path).read()).hexdigest()
-            }
+def get_sha_size(file_path, chunksize=digests.CHUNK_SIZE):
+    return digests.getdigests(file_path, chunksize=chunksize)
 
 def getiteminfo(itempath):
     """
@@ -252,20 +503,7 @@ def getiteminfo(itempath):
     """
     infodict = {}
     if munkicommon.isApplication(itempath):
-        infodict['type'] = 'application'
-        infodict['path'] = itempath
-        plist = getBundleInfo(itempath)
-        for key in ['CFBundleName', 'CFBundleIdentifier',
-                    'CFBundleShortVersionString', 'CFBundleVersion']:
-            if key in plist:
-                infodict[key] = plist[key]
-        if 'LSMinimumSystemVersion' in plist:
-            infodict['minosversion'] = plist['LSMinimumSystemVersion']
-        elif 'SystemVersionCheck:MinimumSystemVersion' in plist:
-            infodict['minosversion'] = \
-                plist['SystemVersionCheck:MinimumSystemVersion']
-        else:
-            infodict['minosversion'] = '10.6'
+        infodict = get_app_info(itempath, getBundleInfo(itempath))
 
     elif os.path.exists(os.path.join(itempath, 'Contents', 'Info.plist')) or \
          os.path.exists(os.path.join(itempath, 'Resources', 'Info.plist')):
@@ -288,6 +526,38 @@ def getiteminfo(itempath):
         except FoundationPlist.NSPropertyListSerializationException:
             pass
 
+    set_version_comparison_key(infodict)
+
+    if not 'CFBundleShortVersionString' in infodict and \
+       not 'CFBundleVersion' in infodict:
+        infodict['type'] = 'file'
+        infodict['path'] = itempath
+        if os.path.isfile(itempath):
+            infodict['md5checksum'] = munkicommon.getmd5hash(itempath)
+    return infodict
+
+def get_app_info(itempath, plist):
+    """
+    Returns the "installs" info of the application at itempath, given the
+    contents of its Info.plist.
+    """
+    infodict = {}
+    infodict['type'] = 'application'
+    infodict['path'] = itempath
+    for key in ['CFBundleName', 'CFBundleIdentifier',
+                'CFBundleShortVersionString', 'CFBundleVersion']:
+        if key in plist:
+            infodict[key] = plist[key]
+    if 'LSMinimumSystemVersion' in plist:
+        infodict['minosversion'] = plist['LSMinimumSystemVersion']
+    elif 'SystemVersionCheck:MinimumSystemVersion' in plist:
+        infodict['minosversion'] = \
+            plist['SystemVersionCheck:MinimumSystemVersion']
+    else:
+        infodict['minosversion'] = '10.6'
+    return infodict
+
+def set_version_comparison_key(infodict):
     # let's help the admin -- if CFBundleShortVersionString is empty
     # or doesn't start with a digit, and CFBundleVersion is there
     # use CFBundleVersion as the version_comparison_key
@@ -299,13 +569,43 @@ def getiteminfo(itempath):
     elif 'CFBundleShortVersionString' in infodict:
         infodict['version_comparison_key'] = 'CFBundleShortVersionString'
 
-    if not 'CFBundleShortVersionString' in infodict and \
-       not 'CFBundleVersion' in infodict:
-        infodict['type'] = 'file'
-        infodict['path'] = itempath
-        if os.path.isfile(itempath):
-            infodict['md5checksum'] = munkicommon.getmd5hash(itempath)
-    return infodict
+def get_volume_app_info(volume):
+    """
+    Finds the first application on an unmounted disk image volume (an
+    hfsplus.HFSVolume), the way CopyFromDmgHandler walks a mounted one.
+    Returns the application's path on the volume and its "installs" info,
+    or (None, None).
+    """
+    for (path, dummy_dirs, dummy_files) in volume.walk():
+        if not path:
+            continue
+        plist = None
+        for infopath in [path + '/Contents/Info.plist',
+                         path + '/Resources/Info.plist']:
+            if volume.isfile(infopath):
+                plist = FoundationPlist.readPlistFromString(
+                    volume.read(infopath))
+                break
+
+        if not path.endswith('.app'):
+            # look for app bundle structure, as munkicommon.isApplication does
+            if not volume.isfile(path + '/Contents/Info.plist'):
+                continue
+            if plist.get('CFBundlePackageType', 'APPL') != 'APPL':
+                continue
+            bundleexecutable = plist.get(
+                'CFBundleExecutable', os.path.basename(path))
+            if not volume.exists(
+                    path + '/Contents/MacOS/' + bundleexecutable):
+                continue
+
+        iteminfo = get_app_info(path, plist or {})
+        set_version_comparison_key(iteminfo)
+        if not 'CFBundleShortVersionString' in iteminfo and \
+           not 'CFBundleVersion' in iteminfo:
+            iteminfo['type'] = 'file'
+        return (path, iteminfo)
+    return (None, None)
     
 def getBundleInfo(path):
     """
@@ -331,192 +631,420 @@ def getHachoirMetaData(file_path):
     parser = hachoir_parser.createParser(ufilepath, file_path)
     
     if not parser:
-        print "Unable to parse file metadata"
-        sys.exit(1)
+        raise BigFixImportError("Unable to parse file metadata")
 
     try:
         metadata = hachoir_metadata.extractMetadata(parser)
-    except HachoirError, err:
-        print "Metadata extraction error: %s" % unicode(err)
-        sys.exit(1)
+    except hachoir_core.error.HachoirError, err:
+        raise BigFixImportError("Metadata extraction error: %s" % unicode(err))
         
     if not metadata:
-        print "Unable to extract metadata"
-        sys.exit(1)
+        raise BigFixImportError("Unable to extract metadata")
     else:
         return metadata
 
+def get_pe_metadata(file_path):
+    """
+    Returns the template values of a Windows executable from its version
+    resource, using the same keys as hachoir_metadata, plus the installer
+    type and silent install arguments of known installer wrappers.
+    """
+    try:
+        pe = peinfo.getpeinfo(file_path)
+    except (peinfo.Error, IOError), err:
+        raise BigFixImportError("Unable to read executable: %s" % err)
+
+    strings = pe['strings']
+    metadata = {
+        'format_version': u"Portable Executable: %s" % ('DLL' if pe['is_dll'] else 'EXE'),
+        'machine':        pe['machine'],
+        'installer_type': pe['installer_type'],
+        'silent_args':    pe['silent_args'],
+    }
+    for (key, names) in [('title',     ['ProductName', 'FileDescription']),
+                         ('author',    ['CompanyName']),
+                         ('copyright', ['LegalCopyright', 'LegalTrademarks']),
+                         ('version',   ['ProductVersion']),
+                         ('comment',   ['Comments', 'FileDescription'])]:
+        for name in names:
+            if strings.get(name):
+                metadata[key] = strings[name]
+                break
+    if 'version' not in metadata and pe.get('product_version'):
+        metadata['version'] = pe['product_version']
+    return metadata
+
+def get_msi_metadata(file_path):
+    """
+    Returns the template values of a Windows Installer package from its
+    Property table and SummaryInformation stream.
+    """
+    try:
+        msi = msiinfo.getmsiinfo(file_path)
+    except (msiinfo.Error, IOError), err:
+        raise BigFixImportError("Unable to read MSI database: %s" % err)
+
+    summary = msi['summary']
+    return {
+        'title':        msi.get('ProductName') or summary.get('subject'),
+        'author':       msi.get('Manufacturer') or summary.get('author'),
+        'version':      msi.get('ProductVersion'),
+        'product_code': msi.get('ProductCode'),
+        'upgrade_code': msi.get('UpgradeCode'),
+        'package_code': summary.get('revision_number'),
+        'comment':      summary.get('comments') or summary.get('title'),
+        'platform':     summary.get('template', u'').split(';', 1)[0],
+        'properties':   msi['properties'],
+    }
+
+
 # -----------------------------------------------------------------------------
-# Core
+# Import Jobs
 # -----------------------------------------------------------------------------
-if args.verbosity > 1:
-    print '\nNumber of arguments:', len(sys.argv), 'arguments.'
-    print 'Argument List:', str(sys.argv)
-
-file_path = sys.argv[-1]
-file_path_noextension = os.path.splitext(file_path)[0]
-file_mime, file_encoding = guess_file_type(file_path)
-file_is_local = True if os.path.isfile(file_path) else False
-file_name_isfolder = os.path.isdir(file_path)
-
-file_name = os.path.basename(file_path)
-file_name_noextension, file_extension = os.path.splitext(file_name)
-base_file_name = file_name.split('-')[0].split('.')[0]
-
-# Add command-line variables
-cli_values = {}
-for arg in args.variables:
-        (key, sep, value) = arg.partition("=")
-        if sep != "=":
-            print "Invalid variable [key=value]: %s" % arg
-            sys.exit(1)
-        cli_values[key] = value
-        
-calc_values = {}
-if DARWIN_FOUNDATION_AVAILABLE:
-    calc_values['url'] = getkMDItemWhereFroms(file_path, None)
 
-if args.verbosity > 1:
-    print "Command-line Variables: %s" % cli_values
+class ImportJob(object):
+    """
+    A single file to be turned into a BES task. Each stage of the Importer
+    fills in more of the job:
+
+        classify -> fileinfo
+        extract  -> handler, template, info
+        render   -> rendered
+        post     -> task
+
+    Jobs only hold plain data so they can be handed to worker processes.
+    """
+
+    def __init__(self, file_path, template_name=None, values=None):
+        self.file_path = file_path
+        self.template_name = template_name
+        self.values = dict(values or {})
+        self.fileinfo = None
+        self.handler = None
+        self.template = None
+        self.info = None
+        self.rendered = None
+        self.task = None
+        self.action = None
+        self.task_name = None
+        self.task_id = None
+        self.error = None
+
+    def __repr__(self):
+        return '<ImportJob %s>' % self.file_path
 
 # -----------------------------------------------------------------------------
-# OS X Drag & Drop App
+# Handlers
 # -----------------------------------------------------------------------------
-if file_mime == 'application/x-apple-diskimage' and file_is_local and DARWIN_FOUNDATION_AVAILABLE and not args.adobe:
-    if args.template:
-        template = env.get_template(args.template)
-    else:
-        template = env.get_template('copyfromdmg.bes')
 
-    mountpoints = munkicommon.mountdmg(file_path, use_existing_mounts=True)
+HANDLERS = []
 
-    iteminfo = ''
-    try:
-        for (itemname, dummy_dirs, dummy_files) in os.walk(mountpoints[0]):
-            itempath = os.path.join(mountpoints[0], itemname)
-            if munkicommon.isApplication(itempath):
-                item = itemname
-                iteminfo = getiteminfo(itempath)
-                if iteminfo:
-                    break
-    
-        if iteminfo:
-            if os.path.isabs(item):
+def register_handler(handler_class):
+    """
+    Registers an ImportHandler subclass. Handlers are tried in order of
+    their priority, and in order of registration within the same priority;
+    the first one whose matches() returns True handles the file.
+    """
+    handler = handler_class()
+    position = len(HANDLERS)
+    for index, existing in enumerate(HANDLERS):
+        if existing.priority > handler.priority:
+            position = index
+            break
+    HANDLERS.insert(position, handler)
+    return handler_class
+
+def get_handler(name):
+    """Returns the registered handler with the given name, or None."""
+    for handler in HANDLERS:
+        if handler.name == name:
+            return handler
+    return None
+
+class ImportHandler(object):
+    """
+    Base class for installer handlers. Subclasses set a name, a default
+    template and implement matches() and extract().
+    """
+    name = None
+    default_template = None
+    priority = 50
+
+    def matches(self, importer, job):
+        """Returns True if this handler should process the job."""
+        return False
+
+    def select_template(self, importer, job):
+        """Returns the name of the template to render the job with."""
+        return job.template_name or self.default_template
+
+    def extract(self, importer, job):
+        """
+        Returns a dictionary of template values for the job, or None if
+        there is nothing to render. Raises BigFixImportError on failure.
+        """
+        return None
+
+@register_handler
+class CopyFromDmgHandler(ImportHandler):
+    """OS X Drag & Drop App"""
+    name = 'copyfromdmg'
+    default_template = 'copyfromdmg.bes'
+
+    def matches(self, importer, job):
+        info = job.fileinfo
+        return (info['file_type'] == 'udif' and info['file_is_local']
+                and not importer.adobe)
+
+    def extract(self, importer, job):
+        file_path = job.file_path
+
+        try:
+            (item, iteminfo) = self.find_volume_app(file_path)
+        except (dmgfile.Error, hfsplus.Error), err:
+            # e.g. an APFS image, which only hdiutil can read
+            if not DARWIN_FOUNDATION_AVAILABLE:
+                raise BigFixImportError("Unable to read disk image: %s" % err)
+            (item, iteminfo) = self.find_mounted_app(file_path)
+        except FoundationPlist.FoundationPlistException, err:
+            raise BigFixImportError(
+                "Unable to read application data from disk image: %s" % err)
+
+        if not iteminfo:
+            return None
+
+        cataloginfo = {}
+        cataloginfo['display_name'] = iteminfo.get('CFBundleName',
+                                        os.path.splitext(item)[0])
+        version_comparison_key = iteminfo.get(
+            'version_comparison_key', "CFBundleShortVersionString")
+        cataloginfo['version'] = \
+            iteminfo.get(version_comparison_key, "0")
+        cataloginfo.update(iteminfo)
+        cataloginfo['item_to_copy'] = item
+        cataloginfo['base_file_name'] = job.fileinfo['base_file_name']
+        cataloginfo.update(get_sha_size(file_path, importer.hash_chunk_size))
+        cataloginfo.update(get_env_source_mime_data())
+        return cataloginfo
+
+    def find_volume_app(self, file_path):
+        """Reads the disk image, without mounting it, to find its application."""
+        volume = dmgfile.openvolume(file_path)
+        try:
+            return get_volume_app_info(volume)
+        finally:
+            volume.close()
+
+    def find_mounted_app(self, file_path):
+        """Mounts the disk image to find its application."""
+        mountpoints = munkicommon.mountdmg(file_path, use_existing_mounts=True)
+        if not mountpoints:
+            raise BigFixImportError("Unable to mount disk image %s" % file_path)
+
+        item = None
+        iteminfo = ''
+        try:
+            for (itemname, dummy_dirs, dummy_files) in os.walk(mountpoints[0]):
+                itempath = os.path.join(mountpoints[0], itemname)
+                if munkicommon.isApplication(itempath):
+                    item = itemname
+                    iteminfo = getiteminfo(itempath)
+                    if iteminfo:
+                        break
+
+            if iteminfo and os.path.isabs(item):
                 mountpointPattern = "^%s/" % mountpoints[0]
                 item = re.sub(mountpointPattern, '', item)
-    
-            cataloginfo = {}
-            cataloginfo['display_name'] = iteminfo.get('CFBundleName',
-                                            os.path.splitext(item)[0])
-            version_comparison_key = iteminfo.get(
-                'version_comparison_key', "CFBundleShortVersionString")
-            cataloginfo['version'] = \
-                iteminfo.get(version_comparison_key, "0")
-            cataloginfo.update(iteminfo)
-            cataloginfo['item_to_copy'] = item
-            cataloginfo['base_file_name'] = base_file_name
-            cataloginfo.update(get_sha_size(file_path))
-            cataloginfo.update(get_env_source_mime_data())
-            
-            # Update with input variables
-            if cli_values:
-                cataloginfo.update(cli_values)
-                
-            # Update with calculated values
-            if calc_values:
-                cataloginfo.update(calc_values)
-            
-            # Render new task
-            rendered_template = template.render(**cataloginfo)
-    except:
-        print "Unable to read application data from disk image!"
-        sys.exit(1)
-    finally:
-        #eject the dmg
-        munkicommon.unmountdmg(mountpoints[0])
+        finally:
+            #eject the dmg
+            munkicommon.unmountdmg(mountpoints[0])
+
+        return (item, iteminfo)
+
+@register_handler
+class FlatPackageHandler(ImportHandler):
+    """OS X Flat Installer Package (.pkg)"""
+    name = 'flatpackage'
+    default_template = 'appleflatpackageinstaller.bes'
+
+    def matches(self, importer, job):
+        info = job.fileinfo
+        return info['file_type'] == 'xar' and importer.package
+
+    def extract(self, importer, job):
+        pkginfo = munkicommon.getPackageMetaData(job.file_path)
+
+        pkginfo.update(get_sha_size(job.file_path, importer.hash_chunk_size))
+        pkginfo.update(get_env_source_mime_data())
+        pkginfo['base_file_name'] = job.fileinfo['base_file_name']
+        return pkginfo
+
+@register_handler
+class BundlePackageHandler(ImportHandler):
+    """OS X Bundle Installer Package (.mpkg)"""
+    name = 'bundlepackage'
+
+    def matches(self, importer, job):
+        info = job.fileinfo
+        return (info['file_name_isfolder'] and info['file_extension'] == '.mpkg'
+                and importer.package)
+
+@register_handler
+class DmgPackageHandler(ImportHandler):
+    """OS X Package in a Disk Image"""
+    name = 'dmgpackage'
+
+    def matches(self, importer, job):
+        info = job.fileinfo
+        return (info['file_mime'] == 'application/x-apple-diskimage' and info['file_is_local']
+                and DARWIN_FOUNDATION_AVAILABLE and importer.package)
+
+@register_handler
+class WindowsMsiHandler(ImportHandler):
+    """Windows MSI"""
+    name = 'windowsmsi'
+    default_template = 'windowsmsi.bes'
+
+    def matches(self, importer, job):
+        return job.fileinfo['file_type'] == 'msi'
+
+    def extract(self, importer, job):
+        msi_info = get_msi_metadata(job.file_path)
+        if importer.verbosity > 1:
+            print msi_info
+
+        msi_info.update(get_sha_size(job.file_path, importer.hash_chunk_size))
+        msi_info.update(get_env_source_mime_data())
+        msi_info['base_file_name'] = job.fileinfo['base_file_name']
+        return msi_info
+
+@register_handler
+class WindowsExeHandler(ImportHandler):
+    """Windows EXE"""
+    name = 'windowsexe'
+    default_template = 'windowsexe.bes'
+
+    def matches(self, importer, job):
+        return job.fileinfo['file_type'] in ('pe', 'mz')
+
+    def extract(self, importer, job):
+        try:
+            mimeinfo = get_pe_metadata(job.file_path)
+        except BigFixImportError:
+            # Not a PE image (e.g. a 16 bit NE executable); hachoir may know it
+            if not HACHOIR_AVAILABLE:
+                if job.fileinfo['file_type'] == 'mz':
+                    raise BigFixImportError(
+                        "%s is not a PE executable and hachoir is not available"
+                        % job.file_path)
+                raise
+            mimeinfo = {}
+            for data_item in getHachoirMetaData(job.file_path):
+                for value in data_item.values:
+                    mimeinfo[data_item.key] = filter(lambda x: x in string.printable, value.text)
+        if importer.verbosity > 1:
+            print mimeinfo
+
+        mimeinfo.update(get_sha_size(job.file_path, importer.hash_chunk_size))
+        mimeinfo.update(get_env_source_mime_data())
+        mimeinfo['base_file_name'] = job.fileinfo['base_file_name']
+        return mimeinfo
+
+class AdobeUpdateHandler(ImportHandler):
+    """Common processing for Adobe CC updates."""
+
+    def extract(self, importer, job):
+        adobe_info = self.extract_adobe_info(importer, job)
+        if adobe_info is None:
+            return None
 
-# -----------------------------------------------------------------------------
-# OS X Flat Installer Package (.pkg)
-# -----------------------------------------------------------------------------
-elif file_mime == 'application/octet-stream' and file_extension == '.pkg' and args.package:
-    if args.template:
-        template = env.get_template(args.template)
-    else:
-        template = env.get_template('appleflatpackageinstaller.bes')
-    
-    pkginfo = munkicommon.getPackageMetaData(file_path)
-    
-    pkginfo.update(get_sha_size(file_path))
-    pkginfo.update(get_env_source_mime_data())
-    pkginfo['base_file_name'] = base_file_name
-    
-    # Update with input variables
-    if cli_values:
-        pkginfo.update(cli_values)
-    
-    # Update with calculated values
-    if calc_values:
-        pkginfo.update(calc_values)
+        # Get direct download link from url file
+        with open('.'.join([job.file_path, 'url']), 'r') as url_file:
+            adobe_info['url'] = url_file.readline()
 
-    # Render new task
-    rendered_template = template.render(**pkginfo)
+        # Trim description
+        if ':' in adobe_info['description']:
+            adobe_info['description'] = adobe_info['description'].split(' : ', 1)[-1]
 
-# -----------------------------------------------------------------------------
-# OS X Bundle Installer Package (.mpkg)
-# -----------------------------------------------------------------------------
-elif file_name_isfolder and file_extension == '.mpkg' and args.package:
-    pass
-    
+        # Sanitize and workaround Adobe naming inconsistency
+        adobe_info['name'] = ''.join(adobe_info['display_name'].split('.')[0])
+        if 'Flash' in adobe_info['display_name'] and 'Professional ' in adobe_info['display_name']:
+            adobe_info['display_name'] = adobe_info['display_name'].replace('Professional ', '')
+            adobe_info['name'] = adobe_info['display_name']
+        if not adobe_info['display_name'].startswith('Adobe '):
+            adobe_info['display_name'] = "Adobe %s" % adobe_info['name']
+        if adobe_info['name'] == 'Adobe Illustrator CC 2014':
+            adobe_info['name'] = 'Adobe Illustrator'
 
-# -----------------------------------------------------------------------------
-# OS X Package in a Disk Image
-# -----------------------------------------------------------------------------
-elif file_mime == 'application/x-apple-diskimage' and file_is_local and DARWIN_FOUNDATION_AVAILABLE and args.package:
-    pass
-    
-# -----------------------------------------------------------------------------
-# Windows MSI
-# -----------------------------------------------------------------------------
-elif file_mime == 'application/x-msdownload' and file_extension == '.msi':
-    pass
+        # Determine base version
+        adobe_info['base_version'] = "%s.0.0" % adobe_info['version'].split('.')[0]
 
-# -----------------------------------------------------------------------------
-# Windows EXE
-# -----------------------------------------------------------------------------
-elif HACHOIR_AVAILABLE and file_mime == 'application/x-msdownload' and file_extension == '.exe':
-    mimeinfo = {}
-    for data_item in getHachoirMetaData(file_path):
-        for value in data_item.values:
-            mimeinfo[data_item.key] = filter(lambda x: x in string.printable, value.text)
-    if args.verbosity > 1: 
-        print mimeinfo
-    
-    mimeinfo.update(get_sha_size(file_path))
-    mimeinfo.update(get_env_source_mime_data())
-    mimeinfo['base_file_name'] = base_file_name
-    
-    if args.template:
-        template = env.get_template(args.template)
-    else:
-        template = env.get_template('windowsexe.bes')
-        
-    rendered_template = template.render(**mimeinfo)
+        adobe_info['base_file_name'] = job.fileinfo['base_file_name']
+        adobe_info.update(get_env_source_mime_data())
+        adobe_info.update(get_sha_size(job.file_path, importer.hash_chunk_size))
+        return adobe_info
 
-# -----------------------------------------------------------------------------
-# Adobe Updates
-# -----------------------------------------------------------------------------
+    def extract_adobe_info(self, importer, job):
+        """Returns the update specific part of the Adobe metadata."""
+        return None
 
-elif args.adobe:
+@register_handler
+class AdobeMacUpdateHandler(AdobeUpdateHandler):
+    """Mac Adobe Update (.dmg)"""
+    name = 'adobemac'
+    default_template = 'ccupdatemacosx.bes'
+
+    def matches(self, importer, job):
+        info = job.fileinfo
+        return (importer.adobe and info['file_type'] == 'udif'
+                and info['file_is_local'])
+
+    def extract_adobe_info(self, importer, job):
+        try:
+            return self.extract_volume_adobe_info(job.file_path)
+        except (dmgfile.Error, hfsplus.Error), err:
+            if not DARWIN_FOUNDATION_AVAILABLE:
+                raise BigFixImportError("Unable to read Adobe CC Update disk image: %s" % err)
+            return self.extract_mounted_adobe_info(importer, job)
+
+    def extract_volume_adobe_info(self, file_path):
+        """Reads the Adobe metadata straight off the disk image, without mounting it."""
+        volume = dmgfile.openvolume(file_path)
+        try:
+            adobe_info = adobeutils.getAdobeSetupInfoFromArchive(volume, ignore_case=True)
+
+            adobepatchinstaller = ''
+            payloads_dir = None
+            for (path, dummy_dirs, dummy_files) in volume.walk():
+                if not adobepatchinstaller and path.endswith("AdobePatchInstaller.app"):
+                    setup_path = path + '/Contents/MacOS/AdobePatchInstaller'
+                    if volume.exists(setup_path):
+                        adobepatchinstaller = setup_path
+                if ('/' + path).endswith('/payloads'):
+                    payloads_dir = path
+            if payloads_dir is None:
+                raise BigFixImportError("No payloads folder in Adobe CC Update disk image")
+
+            # Some subdirs have spaces, so escape them
+            adobe_info['adobepatchinstaller'] = adobepatchinstaller.replace(' ', '\ ')
+
+            root = ET.fromstring(volume.read(payloads_dir + '/UpdateManifest.xml'))
+        except (ET.ParseError, ExpatError), err:
+            raise BigFixImportError(
+                "Unable to parse Adobe CC Update disk image metadata: %s" % err)
+        finally:
+            volume.close()
+
+        description = root.find('''.//Description/en_US''')
+        if description is None or description.text is None:
+            raise BigFixImportError("No description in Adobe CC Update manifest")
+        adobe_info['description'] = description.text.replace(u'\xa0', u' ')
+        return adobe_info
+
+    def extract_mounted_adobe_info(self, importer, job):
+        """Mounts the disk image to read its Adobe metadata."""
+        mounts = adobeutils.mountAdobeDmg(job.file_path)
 
-    # Mac Adobe Update (.dmg)
-    if file_mime == 'application/x-apple-diskimage' and file_is_local and DARWIN_FOUNDATION_AVAILABLE:
-        if args.template:
-            template = env.get_template(args.template)
-        else:
-            template = env.get_template('ccupdatemacosx.bes')
-        
-        mounts = adobeutils.mountAdobeDmg(file_path)
-    
         try:
             for mount in mounts:
                 adobe_info = adobeutils.getAdobeSetupInfo(mount)
@@ -535,140 +1063,1170 @@ elif args.adobe:
                 for (path, dummy_dirs, dummy_files) in os.walk(mount):
                     if path.endswith('/payloads'):
                         payloads_dir = path
-        
+
                 with open(os.path.join(payloads_dir, 'UpdateManifest.xml'), 'r') as setupfile:
                     root = ET.parse(setupfile).getroot()
                     adobe_info['description'] = root.find('''.//Description/en_US''').text.replace(u'\xa0', u' ')
         except:
-            print "Unable to find information in Adobe CC Update disk image!"
-            sys.exit(1)
-        finally:    
+            raise BigFixImportError("Unable to find information in Adobe CC Update disk image!")
+        finally:
             munkicommon.unmountdmg(mount)
-    
-    # Windows Adobe Update (.zip)
-    elif file_mime == 'application/zip' and file_is_local:
-        if args.template:
-            template = env.get_template(args.template)
+
+        return adobe_info
+
+@register_handler
+class AdobeWindowsUpdateHandler(AdobeUpdateHandler):
+    """Windows Adobe Update (.zip)"""
+    name = 'adobewindows'
+
+    def matches(self, importer, job):
+        info = job.fileinfo
+        return (importer.adobe and info['file_mime'] == 'application/zip'
+                and info['file_is_local'])
+
+    def select_template(self, importer, job):
+        if job.template_name:
+            return job.template_name
+
+        # Pick template based on '64bit' or '32bit' in file_path
+        if any(x in job.file_path for x in ['64Bit', '64bit', 'X64', 'x64']):
+            return 'ccupdatewindows64.bes'
+        elif any(x in job.file_path for x in ['32Bit', '32bit']):
+            return 'ccupdatewindows32.bes'
         else:
-            # Pick template based on '64bit' or '32bit' in file_path
-            if any(x in file_path for x in ['64Bit', '64bit', 'X64', 'x64']):
-                template = env.get_template('ccupdatewindows64.bes')
-            elif any(x in file_path for x in ['32Bit', '32bit']):
-                template = env.get_template('ccupdatewindows32.bes')
-            else:
-                template = env.get_template('ccupdatewindows.bes')
-    
-        zf = zipfile.ZipFile(file_path, 'r')
-        extractdir = os.path.join(tempfile.gettempdir(), file_name_noextension)
-    
-        for name in zf.namelist():
-            if not name.endswith('.zip') and not name.endswith('.exe'):
-                if name.endswith('Setup.xml') or name.endswith('setup.xml'):
-                    setup_xml = name
-                elif name.endswith('UpdateManifest.xml'):
-                    update_manifest = name
-                
-                (dirname, filename) = os.path.split(name)
-                zf.extract(name, extractdir)
-    
-        adobe_info = adobeutils.getAdobeSetupInfo(extractdir)
+            return 'ccupdatewindows.bes'
+
+    def extract_adobe_info(self, importer, job):
+        # Read the metadata straight out of the archive, without extracting it
+        adobe_info = adobeutils.getAdobeSetupInfoFromZip(job.file_path)
         adobe_info['adobepatchinstaller'] = 'AdobePatchInstaller.exe'
-    
+
+        zf = zipfile.ZipFile(job.file_path, 'r')
         try:
-            with open(os.path.join(extractdir, setup_xml), 'r') as setupfile:
-                root = ET.parse(setupfile).getroot()
+            setup_xml = None
+            for name in zf.namelist():
+                if not name.endswith('.zip') and not name.endswith('.exe'):
+                    if name.endswith('Setup.xml') or name.endswith('setup.xml'):
+                        setup_xml = name
+                    elif name.endswith('UpdateManifest.xml'):
+                        update_manifest = name
+
+            try:
+                root = ET.fromstring(zf.read(setup_xml))
                 adobe_info['display_name'] = root.find('''.//Media/Volume/Name''').text
-        except AttributeError:
-            pass # Can't find display name, so we'll get it from UpdateManifest next
-        
-        with open(os.path.join(extractdir, update_manifest), 'r') as manifestfile:
-            root = ET.parse(manifestfile).getroot()
+            except (AttributeError, KeyError):
+                pass # Can't find display name, so we'll get it from UpdateManifest next
+
+            root = ET.fromstring(zf.read(update_manifest))
             adobe_info['version'] = root.find('''.//UpdateID''').text
             adobe_info['description'] = root.find('''.//Description/en_US''').text.replace(u'\xa0', u' ')
-            
+
             # Failed to get display_name from Setup.xml, so look in UpdateManifest
             if not adobe_info.get('display_name') or [e in adobe_info.get('display_name') for e in ['_', '-'] if e in adobe_info.get('display_name')]:
                 adobe_info['display_name'] = root.find('''.//DisplayName/en_US''').text
-    
-        shutil.rmtree(extractdir)
-    
-    # Process Adobe Update
-    if 'adobe_info' in locals():
-        
-        # Get direct download link from url file
-        with open('.'.join([file_path, 'url']), 'r') as url_file:
-            adobe_info['url'] = url_file.readline()
-        
-        # Trim description
-        if ':' in adobe_info['description']:
-            adobe_info['description'] = adobe_info['description'].split(' : ', 1)[-1]
-        
-        # Sanitize and workaround Adobe naming inconsistency
-        adobe_info['name'] = ''.join(adobe_info['display_name'].split('.')[0])
-        if 'Flash' in adobe_info['display_name'] and 'Professional ' in adobe_info['display_name']:
-            adobe_info['display_name'] = adobe_info['display_name'].replace('Professional ', '')
-            adobe_info['name'] = adobe_info['display_name']
-        if not adobe_info['display_name'].startswith('Adobe '):
-            adobe_info['display_name'] = "Adobe %s" % adobe_info['name']
-        if adobe_info['name'] == 'Adobe Illustrator CC 2014':
-            adobe_info['name'] = 'Adobe Illustrator'
+        finally:
+            zf.close()
 
-        # Determine base version
-        adobe_info['base_version'] = "%s.0.0" % adobe_info['version'].split('.')[0]
-    
-        adobe_info['base_file_name'] = base_file_name
-        adobe_info.update(get_env_source_mime_data())
-        adobe_info.update(get_sha_size(file_path))
-    
-        # Update with input variables
-        if cli_values:
-            adobe_info.update(cli_values)
+        return adobe_info
 
-        # Update with calculated values
-        if calc_values:
-            pkginfo.update(calc_values)
+@register_handler
+class CustomTemplateHandler(ImportHandler):
+    """Custom Task"""
+    name = 'custom'
+    priority = 100
 
-        # Render new task
-        rendered_template = template.render(**adobe_info)
+    def matches(self, importer, job):
+        return bool(job.template_name) and not importer.adobe
+
+    def extract(self, importer, job):
+        return {}
 
 # -----------------------------------------------------------------------------
-# Custom Task
+# Templates
 # -----------------------------------------------------------------------------
 
-elif args.template:
-    task_info = {}
-    
-    # Update with calculated values
-    if calc_values:
-        task_info.update(calc_values)
+class CompiledTemplateLoader(object):
+    """
+    Jinja2 loader that prefers templates precompiled by compile-templates,
+    falling back to the source loader whenever a .bes file is newer than its
+    compiled module.
+    """
 
-    # Use named template
-    template = env.get_template(args.template)
-    
-    # Update with input variables
-    if cli_values:
-        task_info.update(cli_values)
+    def __init__(self, compiled_path, source_loader):
+        from jinja2 import ModuleLoader
+        self.compiled_path = compiled_path
+        self.compiled_loader = ModuleLoader(compiled_path)
+        self.source_loader = source_loader
+
+    def get_source(self, environment, template):
+        return self.source_loader.get_source(environment, template)
 
-    # Render new task
-    rendered_template = template.render(**task_info)
+    def list_templates(self):
+        return self.source_loader.list_templates()
+
+    def source_mtime(self, name):
+        for searchpath in self.source_loader.searchpath:
+            path = os.path.join(searchpath, *name.split('/'))
+            if os.path.isfile(path):
+                return os.path.getmtime(path)
+        return None
+
+    def load(self, environment, name, globals=None):
+        # compile-templates writes byte-compiled .pyc modules
+        compiled = os.path.join(self.compiled_path, self.compiled_loader.get_module_filename(name) + 'c')
+        source_mtime = self.source_mtime(name)
+        if (source_mtime is not None and os.path.isfile(compiled)
+                and os.path.getmtime(compiled) >= source_mtime):
+            return self.compiled_loader.load(environment, name, globals)
+        return self.source_loader.load(environment, name, globals)
+
+def build_environment(template_paths, bytecode_cache=None, compiled_path=None):
+    """
+    Returns a Jinja2 environment for template_paths. Parsed templates are
+    kept in bytecode_cache, a directory, and precompiled templates in
+    compiled_path are used when they are up to date.
+    """
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+    loader = FileSystemLoader(template_paths)
+    if compiled_path and os.path.isdir(compiled_path):
+        loader = CompiledTemplateLoader(compiled_path, loader)
+
+    cache = None
+    if bytecode_cache:
+        if not os.path.isdir(bytecode_cache):
+            os.makedirs(bytecode_cache)
+        cache = FileSystemBytecodeCache(bytecode_cache)
+
+    return Environment(loader=loader, bytecode_cache=cache)
+
+def compile_templates(importer):
+    """Compiles every .bes template into importer.template_modules."""
+    env = build_environment(importer.template_paths)
+    env.compile_templates(importer.template_modules, zip=None, py_compile=True,
+                          filter_func=lambda name: name.endswith('.bes'))
+    print "Compiled templates into %s" % importer.template_modules
+
+def benchmark_templates(importer, iterations=10000):
+    """
+    Prints how long each shipped template takes to load from source, from
+    the bytecode cache and from compiled modules, and to render
+    `iterations` times.
+    """
+    import timeit
+
+    loads = max(1, iterations / 100)
+    setups = [('source', lambda: build_environment(importer.template_paths)),
+              ('bytecode', lambda: build_environment(importer.template_paths,
+                                                     importer.template_cache))]
+    if os.path.isdir(importer.template_modules):
+        setups.append(('compiled', lambda: build_environment(importer.template_paths,
+                                                             compiled_path=importer.template_modules)))
+
+    print "%-35s %12s %12s %12s %12s" % ('template', 'source ms', 'bytecode ms', 'compiled ms', 'render us')
+    for name in build_environment(importer.template_paths).list_templates(filter_func=lambda n: n.endswith('.bes')):
+        timings = {}
+        for (label, make_env) in setups:
+            # Warm the bytecode cache before timing it
+            make_env().get_template(name)
+            timings[label] = timeit.timeit(lambda: make_env().get_template(name), number=loads) / loads * 1000
+
+        template = build_environment(importer.template_paths).get_template(name)
+        render = timeit.timeit(template.render, number=iterations) / iterations * 1000000
+
+        print "%-35s %12.3f %12.3f %12s %12.1f" % (name, timings['source'], timings['bytecode'],
+                                                    '%.3f' % timings['compiled'] if 'compiled' in timings else '-',
+                                                    render)
 
 # -----------------------------------------------------------------------------
-# Import Into Console Site
+# Importer
 # -----------------------------------------------------------------------------
 
-if 'rendered_template' in locals():
-    print rendered_template
+class Importer(object):
+    """
+    Runs ImportJobs through the classify -> extract -> render -> post
+    stages. The template environment and the BigFix connection are created
+    on first use and reused for every job, so one Importer can process any
+    number of files.
+    """
+
+    def __init__(self, config=None, adobe=False, package=False, verbosity=0,
+                 template_paths=None, stream=None, gzip=None, force=False):
+        if config is None:
+            config = read_config()
+        self.config = config
+        self.adobe = adobe
+        self.package = package
+        self.verbosity = verbosity
+        self.template_paths = template_paths or TEMPLATE_PATHS
+
+        if config.has_option('bigfiximport', 'BES_DEFAULTSITE'):
+            self.default_site = config.get('bigfiximport', 'BES_DEFAULTSITE')
+        else:
+            self.default_site = "master"
+
+        if config.has_option('bigfiximport', 'HASH_CHUNK_SIZE'):
+            self.hash_chunk_size = config.getint('bigfiximport', 'HASH_CHUNK_SIZE')
+        else:
+            self.hash_chunk_size = digests.CHUNK_SIZE
+
+        # munkilib leaves the persistent digest cache off; opt in to it here.
+        # Set DIGEST_CACHE to an empty value to disable it
+        if config.has_option('bigfiximport', 'DIGEST_CACHE'):
+            digest_cache = os.path.expanduser(config.get('bigfiximport', 'DIGEST_CACHE'))
+        else:
+            digest_cache = digests.CACHE_PATH
+        if config.has_option('bigfiximport', 'DIGEST_CACHE_SIZE'):
+            digest_cache_size = config.getint('bigfiximport', 'DIGEST_CACHE_SIZE')
+        else:
+            digest_cache_size = digests.CACHE_MAX_ENTRIES
+        digests.setcache(digest_cache, digest_cache_size)
+
+        if 'besarchiver' in config.sections():
+            self.verbose = config.getboolean('besarchiver', 'VERBOSE')
+        else:
+            self.verbose = True
+
+        # Jinja2 bytecode cache; set TEMPLATE_CACHE to an empty value to disable it
+        if config.has_option('bigfiximport', 'TEMPLATE_CACHE'):
+            self.template_cache = os.path.expanduser(config.get('bigfiximport', 'TEMPLATE_CACHE'))
+        else:
+            self.template_cache = TEMPLATE_CACHE_DIR
+
+        # Templates precompiled by 'bigfiximport.py compile-templates'
+        if config.has_option('bigfiximport', 'TEMPLATE_MODULES'):
+            self.template_modules = os.path.expanduser(config.get('bigfiximport', 'TEMPLATE_MODULES'))
+        else:
+            self.template_modules = TEMPLATE_MODULES_DIR
+
+        # Send tasks as a chunked, optionally gzipped, request body
+        if stream is None and config.has_option('bigfiximport', 'STREAM_POSTS'):
+            stream = config.getboolean('bigfiximport', 'STREAM_POSTS')
+        self.stream = bool(stream)
+        if gzip is None and config.has_option('bigfiximport', 'GZIP_POSTS'):
+            gzip = config.getboolean('bigfiximport', 'GZIP_POSTS')
+        self.gzip = bool(gzip)
+
+        # Index of imported tasks; set TASK_INDEX to an empty value to disable it
+        if config.has_option('bigfiximport', 'TASK_INDEX'):
+            task_index = os.path.expanduser(config.get('bigfiximport', 'TASK_INDEX'))
+        else:
+            task_index = TASK_INDEX_PATH
+        self.task_index = TaskIndex(task_index) if task_index else None
+        self.force = bool(force)
+
+        self._env = None
+        self._connection = None
+
+    def __getstate__(self):
+        # Worker processes build their own environment, connection and index
+        state = self.__dict__.copy()
+        state['_env'] = None
+        state['_connection'] = None
+        if self.task_index is not None:
+            state['task_index'] = TaskIndex(self.task_index.path)
+        return state
+
+    @property
+    def env(self):
+        """The Jinja2 template environment."""
+        if self._env is None:
+            self._env = build_environment(self.template_paths, self.template_cache,
+                                          self.template_modules)
+        return self._env
+
+    @property
+    def connection(self):
+        """The BigFixSession to the root server."""
+        if self._connection is None:
+            options = {}
+            for (option, key, getter) in [('BES_VERIFY', 'verify', self.config.getboolean),
+                                          ('POOL_SIZE', 'pool_size', self.config.getint),
+                                          ('RETRIES', 'retries', self.config.getint),
+                                          ('BACKOFF', 'backoff', self.config.getfloat)]:
+                if self.config.has_option('bigfiximport', option):
+                    options[key] = getter('bigfiximport', option)
+
+            self._connection = BigFixSession(
+                self.config.get('besapi', 'BES_USER_NAME'),
+                self.config.get('besapi', 'BES_PASSWORD'),
+                self.config.get('besapi', 'BES_ROOT_SERVER'),
+                **options)
+        return self._connection
+
+    def classify(self, job):
+        """Gathers the name and type information handlers dispatch on."""
+        job.fileinfo = classify_file(job.file_path)
+        return job
+
+    def find_handler(self, job):
+        """Returns the first registered handler that matches the job."""
+        for handler in HANDLERS:
+            if handler.matches(self, job):
+                return handler
+        return None
+
+    def extract(self, job):
+        """
+        Collects the template values for a job. job.info stays None if no
+        handler produces anything for the file.
+        """
+        if job.fileinfo is None:
+            self.classify(job)
+
+        handler = self.find_handler(job)
+        if handler is None:
+            return job
+        job.handler = handler.name
+
+        info = handler.extract(self, job)
+        if info is None:
+            return job
+
+        # Update with calculated values
+        if DARWIN_FOUNDATION_AVAILABLE and job.fileinfo['file_is_local']:
+            url = getkMDItemWhereFroms(job.file_path, None)
+            if url:
+                # a link the handler found itself (the Adobe .url file)
+                # is the direct one; keep it
+                info.setdefault('url', url)
+
+        # Update with input variables
+        if job.values:
+            info.update(job.values)
+
+        job.template = handler.select_template(self, job)
+        job.info = info
+        return job
+
+    def render(self, job):
+        """Renders the job's template with its extracted values."""
+        if job.info is not None:
+            template = self.env.get_template(job.template)
+            job.rendered = template.render(**job.info)
+        return job
+
+    def run(self, job, render=True):
+        """
+        Runs the classify, extract and render stages for a job. Rendering
+        can be left to post() when streaming.
+        """
+        self.classify(job)
+        self.extract(job)
+        if render:
+            self.render(job)
+        return job
+
+    def chunks(self, job):
+        """
+        Returns the job's task as an iterable of unicode chunks: the rendered
+        task if there is one, otherwise the template's output as it renders.
+        """
+        if job.rendered is not None:
+            return [job.rendered]
+        return self.env.get_template(job.template).generate(**job.info)
+
+    def body(self, job):
+        """
+        Yields the job's task as encoded chunks of about STREAM_CHUNK_SIZE
+        bytes, gzip compressed if enabled.
+        """
+        return stream_chunks(self.chunks(job), STREAM_CHUNK_SIZE, self.gzip)
+
+    def send(self, method, path, chunks):
+        """
+        Sends a task document, given as a callable returning unicode chunks,
+        to path. When streaming, the request body is sent chunked as it is
+        produced; otherwise it is joined and sent in one piece.
+        """
+        if self.stream:
+            headers = {'Content-Type': 'application/xml'}
+            if self.gzip:
+                headers['Content-Encoding'] = 'gzip'
+            return self.connection.request(method, path, headers=headers,
+                data=lambda: stream_chunks(chunks(), STREAM_CHUNK_SIZE, self.gzip))
+        return self.connection.request(method, path, data=u''.join(chunks()).encode('utf-8'))
+
+    def check_index(self, job, site):
+        """
+        Looks the job up in the task index. Returns the index entry for an
+        existing task with the same installer, or None. Sets job.action to
+        'unchanged' if that task was imported from identical values.
+        """
+        if self.task_index is None or self.force or not job.info or not job.info.get('sha256'):
+            return None
+
+        entry = self.task_index.get(site, job.info['sha256'])
+        if entry is not None and entry['task_hash'] == task_hash(job):
+            job.action = 'unchanged'
+            job.task_name = entry['task_name']
+            job.task_id = entry['task_id']
+        return entry
+
+    def record_index(self, job, site):
+        """Remembers an imported job in the task index."""
+        if self.task_index is not None and job.task_id and job.info and job.info.get('sha256'):
+            self.task_index.put(site, job.info['sha256'], job.task_id, job.task_name,
+                                job.template, task_hash(job))
+
+    def post(self, job, site=None):
+        """
+        Imports a job into tasks/<site>. If the task index knows a task for
+        the same installer, that task is updated instead, or left alone if
+        nothing changed.
+        """
+        site = site or self.default_site
+        entry = self.check_index(job, site)
+        if job.action == 'unchanged':
+            return job
+
+        if job.rendered is None and not self.stream:
+            self.render(job)
+
+        if entry is not None:
+            job.task = self.send('PUT', 'task/%s/%s' % (site, entry['task_id']), lambda: self.chunks(job))
+            if not job.task.ok:
+                if job.task.status_code == 404:
+                    # deleted in the console; the next import creates it again
+                    self.task_index.remove_tasks(site, [entry['task_id']])
+                return self.fail(job, "Unable to update task %s: %s"
+                                 % (entry['task_id'], response_error(job.task)))
+            job.task_name = task_summary(job.task)[0] or entry['task_name']
+            job.task_id = entry['task_id']
+            job.action = 'updated'
+        else:
+            try:
+                job.task = self.send('POST', 'tasks/%s' % site, lambda: self.chunks(job))
+            except IOError, err:
+                # requests' ConnectionError; the task may have been created
+                self.recover_posts([job], site, "Unable to create task: %s" % err)
+                return job
+            if not job.task.ok:
+                error = "Unable to create task: %s" % response_error(job.task)
+                if job.task.status_code in BigFixSession.RETRY_STATUS_CODES:
+                    self.recover_posts([job], site, error)
+                    return job
+                return self.fail(job, error)
+            (job.task_name, job.task_id) = task_summary(job.task)
+            job.action = 'created'
+
+        self.record_index(job, site)
+        return job
+
+    def fail(self, job, error):
+        """Marks a job whose import was rejected, leaving the task index alone."""
+        job.action = 'failed'
+        job.error = error
+        return job
+
+    def recover_posts(self, jobs, site, error):
+        """
+        Handles a POST that failed after it may have reached the server
+        (a 5xx or a dropped connection). Rather than risk creating the
+        tasks twice, the task index is refreshed from tasks/<site>, and
+        jobs whose installer now has a task are marked created. The rest
+        are marked failed with error.
+        """
+        refreshed = False
+        if self.task_index is not None:
+            try:
+                refresh_task_index(self, site)
+                refreshed = True
+            except (BigFixImportError, IOError), err:
+                error = "%s (and unable to check for the task: %s)" % (error, err)
+
+        for job in jobs:
+            entry = None
+            if refreshed and job.info and job.info.get('sha256'):
+                entry = self.task_index.get(site, job.info['sha256'])
+            if entry is None:
+                self.fail(job, error)
+                continue
+            job.task_name = entry['task_name']
+            job.task_id = entry['task_id']
+            job.action = 'created'
+            self.record_index(job, site)
+        return jobs
+
+    def post_bundle(self, jobs, site=None):
+        """
+        Imports several jobs into tasks/<site> with one request, packing
+        their Task elements into a single BES document. The IDs in the
+        response are assigned back to the jobs in order. Jobs the task index
+        already knows about are updated or skipped individually.
+        """
+        site = site or self.default_site
+        new_jobs = []
+        for job in jobs:
+            if self.check_index(job, site) is None:
+                new_jobs.append(job)
+            elif job.action != 'unchanged':
+                self.post(job, site)
+
+        if not new_jobs:
+            return jobs
+
+        for job in new_jobs:
+            if job.rendered is None:
+                self.render(job)
+        document = bundle_tasks([job.rendered for job in new_jobs])
+
+        try:
+            result = self.send('POST', 'tasks/%s' % site, lambda: [document])
+        except IOError, err:
+            # requests' ConnectionError; the tasks may have been created
+            self.recover_posts(new_jobs, site, "Unable to create task: %s" % err)
+            return jobs
+        if not result.ok:
+            error = "Unable to create task: %s" % response_error(result)
+            for job in new_jobs:
+                job.task = result
+            if result.status_code in BigFixSession.RETRY_STATUS_CODES:
+                self.recover_posts(new_jobs, site, error)
+            else:
+                for job in new_jobs:
+                    self.fail(job, error)
+            return jobs
+
+        created = parse_task_results(result)
+        created += [(None, None)] * (len(new_jobs) - len(created))
+        for job, (name, task_id) in zip(new_jobs, created):
+            job.task = result
+            if task_id is None:
+                self.fail(job, "No task ID returned")
+                continue
+            job.task_name = name
+            job.task_id = task_id
+            job.action = 'created'
+            self.record_index(job, site)
+        return jobs
+
+    def extract_all(self, jobs, processes=1):
+        """
+        Classifies and extracts a list of jobs, yielding them in order as
+        they finish. With more than one process, extraction runs in a pool.
+        Jobs no handler matches are passed straight through instead of
+        being sent to a worker. A job that fails has its error set instead
+        of stopping the others.
+        """
+        for job in jobs:
+            if job.fileinfo is None:
+                self.classify(job)
+        handled = [job for job in jobs if self.find_handler(job) is not None]
+
+        pool = None
+        if processes > 1 and len(handled) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(min(processes, len(handled)), _init_worker, (self,))
+            extracted_jobs = pool.imap(_extract_job, handled)
+        else:
+            extracted_jobs = itertools.imap(lambda job: _extract_job(job, self), handled)
+
+        try:
+            handled_ids = set(id(job) for job in handled)
+            for job in jobs:
+                if id(job) in handled_ids:
+                    yield extracted_jobs.next()
+                else:
+                    yield job
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+_WORKER_IMPORTER = None
+
+def _init_worker(importer):
+    global _WORKER_IMPORTER
+    _WORKER_IMPORTER = importer
+
+def _extract_job(job, importer=None):
+    """
+    Extracts the metadata for one job. Any failure is stored on the job
+    instead of raised, so one unreadable file doesn't stop a batch.
+    """
+    importer = importer or _WORKER_IMPORTER
+    try:
+        importer.extract(job)
+    except (Exception, SystemExit), err:
+        job.error = str(err) or err.__class__.__name__
+    return job
+
+def parse_variables(variables):
+    """Turns a list of key=value strings into a dictionary."""
+    values = {}
+    for arg in variables:
+        (key, sep, value) = arg.partition("=")
+        if sep != "=":
+            print "Invalid variable [key=value]: %s" % arg
+            sys.exit(1)
+        values[key] = value
+    return values
+
+def classify_file(file_path):
+    """
+    Gathers the name and type information the handlers dispatch on. The
+    file type comes from the file's contents (see munkilib.filetypes); the
+    MIME type is only guessed from the name when the contents aren't
+    recognized.
+    """
+    descriptor = filetypes.classify(file_path)
+    file_mime, file_encoding = guess_file_type(file_path)
+    if descriptor['mime']:
+        file_mime = descriptor['mime']
+    file_name = os.path.basename(file_path)
+    file_name_noextension, file_extension = os.path.splitext(file_name)
+
+    return {
+                'file_path'             : file_path,
+                'file_type'             : descriptor['type'],
+                'file_size'             : descriptor['size'],
+                'file_mime'             : file_mime,
+                'file_encoding'         : file_encoding,
+                'file_is_local'         : os.path.isfile(file_path),
+                'file_name_isfolder'    : os.path.isdir(file_path),
+                'file_name'             : file_name,
+                'file_name_noextension' : file_name_noextension,
+                'file_extension'        : file_extension,
+                'base_file_name'        : file_name.split('-')[0].split('.')[0]
+            }
+
+def import_task(importer, job, preview=False):
+    """
+    Imports a task into the console site on request, showing the rendered
+    task first if preview is set.
+    """
+    if preview:
+        if job.rendered is None:
+            importer.render(job)
+        print job.rendered
+    else:
+        print "%s: %s" % (job.file_path, job.template)
+
+    to_import = raw_input('Import into tasks/%s [y or n]: ' % importer.default_site)
+    if to_import and to_import.lower() in ['y', 'yes']:
+        importer.post(job)
+
+    # Reporting Output
+    new_task = job.task
+    if job.action == 'failed':
+        print "\nUnable to import %s: %s" % (job.file_path, job.error)
+    elif job.action == 'unchanged':
+        print "\nUnchanged Task: %s - %s" % (job.task_name, job.task_id)
+    elif new_task is not None:
+        if job.task_id is not None:
+            print "\n%s Task: %s - %s" % ('Updated' if job.action == 'updated' else 'New',
+                                         job.task_name, job.task_id)
+        else:
+            print new_task.text
+
+    return new_task
+
+def import_bundle(importer, jobs, preview=False):
+    """
+    Imports several tasks into the console site with a single request,
+    after one confirmation for the whole bundle.
+    """
+    for job in jobs:
+        if preview:
+            if job.rendered is None:
+                importer.render(job)
+            print job.rendered
+        else:
+            print "%s: %s" % (job.file_path, job.template)
 
-    to_import = raw_input('Import into tasks/%s [y or n]: ' % BES_DEFAULTSITE)
+    to_import = raw_input('Import %d tasks into tasks/%s [y or n]: ' % (len(jobs), importer.default_site))
     if to_import and to_import.lower() in ['y', 'yes']:
-        new_task = B.post('tasks/%s' % BES_DEFAULTSITE, rendered_template)
+        importer.post_bundle(jobs)
+
+        # Reporting Output
+        labels = {'created': 'New', 'updated': 'Updated', 'unchanged': 'Unchanged'}
+        for job in jobs:
+            if job.action == 'failed':
+                print "Unable to import %s: %s" % (job.file_path, job.error)
+                if job.task is not None and job.task.text:
+                    print job.task.text
+            else:
+                print "%s Task: %s - %s (%s)" % (labels[job.action], job.task_name, job.task_id, job.file_path)
+
+    return jobs
+
+# Splits a rendered BES document into its opening tag, content and closing tag
+BES_DOCUMENT = re.compile(r'^(.*?<BES\b[^>]*>)(.*)(</BES>\s*)$', re.S)
+
+def bundle_tasks(documents):
+    """
+    Combines rendered BES documents into a single BES document holding all
+    of their Task elements. The documents are spliced as text so CDATA
+    sections are sent exactly as rendered.
+    """
+    header = None
+    contents = []
+    for document in documents:
+        match = BES_DOCUMENT.match(document)
+        if not match:
+            raise BigFixImportError("Rendered task is not a BES document")
+        if header is None:
+            header = match.group(1)
+        contents.append(match.group(2).strip('\n'))
+    return u'%s\n%s\n</BES>\n' % (header, u'\n'.join(contents))
+
+def parse_task_results(result):
+    """
+    Returns a list of (name, id) tuples for every item created by a post,
+    in the order the server lists them.
+    """
+    try:
+        root = ET.fromstring(result.content)
+    except (ET.ParseError, AttributeError):
+        return []
+
+    created = []
+    for element in root:
+        if element.find('ID') is not None:
+            created.append((element.findtext('Name'), element.findtext('ID')))
+    return created
+
+def stream_chunks(chunks, chunk_size=STREAM_CHUNK_SIZE, compress=False):
+    """
+    Joins an iterable of unicode template output into UTF-8 encoded chunks
+    of about chunk_size bytes, gzip compressing them if asked.
+    """
+    compressor = None
+    if compress:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffered.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            data = ''.join(buffered)
+            buffered = []
+            size = 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = ''.join(buffered)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+def task_summary(new_task):
+    """Returns the (name, id) of a task returned by a post, or (None, None)."""
+    created = parse_task_results(new_task)
+    if created:
+        return created[0]
+    return (None, None)
+
+# -----------------------------------------------------------------------------
+# Batch Import
+# -----------------------------------------------------------------------------
+
+def read_batch_manifest(manifest_path):
+    """
+    Reads a JSON or CSV batch manifest into a list of
+    (file_path, template_name, values) entries.
+
+    JSON manifests are a list of file paths or of objects with 'path' and
+    optional 'template' and 'key' (a dict of variables) members. CSV
+    manifests need a 'path' column, may have a 'template' column, and any
+    other columns become template variables.
+    """
+    entries = []
+    manifest_dir = os.path.dirname(manifest_path)
+
+    if manifest_path.lower().endswith('.json'):
+        with open(manifest_path, 'r') as manifest_file:
+            for item in json.load(manifest_file):
+                if isinstance(item, basestring):
+                    item = {'path': item}
+                entries.append((item['path'], item.get('template'),
+                                dict(item.get('key', {}))))
+    else:
+        with open(manifest_path, 'rb') as manifest_file:
+            for row in csv.DictReader(manifest_file):
+                row = dict((k.strip(), v.strip()) for k, v in row.items() if k and v)
+                item_path = row.pop('path')
+                template_name = row.pop('template', None)
+                entries.append((item_path, template_name, row))
+
+    # Paths in a manifest are relative to the manifest itself
+    return [(os.path.join(manifest_dir, p), t, v) for (p, t, v) in entries]
+
+def expand_batch_source(source):
+    """
+    Expands a directory, glob pattern or manifest into a list of
+    (file_path, template_name, values) entries.
+    """
+    if os.path.isdir(source) and os.path.splitext(source)[1] != '.mpkg':
+        paths = [os.path.join(source, name) for name in sorted(os.listdir(source))]
+    elif os.path.isfile(source) and os.path.splitext(source)[1].lower() in ['.json', '.csv']:
+        return read_batch_manifest(source)
+    else:
+        paths = sorted(glob.glob(source))
+
+    # Skip hidden files and the Adobe '.url' sidecar files
+    return [(p, None, {}) for p in paths
+            if not os.path.basename(p).startswith('.') and not p.endswith('.url')]
+
+def run_batch(importer, source, cli_values, template_name=None, jobs=1, preview=False,
+              bundle_size=1):
+    """
+    Imports every installer found in source with a single Importer. All
+    files are classified before any of them is processed. Metadata
+    extraction runs in a pool of up to `jobs` processes, while rendering
+    and importing stay in order. With a bundle_size above one, tasks are
+    imported that many at a time in a single request.
+    """
+    work = []
+    for (item_path, item_template, item_values) in expand_batch_source(source):
+        values = dict(cli_values)
+        values.update(item_values)
+        work.append(importer.classify(ImportJob(item_path, item_template or template_name, values)))
+
+    if importer.verbosity > 0:
+        for job in work:
+            print "%s: %s (%s)" % (job.file_path, job.fileinfo['file_type'], job.fileinfo['file_mime'])
+
+    results = []
+    bundle = []
+    for job in importer.extract_all(work, jobs):
+        if job.error is not None:
+            print "Unable to import %s: %s" % (job.file_path, job.error)
+        elif job.info is None:
+            print "No handler for %s, skipping" % job.file_path
+        elif bundle_size > 1:
+            bundle.append(job)
+            if len(bundle) >= bundle_size:
+                import_bundle(importer, bundle, preview)
+                bundle = []
+        else:
+            import_task(importer, job, preview)
+        results.append(job)
+
+    if bundle:
+        import_bundle(importer, bundle, preview)
+
+    return results
+
+# -----------------------------------------------------------------------------
+# Import Service
+# -----------------------------------------------------------------------------
+
+class ImportService(object):
+    """
+    Keeps one warm Importer and feeds it jobs from a bounded queue using a
+    fixed number of worker threads. Jobs are submitted and inspected
+    through ImportRequestHandler.
+    """
+
+    def __init__(self, importer, workers=2, queue_size=100, history=1000):
+        self.importer = importer
+        self.workers = workers
+        self.history = history
+        self.queue = Queue.Queue(queue_size)
+        self.records = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        self.threads = []
+
+    def start(self):
+        """Starts the worker threads."""
+        for dummy_index in range(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, request):
+        """
+        Queues an import described by a request dictionary with 'path' and
+        optional 'template', 'key', 'post' and 'site' members. Returns the
+        job record, or None if the queue is full.
+        """
+        job = ImportJob(request['path'], request.get('template'), request.get('key'))
+        record = {
+                    'id'    : next(self.counter),
+                    'state' : 'queued',
+                    'path'  : job.file_path,
+                    'post'  : bool(request.get('post')),
+                    'site'  : request.get('site') or self.importer.default_site
+                 }
+        try:
+            self.queue.put_nowait((record, job))
+        except Queue.Full:
+            return None
+
+        with self.lock:
+            self.records[record['id']] = record
+            while len(self.records) > self.history:
+                self.records.popitem(last=False)
+        return record
+
+    def get(self, job_id):
+        """Returns a copy of a job record, or None."""
+        with self.lock:
+            record = self.records.get(job_id)
+            return dict(record) if record else None
+
+    def list(self):
+        """Returns copies of all remembered job records."""
+        with self.lock:
+            return [dict(record) for record in self.records.values()]
+
+    def update(self, record, **values):
+        with self.lock:
+            record.update(values)
+
+    def work(self):
+        """Worker thread loop."""
+        while True:
+            (record, job) = self.queue.get()
+            self.update(record, state='running')
+            try:
+                self.importer.run(job, render=not self.importer.stream)
+                if job.info is None:
+                    self.update(record, state='skipped', error='No handler for file')
+                    continue
+
+                # records are kept for the last `history` jobs, so they hold
+                # only a summary of each job and never the rendered task
+                self.update(record, handler=job.handler, template=job.template)
+                if record['post']:
+                    self.importer.post(job, record['site'])
+                    if job.action == 'failed':
+                        self.update(record, state='failed', error=job.error)
+                        continue
+                    self.update(record, task_name=job.task_name, task_id=job.task_id,
+                                action=job.action)
+                self.update(record, state='done')
+            except (Exception, SystemExit), err:
+                self.update(record, state='failed', error=str(err) or err.__class__.__name__)
+            finally:
+                self.queue.task_done()
+
+class ImportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    JSON interface to an ImportService:
+
+        POST /jobs        queue a job, returns its record
+        GET  /jobs        list job records
+        GET  /jobs/<id>   a single job record
+        GET  /stats       REST request latencies
+    """
+
+    def send_json(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/jobs':
+            self.send_json(200, self.server.service.list())
+        elif path == '/stats':
+            connection = self.server.service.importer._connection
+            self.send_json(200, connection.latency_summary() if connection else {'count': 0})
+        elif path.startswith('/jobs/') and path[6:].isdigit():
+            record = self.server.service.get(int(path[6:]))
+            if record is None:
+                self.send_json(404, {'error': 'Unknown job'})
+            else:
+                self.send_json(200, record)
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.getheader('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length))
+            request['path']
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {'error': 'Expected a JSON object with a path'})
+            return
+
+        record = self.server.service.submit(request)
+        if record is None:
+            self.send_json(503, {'error': 'Queue is full'})
+        else:
+            self.send_json(202, record)
+
+    def log_message(self, format, *args):
+        if self.server.service.importer.verbosity > 0:
+            sys.stderr.write("%s\n" % (format % args))
+
+class ImportHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
 
-# Reporting Output
-if 'new_task' in locals(): 
+class ImportUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def is_loopback(host):
+    """Returns True if host names or resolves to a loopback address."""
+    host = host.strip('[]')
+    if host in ('localhost', '::1'):
+        return True
     try:
-        if len(new_task()):
-            print "\nNew Task: %s - %s" % (str(new_task().Task.Name), str(new_task().Task.ID))
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+def serve(importer, listen, workers=2, queue_size=100):
+    """
+    Runs an ImportService until interrupted. listen is either host:port for
+    localhost HTTP or the path of a Unix socket.
+
+    The service has no authentication and queues imports that post to the
+    BigFix server with the configured credentials, so HTTP is only served
+    on loopback addresses; use a Unix socket's permissions to share it.
+    """
+    if ':' in listen:
+        (host, port) = listen.rsplit(':', 1)
+        if not is_loopback(host):
+            raise BigFixImportError("Refusing to serve on %s: serve mode has no "
+                                    "authentication and only listens on loopback "
+                                    "addresses" % listen)
+
+    service = ImportService(importer, workers, queue_size)
+    service.start()
+
+    if ':' in listen:
+        server = ImportHTTPServer((host, int(port)), ImportRequestHandler)
+    else:
+        if os.path.exists(listen):
+            os.unlink(listen)
+        server = ImportUnixHTTPServer(listen, ImportRequestHandler)
+    server.service = service
+
+    print "Listening on %s with %d workers" % (listen, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if ':' not in listen and os.path.exists(listen):
+            os.unlink(listen)
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+def build_parser():
+    """Returns the command-line argument parser."""
+    parser = argparse.ArgumentParser(description='bigfiximport')
+    parser.add_argument('-v', '--verbose', action='count', dest='verbosity',
+                        help='increase output verbosity', default=0)
+    parser.add_argument('--adobe', action='store_true', default=False,
+                        help='process an Adobe CC update file')
+    parser.add_argument('--copyfromdmg', action='store_true', default=False,
+                        help='process an OS X copy from dmg installer')
+    parser.add_argument('--package', action='store_true', default=False,
+                        help='process an OS X package installer')
+    parser.add_argument('--key', action='append', dest='variables',
+                          default=[], help='Provide key=value pairs for input.'),
+    parser.add_argument('--template', action='store', dest='template',
+                          default=[], help='Use an alternative template.'),
+    parser.add_argument('--preview', action='store_true', default=False,
+                        help='Print each rendered task before asking to import it.')
+    parser.add_argument('--stream', action='store_true', default=False,
+                        help='Stream rendered tasks to the server as a chunked request body.')
+    parser.add_argument('--gzip', action='store_true', default=False,
+                        help='Gzip compress streamed request bodies.')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Import new tasks even if the task index already has one for the file.')
+    parser.add_argument('--batch', action='store', dest='batch', default=None,
+                        help='Import every installer in a directory, glob, or JSON/CSV manifest.')
+    parser.add_argument('--bundle-size', action='store', dest='bundle_size', type=int, default=None,
+                        help='Number of tasks to import per request in batch mode.')
+    parser.add_argument('--jobs', action='store', dest='jobs', type=int, default=1,
+                        help='Number of files to extract metadata from in parallel in batch mode.')
+    parser.add_argument('--listen', action='store', dest='listen', default='127.0.0.1:52380',
+                        help='Loopback host:port or Unix socket path for serve mode.')
+    parser.add_argument('--workers', action='store', dest='workers', type=int, default=2,
+                        help='Number of import workers in serve mode.')
+    parser.add_argument('--queue-size', action='store', dest='queue_size', type=int, default=100,
+                        help='Maximum number of queued jobs in serve mode.')
+    parser.add_argument('--iterations', action='store', dest='iterations', type=int, default=10000,
+                        help='Number of renders per template for benchmark-templates.')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    return parser
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    args, extra_args = build_parser().parse_known_args(argv[1:])
+
+    # Verbose environment output
+    if args.verbosity > 1:
+        for p in ['PLATFORM', 'MUNKILIB_AVAILABLE', 'DARWIN_FOUNDATION_AVAILABLE', 'HACHOIR_AVAILABLE']:
+            print "%s: %s" % (p, globals()[p])
+
+        for (label, version) in sorted(get_versions().items()):
+            print "%s version: %s" % (label, version)
+
+        print '\nNumber of arguments:', len(argv), 'arguments.'
+        print 'Argument List:', str(argv)
+
+    # Add command-line variables
+    cli_values = parse_variables(args.variables)
+
+    if args.verbosity > 1:
+        print "Command-line Variables: %s" % cli_values
+
+    importer = Importer(adobe=args.adobe, package=args.package,
+                        verbosity=args.verbosity,
+                        stream=args.stream or None, gzip=args.gzip or None,
+                        force=args.force)
+
+    if extra_args[:1] == ['serve']:
+        try:
+            serve(importer, args.listen, args.workers, args.queue_size)
+        except BigFixImportError, err:
+            print err
+            sys.exit(1)
+    elif extra_args[:1] == ['refresh-index']:
+        try:
+            refresh_task_index(importer)
+        except BigFixImportError, err:
+            print err
+            sys.exit(1)
+    elif extra_args[:1] == ['compile-templates']:
+        compile_templates(importer)
+    elif extra_args[:1] == ['benchmark-templates']:
+        benchmark_templates(importer, args.iterations)
+    elif args.batch:
+        if args.bundle_size is not None:
+            bundle_size = args.bundle_size
+        elif importer.config.has_option('bigfiximport', 'BUNDLE_SIZE'):
+            bundle_size = importer.config.getint('bigfiximport', 'BUNDLE_SIZE')
         else:
-            print new_task
-    except:
-        print new_task
+            bundle_size = 1
+        run_batch(importer, args.batch, cli_values, args.template or None, args.jobs, args.preview,
+                  bundle_size)
+    else:
+        job = ImportJob(argv[-1], args.template or None, cli_values)
+        try:
+            importer.run(job, render=False)
+        except BigFixImportError, err:
+            print err
+            sys.exit(1)
+        if job.info is not None:
+            import_task(importer, job, args.preview)
+
+if __name__ == '__main__':
+    main()
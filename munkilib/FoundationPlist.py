@@ -38,16 +38,29 @@ with a file name. It returns the top level object (again, usually a
 dictionary).
 
 To work with plist data in strings, you can use readPlistFromString()
-and writePlistToString().
+and writePlistToString(). writeBinaryPlist(rootObject, filepath) writes
+the binary format, which is quicker to read back.
+
+Where Foundation isn't available, plists are read with bplist (binary) or
+plistlib (XML) and written as XML with plistlib, or with bplist by
+writeBinaryPlist().
 """
 
+import plistlib
+
+import bplist
+
 # PyLint cannot properly find names inside Cocoa libraries, so issues bogus
 # No name 'Foo' in module 'Bar' warnings. Disable them.
 # pylint: disable=E0611
-from Foundation import NSData
-from Foundation import NSPropertyListSerialization
-from Foundation import NSPropertyListMutableContainers
-from Foundation import NSPropertyListXMLFormat_v1_0
+try:
+    from Foundation import NSData
+    from Foundation import NSPropertyListSerialization
+    from Foundation import NSPropertyListMutableContainers
+    from Foundation import NSPropertyListBinaryFormat_v1_0
+    from Foundation import NSPropertyListXMLFormat_v1_0
+except ImportError:
+    NSPropertyListSerialization = None
 # pylint: enable=E0611
 
 # Disable PyLint complaining about 'invalid' camelCase names
@@ -66,11 +79,33 @@ class NSPropertyListWriteException(FoundationPlistException):
     """Write error for plists"""
     pass
 
+def _readPlistData(data):
+    '''Parses plist data without Foundation.'''
+    try:
+        if bplist.isbplist(data):
+            return bplist.readplist(data)
+        return plistlib.readPlistFromString(data)
+    except Exception, err:
+        raise NSPropertyListSerializationException(err)
+
+
 def readPlist(filepath):
     """
     Read a .plist file from filepath.  Return the unpacked root object
     (which is usually a dictionary).
     """
+    if NSPropertyListSerialization is None:
+        try:
+            with open(filepath, 'rb') as plistfile:
+                data = plistfile.read()
+        except IOError, err:
+            raise NSPropertyListSerializationException(
+                "%s in file %s" % (err, filepath))
+        try:
+            return _readPlistData(data)
+        except NSPropertyListSerializationException, err:
+            raise NSPropertyListSerializationException(
+                "%s in file %s" % (err, filepath))
     plistData = NSData.dataWithContentsOfFile_(filepath)
     dataObject, dummy_plistFormat, error = (
         NSPropertyListSerialization.
@@ -86,6 +121,8 @@ def readPlist(filepath):
 
 def readPlistFromString(data):
     '''Read a plist data from a string. Return the root object.'''
+    if NSPropertyListSerialization is None:
+        return _readPlistData(data)
     try:
         plistData = buffer(data)
     except TypeError, err:
@@ -105,6 +142,15 @@ def writePlist(dataObject, filepath):
     '''
     Write 'rootObject' as a plist to filepath.
     '''
+    if NSPropertyListSerialization is None:
+        plistData = writePlistToString(dataObject)
+        try:
+            with open(filepath, 'wb') as plistfile:
+                plistfile.write(plistData)
+            return
+        except IOError:
+            raise NSPropertyListWriteException(
+                "Failed to write plist data to %s" % filepath)
     plistData, error = (
         NSPropertyListSerialization.
         dataFromPropertyList_format_errorDescription_(
@@ -120,8 +166,44 @@ def writePlist(dataObject, filepath):
                 "Failed to write plist data to %s" % filepath)
 
 
+def writeBinaryPlist(dataObject, filepath):
+    '''
+    Write 'rootObject' as a binary plist to filepath.
+    '''
+    if NSPropertyListSerialization is None:
+        try:
+            plistData = bplist.writeplist(dataObject)
+        except bplist.Error, err:
+            raise NSPropertyListSerializationException(err)
+        try:
+            with open(filepath, 'wb') as plistfile:
+                plistfile.write(plistData)
+            return
+        except IOError:
+            raise NSPropertyListWriteException(
+                "Failed to write plist data to %s" % filepath)
+    plistData, error = (
+        NSPropertyListSerialization.
+        dataFromPropertyList_format_errorDescription_(
+            dataObject, NSPropertyListBinaryFormat_v1_0, None))
+    if error:
+        error = error.encode('ascii', 'ignore')
+        raise NSPropertyListSerializationException(error)
+    else:
+        if plistData.writeToFile_atomically_(filepath, True):
+            return
+        else:
+            raise NSPropertyListWriteException(
+                "Failed to write plist data to %s" % filepath)
+
+
 def writePlistToString(rootObject):
     '''Return 'rootObject' as a plist-formatted string.'''
+    if NSPropertyListSerialization is None:
+        try:
+            return plistlib.writePlistToString(rootObject)
+        except (TypeError, AttributeError), err:
+            raise NSPropertyListSerializationException(err)
     plistData, error = (
         NSPropertyListSerialization.
         dataFromPropertyList_format_errorDescription_(
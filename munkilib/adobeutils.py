@@ -28,6 +28,7 @@ import subprocess
 import time
 import tempfile
 import sqlite3
+import zipfile
 from xml.dom import minidom
 from glob import glob
 
@@ -223,53 +224,93 @@ def getPayloadInfo(dirpath):
         else:
             db_path = os.path.join(dirpath, 'Media_db.db')
             if os.path.exists(db_path):
-                conn = sqlite3.connect(db_path)
-                cur = conn.cursor()
-                cur.execute("SELECT value FROM PayloadData WHERE "
-                          "PayloadData.key = 'PayloadInfo'")
-                result = cur.fetchone()
-                cur.close()
-                if result:
-                    info_xml = result[0].encode('UTF-8')
-                    dom = minidom.parseString(info_xml)
+                info_xml = getMediaDbPayloadInfo(db_path)
+                if not info_xml:
+                    return payloadinfo
+                dom = minidom.parseString(info_xml)
             else:
                 # no xml, no db, no payload info!
                 return payloadinfo
 
-        payload_info = dom.getElementsByTagName('PayloadInfo')
-        if payload_info:
-            installer_properties = payload_info[0].getElementsByTagName(
-                'InstallerProperties')
-            if installer_properties:
-                properties = installer_properties[0].getElementsByTagName(
-                    'Property')
-                for prop in properties:
-                    if 'name' in prop.attributes.keys():
-                        propname = prop.attributes['name'].value.encode('UTF-8')
-                        propvalue = ''
-                        for node in prop.childNodes:
-                            propvalue += node.nodeValue
-                        if propname == 'AdobeCode':
-                            payloadinfo['AdobeCode'] = propvalue
-                        if propname == 'ProductName':
-                            payloadinfo['display_name'] = propvalue
-                        if propname == 'ProductVersion':
-                            payloadinfo['version'] = propvalue
-
-            installmetadata = payload_info[0].getElementsByTagName(
-                'InstallDestinationMetadata')
-            if installmetadata:
-                totalsizes = installmetadata[0].getElementsByTagName(
-                    'TotalSize')
-                if totalsizes:
-                    installsize = ''
-                    for node in totalsizes[0].childNodes:
-                        installsize += node.nodeValue
-                    payloadinfo['installed_size'] = int(installsize)/1024
+        payloadinfo = parsePayloadInfo(dom)
 
     return payloadinfo
 
 
+def getMediaDbPayloadInfo(db_path):
+    '''Returns the PayloadInfo XML stored in a Media_db.db file as
+    UTF-8 encoded bytes, or None'''
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT value FROM PayloadData WHERE "
+                    "PayloadData.key = 'PayloadInfo'")
+        result = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+    if result:
+        return result[0].encode('UTF-8')
+    return None
+
+
+def parsePayloadInfo(dom):
+    '''Pulls the AdobeCode, name, version and installed size out of a
+    parsed .proxy.xml or Media_db.db PayloadInfo document'''
+    payloadinfo = {}
+    payload_info = dom.getElementsByTagName('PayloadInfo')
+    if payload_info:
+        installer_properties = payload_info[0].getElementsByTagName(
+            'InstallerProperties')
+        if installer_properties:
+            properties = installer_properties[0].getElementsByTagName(
+                'Property')
+            for prop in properties:
+                if 'name' in prop.attributes.keys():
+                    propname = prop.attributes['name'].value.encode('UTF-8')
+                    propvalue = ''
+                    for node in prop.childNodes:
+                        propvalue += node.nodeValue
+                    if propname == 'AdobeCode':
+                        payloadinfo['AdobeCode'] = propvalue
+                    if propname == 'ProductName':
+                        payloadinfo['display_name'] = propvalue
+                    if propname == 'ProductVersion':
+                        payloadinfo['version'] = propvalue
+
+        installmetadata = payload_info[0].getElementsByTagName(
+            'InstallDestinationMetadata')
+        if installmetadata:
+            totalsizes = installmetadata[0].getElementsByTagName(
+                'TotalSize')
+            if totalsizes:
+                installsize = ''
+                for node in totalsizes[0].childNodes:
+                    installsize += node.nodeValue
+                payloadinfo['installed_size'] = int(installsize)/1024
+
+    return payloadinfo
+
+
+def addPayloadSummary(info, payloads):
+    '''Fills in name, version and installed size of an installer or
+    updater from the payloads found by getAdobeSetupInfo'''
+    if payloads:
+        if len(payloads) == 1:
+            info['display_name'] = payloads[0]['display_name']
+            info['version'] = payloads[0]['version']
+        else:
+            if not 'display_name' in info:
+                info['display_name'] = "ADMIN: choose from payloads"
+            if not 'version' in info:
+                info['version'] = "ADMIN please set me"
+        info['payloads'] = payloads
+        installed_size = 0
+        for payload in payloads:
+            installed_size = installed_size + payload.get('installed_size', 0)
+        info['installed_size'] = installed_size
+
+
 def getAdobeSetupInfo(installroot):
     '''Given the root of mounted Adobe DMG,
     look for info about the installer or updater'''
@@ -330,20 +371,159 @@ def getAdobeSetupInfo(installroot):
                 # so no need to keep walking the install root
                 break
 
-    if payloads:
-        if len(payloads) == 1:
-            info['display_name'] = payloads[0]['display_name']
-            info['version'] = payloads[0]['version']
-        else:
-            if not 'display_name' in info:
-                info['display_name'] = "ADMIN: choose from payloads"
-            if not 'version' in info:
-                info['version'] = "ADMIN please set me"
-        info['payloads'] = payloads
-        installed_size = 0
-        for payload in payloads:
-            installed_size = installed_size + payload.get('installed_size', 0)
-        info['installed_size'] = installed_size
+    addPayloadSummary(info, payloads)
+    return info
+
+
+def getZipDirectoryIndex(zf):
+    '''Returns a dictionary mapping every directory in an open ZipFile, or
+    any archive with a zipfile-like namelist(), ('' for the top level) to
+    the set of names directly inside it'''
+    index = {'': set()}
+    for name in zf.namelist():
+        parts = name.rstrip('/').split('/')
+        for i in range(len(parts)):
+            index.setdefault('/'.join(parts[:i]), set()).add(parts[i])
+        if name.endswith('/'):
+            index.setdefault(name.rstrip('/'), set())
+    return index
+
+
+def walkZipDirectoryIndex(index, top=''):
+    '''Yields the directories of a getZipDirectoryIndex() index top-down,
+    each followed by its subdirectories in name order: the order os.walk()
+    visits an extracted copy in on a volume that lists names sorted'''
+    yield top
+    for item in sorted(index[top]):
+        path = '%s/%s' % (top, item) if top else item
+        if path in index:
+            for subdir in walkZipDirectoryIndex(index, path):
+                yield subdir
+
+
+def getPayloadInfoFromZip(zf, index, dirpath, db_path):
+    '''Like getPayloadInfo, for a payload directory inside a zip archive.
+    Only the .proxy.xml or Media_db.db member is read; a Media_db.db is
+    copied to db_path because sqlite can't open it from the archive.'''
+    if dirpath not in index:
+        return {}
+
+    items = index[dirpath]
+    proxy_names = sorted(
+        [item for item in items if item.endswith('.proxy.xml')])
+    if proxy_names:
+        dom = minidom.parseString(
+            zf.read('%s/%s' % (dirpath, proxy_names[0])))
+    elif 'Media_db.db' in items:
+        source = zf.open('%s/Media_db.db' % dirpath)
+        try:
+            with open(db_path, 'wb') as dbfile:
+                while True:
+                    chunk = source.read(2**20)
+                    if not chunk:
+                        break
+                    dbfile.write(chunk)
+        finally:
+            source.close()
+        info_xml = getMediaDbPayloadInfo(db_path)
+        if not info_xml:
+            return {}
+        dom = minidom.parseString(info_xml)
+    else:
+        # no xml, no db, no payload info!
+        return {}
+
+    return parsePayloadInfo(dom)
+
+
+def getAdobeSetupInfoFromZip(zippath):
+    '''Like getAdobeSetupInfo, but reads an Adobe installer or updater
+    straight from a zip archive instead of from an extracted copy.
+    Names are matched case-sensitively, as in an extracted copy.'''
+    zf = zipfile.ZipFile(zippath, 'r')
+    try:
+        return getAdobeSetupInfoFromArchive(zf)
+    finally:
+        zf.close()
+
+
+def getAdobeSetupInfoFromArchive(zf, ignore_case=False):
+    '''Like getAdobeSetupInfo, for an open ZipFile or any other archive
+    with zipfile-like namelist(), read() and open() methods, such as an
+    unmounted disk image volume. Only the setup.xml, .proxy.xml and
+    Media_db.db members are read, and at most one temporary file is
+    written. Set ignore_case to find setup.xml the way it is found on a
+    case-insensitive volume, such as a mounted Adobe disk image.'''
+
+    info = {}
+    payloads = []
+
+    index = getZipDirectoryIndex(zf)
+    (fd, db_path) = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        # look for all the payloads folders
+        for path in walkZipDirectoryIndex(index):
+            if not ('/' + path).endswith('/payloads'):
+                continue
+            driverfolder = ''
+            mediaSignature = ''
+            setupxml = [item for item in sorted(index[path])
+                        if item == 'setup.xml' or
+                        (ignore_case and item.lower() == 'setup.xml')]
+            if setupxml:
+                dom = minidom.parseString(
+                    zf.read('%s/%s' % (path, setupxml[0])))
+                drivers = dom.getElementsByTagName('Driver')
+                if drivers:
+                    driver = drivers[0]
+                    if 'folder' in driver.attributes.keys():
+                        driverfolder = driver.attributes[
+                            'folder'].value.encode('UTF-8')
+                if driverfolder == '':
+                    # look for mediaSignature (CS5 AAMEE install)
+                    setupElements = dom.getElementsByTagName('Setup')
+                    if setupElements:
+                        mediaSignatureElements = setupElements[
+                            0].getElementsByTagName('mediaSignature')
+                        if mediaSignatureElements:
+                            element = mediaSignatureElements[0]
+                            for node in element.childNodes:
+                                mediaSignature += node.nodeValue
+
+            for item in sorted(index[path]):
+                payloadpath = '%s/%s' % (path, item)
+                payloadinfo = getPayloadInfoFromZip(
+                    zf, index, payloadpath, db_path)
+                if payloadinfo:
+                    payloads.append(payloadinfo)
+                    if ((driverfolder and item == driverfolder) or
+                            (mediaSignature and
+                             payloadinfo['AdobeCode'] == mediaSignature)):
+                        info['display_name'] = payloadinfo['display_name']
+                        info['version'] = payloadinfo['version']
+                        info['AdobeSetupType'] = 'ProductInstall'
+
+        if not payloads:
+            # look for an extensions folder; almost certainly this is an
+            # Updater
+            for path in walkZipDirectoryIndex(index):
+                if ('/' + path).endswith('/extensions'):
+                    for item in sorted(index[path]):
+                        #skip LanguagePacks
+                        if item.find("LanguagePack") == -1:
+                            payloadinfo = getPayloadInfoFromZip(
+                                zf, index, '%s/%s' % (path, item), db_path)
+                            if payloadinfo:
+                                payloads.append(payloadinfo)
+
+                    # we found an extensions dir,
+                    # so no need to keep looking
+                    break
+    finally:
+        os.remove(db_path)
+
+    addPayloadSummary(info, payloads)
     return info
 
 
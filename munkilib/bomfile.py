@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+bomfile
+
+Reads Bill of Materials (.bom) files, the package content listings found in
+installer packages and receipts, without running /usr/bin/lsbom.
+
+The file is mapped into memory and the Paths B-tree is walked directly,
+leaf by leaf, yielding one (path, mode, uid, gid) tuple per entry in the
+same order and with the same paths that lsbom prints.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import mmap
+import os
+import struct
+
+
+BOM_MAGIC = 'BOMStore'
+
+# Entry types in BOMPathInfo2 records.
+TYPE_FILE = 1
+TYPE_DIRECTORY = 2
+TYPE_LINK = 3
+TYPE_DEVICE = 4
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+class BomStore(object):
+    """The block table and named variables of a mapped BOM file."""
+
+    def __init__(self, data):
+        self.data = data
+        if data[:8] != BOM_MAGIC:
+            raise Error('Not a BOM file')
+        (dummy_version, dummy_blocks, index_offset, dummy_index_length,
+         vars_offset, dummy_vars_length) = struct.unpack_from('>6I', data, 8)
+
+        count = struct.unpack_from('>I', data, index_offset)[0]
+        self.blocks = struct.unpack_from('>%dI' % (count * 2), data,
+                                         index_offset + 4)
+
+        self.variables = {}
+        count = struct.unpack_from('>I', data, vars_offset)[0]
+        offset = vars_offset + 4
+        for dummy_index in xrange(count):
+            (block, length) = struct.unpack_from('>IB', data, offset)
+            name = data[offset + 5:offset + 5 + length]
+            self.variables[name] = block
+            offset += 5 + length
+
+    def block(self, index):
+        """Returns the (offset, length) of a block."""
+        if index * 2 + 1 >= len(self.blocks):
+            raise Error('Bad block index %d' % index)
+        return (self.blocks[index * 2], self.blocks[index * 2 + 1])
+
+    def tree_entries(self, name):
+        """
+        Yields the (key block, value block) pairs of a named B-tree, in
+        order, by descending to the first leaf and following the leaves'
+        forward links.
+        """
+        if name not in self.variables:
+            raise Error('BOM has no %s tree' % name)
+        (offset, dummy_length) = self.block(self.variables[name])
+        if self.data[offset:offset + 4] != 'tree':
+            raise Error('%s is not a tree' % name)
+        node = struct.unpack_from('>I', self.data, offset + 8)[0]
+
+        visited = set()
+        while node and node not in visited:
+            visited.add(node)
+            (offset, dummy_length) = self.block(node)
+            (is_leaf, count, forward) = struct.unpack_from(
+                '>HHI', self.data, offset)
+            pairs = struct.unpack_from('>%dI' % (count * 2), self.data,
+                                       offset + 12)
+            if not is_leaf:
+                if not count:
+                    return
+                node = pairs[0]
+                continue
+            for i in xrange(0, count * 2, 2):
+                yield (pairs[i], pairs[i + 1])
+            node = forward
+
+
+def readbom(bompath):
+    """
+    Yields a (path, mode, uid, gid) tuple for every entry of a BOM file,
+    with paths as lsbom prints them ('.', './Applications', ...) decoded
+    as UTF-8.
+    """
+    f = open(bompath, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            raise Error('%s is empty' % bompath)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    try:
+        try:
+            store = BomStore(data)
+
+            # Names are keyed by the ID of their parent entry; read them
+            # all first since a child can come before its parent.
+            entries = []
+            for (info_block, file_block) in store.tree_entries('Paths'):
+                (offset, length) = store.block(file_block)
+                parent = struct.unpack_from('>I', data, offset)[0]
+                name = data[offset + 4:offset + length].split('\0', 1)[0]
+                (offset, dummy_length) = store.block(info_block)
+                (entry_id, info2_block) = struct.unpack_from(
+                    '>II', data, offset)
+                entries.append((entry_id, parent, name, info2_block))
+
+            names = dict((entry[0], (entry[1], entry[2])) for entry in entries)
+            paths = {}
+
+            def fullpath(entry_id):
+                parts = []
+                while entry_id in names and entry_id not in paths:
+                    (parent, name) = names[entry_id]
+                    parts.append((entry_id, name))
+                    entry_id = parent
+                    if len(parts) > len(names):
+                        raise Error('Loop in BOM paths')
+                prefix = paths.get(entry_id)
+                for (part_id, name) in reversed(parts):
+                    prefix = name if prefix is None else prefix + '/' + name
+                    paths[part_id] = prefix
+                return prefix
+
+            for (entry_id, dummy_parent, dummy_name, info2_block) in entries:
+                (offset, dummy_length) = store.block(info2_block)
+                (mode, uid, gid) = struct.unpack_from('>HII', data, offset + 4)
+                yield (fullpath(entry_id).decode('UTF-8'), mode, uid, gid)
+        except struct.error, err:
+            raise Error('Malformed BOM file %s: %s' % (bompath, err))
+    finally:
+        data.close()
@@ -0,0 +1,349 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+bplist
+
+Reads and writes binary property lists (bplist00), such as the values of
+com.apple.metadata extended attributes, in process.
+
+readplist() decodes objects straight from the data, looking offsets up in
+the offset table as it goes rather than copying it. Values come back as
+plistlib would return them from the equivalent XML: str for ASCII strings,
+unicode otherwise, plistlib.Data for data and naive UTC datetimes for
+dates. Keyed archiver UIDs are returned as {'CF$UID': n} dictionaries, as
+plutil prints them.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import datetime
+import plistlib
+import struct
+
+
+MAGIC = 'bplist00'
+TRAILER_FORMAT = '>6xBBQQQ'
+TRAILER_SIZE = 32
+
+# Dates are seconds from the start of 2001
+EPOCH = datetime.datetime(2001, 1, 1)
+
+UINT_FORMATS = {1: '>B', 2: '>H', 4: '>I', 8: '>Q'}
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def isbplist(data):
+    """Returns True if data looks like a binary plist."""
+    return data[:8] == MAGIC
+
+
+def _uint(data, offset, size):
+    if size in UINT_FORMATS:
+        return struct.unpack_from(UINT_FORMATS[size], data, offset)[0]
+    value = 0
+    for byte in data[offset:offset + size]:
+        value = value << 8 | ord(byte)
+    return value
+
+
+class _Reader(object):
+    """Decodes the objects of one binary plist."""
+
+    def __init__(self, data):
+        self.data = data
+        if len(data) < len(MAGIC) + TRAILER_SIZE or not isbplist(data):
+            raise Error('Not a binary plist')
+        (self.offset_size, self.ref_size, self.count, self.top,
+         self.table_offset) = struct.unpack_from(
+             TRAILER_FORMAT, data, len(data) - TRAILER_SIZE)
+        if (not self.offset_size or not self.ref_size or
+                self.top >= self.count or
+                self.table_offset + self.count * self.offset_size >
+                len(data) - TRAILER_SIZE):
+            raise Error('Bad binary plist trailer')
+        if self.offset_size in UINT_FORMATS:
+            self.offsets = struct.unpack_from(
+                '>%d%s' % (self.count, UINT_FORMATS[self.offset_size][1]),
+                data, self.table_offset)
+        else:
+            self.offsets = [
+                _uint(data, self.table_offset + ref * self.offset_size,
+                      self.offset_size) for ref in xrange(self.count)]
+        # Writers store each distinct string, number or date once and refer
+        # to it from everywhere it is used, so decode those once too.
+        self.scalars = {}
+        self.decoding = set()
+
+    def offset(self, ref):
+        if ref >= self.count:
+            raise Error('Bad object reference %d' % ref)
+        return self.offsets[ref]
+
+    def length(self, info, offset):
+        """Returns a length and the offset of the data that follows it."""
+        if info != 0x0f:
+            return (info, offset + 1)
+        marker = ord(self.data[offset + 1])
+        if marker & 0xf0 != 0x10:
+            raise Error('Bad length at offset %d' % offset)
+        size = 1 << (marker & 0x0f)
+        return (_uint(self.data, offset + 2, size), offset + 2 + size)
+
+    def refs(self, offset, count):
+        if offset + count * self.ref_size > len(self.data):
+            raise Error('Truncated object at offset %d' % offset)
+        if self.ref_size in UINT_FORMATS:
+            return struct.unpack_from(
+                '>%d%s' % (count, UINT_FORMATS[self.ref_size][1]),
+                self.data, offset)
+        return [_uint(self.data, offset + i * self.ref_size, self.ref_size)
+                for i in xrange(count)]
+
+    def object(self, ref):
+        if ref in self.scalars:
+            return self.scalars[ref]
+        if ref in self.decoding:
+            raise Error('Object %d contains itself' % ref)
+        value = self._decode(ref)
+        if not isinstance(value, (dict, list, plistlib.Data)):
+            self.scalars[ref] = value
+        return value
+
+    def _decode(self, ref):
+        offset = self.offset(ref)
+        data = self.data
+        marker = ord(data[offset])
+        (kind, info) = (marker >> 4, marker & 0x0f)
+
+        if marker == 0x00:
+            return None
+        if marker == 0x08:
+            return False
+        if marker == 0x09:
+            return True
+        if kind == 0x1:
+            size = 1 << info
+            if size == 16:
+                (high, low) = struct.unpack_from('>QQ', data, offset + 1)
+                value = high << 64 | low
+                if high & (1 << 63):
+                    value -= 1 << 128
+                return value
+            if size == 8:
+                return struct.unpack_from('>q', data, offset + 1)[0]
+            return _uint(data, offset + 1, size)
+        if kind == 0x2:
+            if info == 2:
+                return struct.unpack_from('>f', data, offset + 1)[0]
+            if info == 3:
+                return struct.unpack_from('>d', data, offset + 1)[0]
+        elif marker == 0x33:
+            seconds = struct.unpack_from('>d', data, offset + 1)[0]
+            return EPOCH + datetime.timedelta(seconds=seconds)
+        elif kind == 0x4:
+            (length, start) = self.length(info, offset)
+            return plistlib.Data(data[start:start + length])
+        elif kind == 0x5:
+            (length, start) = self.length(info, offset)
+            return data[start:start + length]
+        elif kind == 0x6:
+            (length, start) = self.length(info, offset)
+            return data[start:start + length * 2].decode('utf-16-be')
+        elif kind == 0x8:
+            return {'CF$UID': _uint(data, offset + 1, info + 1)}
+        elif kind in (0xa, 0xc, 0xd):
+            (length, start) = self.length(info, offset)
+            self.decoding.add(ref)
+            try:
+                if kind == 0xd:
+                    keys = self.refs(start, length)
+                    values = self.refs(start + length * self.ref_size, length)
+                    return dict((self.object(key), self.object(value))
+                                for (key, value) in zip(keys, values))
+                # sets have no plist XML equivalent; read them as arrays
+                return [self.object(item) for item in self.refs(start, length)]
+            finally:
+                self.decoding.discard(ref)
+        raise Error('Unknown object type 0x%02x at offset %d'
+                    % (marker, offset))
+
+
+def readplist(data):
+    """Returns the root object of a binary plist."""
+    reader = _Reader(data)
+    try:
+        return reader.object(reader.top)
+    except (struct.error, IndexError, TypeError, UnicodeDecodeError,
+            OverflowError, ValueError), err:
+        # OverflowError and ValueError: dates out of datetime's range or NaN
+        raise Error('Malformed binary plist: %s' % err)
+    except RuntimeError:
+        # nesting deeper than the recursion limit
+        raise Error('Malformed binary plist: objects nested too deeply')
+
+
+def _uintsize(value):
+    for size in (1, 2, 4, 8):
+        if value < 1 << (size * 8):
+            return size
+    raise Error('Value too large: %d' % value)
+
+
+def _packuint(value, size):
+    if size in UINT_FORMATS:
+        return struct.pack(UINT_FORMATS[size], value)
+    raise Error('Bad integer size %d' % size)
+
+
+class _Writer(object):
+    """Flattens an object tree into a binary plist."""
+
+    def __init__(self):
+        self.objects = []
+        self.unique = {}
+        self.building = set()
+
+    def flatten(self, obj):
+        """Returns the object reference of obj, adding it if needed."""
+        if isinstance(obj, bool):
+            key = ('bool', obj)
+        elif isinstance(obj, (int, long)):
+            key = ('int', obj)
+        elif isinstance(obj, float):
+            key = ('real', obj)
+        elif isinstance(obj, basestring):
+            if isinstance(obj, str):
+                try:
+                    obj.decode('ascii')
+                except UnicodeDecodeError:
+                    obj = obj.decode('UTF-8')
+            key = ('string', obj)
+        elif isinstance(obj, plistlib.Data):
+            key = ('data', obj.data)
+        elif isinstance(obj, bytearray):
+            key = ('data', str(obj))
+        elif isinstance(obj, datetime.datetime):
+            key = ('date', obj)
+        elif (isinstance(obj, dict) and obj.keys() == ['CF$UID'] and
+              isinstance(obj['CF$UID'], (int, long))):
+            key = ('uid', obj['CF$UID'])
+        else:
+            key = None
+
+        if key is not None:
+            if key not in self.unique:
+                self.unique[key] = len(self.objects)
+                self.objects.append(key)
+            return self.unique[key]
+
+        if id(obj) in self.building:
+            raise Error('Object contains itself')
+        ref = len(self.objects)
+        self.objects.append(None)
+        self.building.add(id(obj))
+        if isinstance(obj, dict):
+            keys = sorted(obj.keys())
+            for item in keys:
+                if not isinstance(item, basestring):
+                    raise Error('Dictionary keys must be strings')
+            self.objects[ref] = ('dict', [self.flatten(item) for item in keys],
+                                 [self.flatten(obj[item]) for item in keys])
+        elif isinstance(obj, (list, tuple)):
+            self.objects[ref] = ('array',
+                                 [self.flatten(item) for item in obj])
+        else:
+            raise Error('Unsupported type: %s' % type(obj).__name__)
+        self.building.discard(id(obj))
+        return ref
+
+    def header(self, kind, length):
+        if length < 0x0f:
+            return chr(kind << 4 | length)
+        size = _uintsize(length)
+        return (chr(kind << 4 | 0x0f) + chr(0x10 | (size.bit_length() - 1)) +
+                _packuint(length, size))
+
+    def encode(self, obj, ref_size):
+        kind = obj[0]
+        if kind == 'bool':
+            return '\x09' if obj[1] else '\x08'
+        if kind == 'int':
+            value = obj[1]
+            if value < -(1 << 63):
+                raise Error('Integer too small: %d' % value)
+            if value < 0:
+                return '\x13' + struct.pack('>q', value)
+            if value >= 1 << 64:
+                raise Error('Integer too large: %d' % value)
+            if value >= 1 << 63:
+                return '\x14' + struct.pack('>QQ', 0, value)
+            size = _uintsize(value)
+            return chr(0x10 | (size.bit_length() - 1)) + _packuint(value, size)
+        if kind == 'real':
+            return '\x23' + struct.pack('>d', obj[1])
+        if kind == 'date':
+            delta = obj[1] - EPOCH
+            seconds = (delta.days * 86400 + delta.seconds +
+                       delta.microseconds / 1000000.0)
+            return '\x33' + struct.pack('>d', seconds)
+        if kind == 'data':
+            return self.header(0x4, len(obj[1])) + obj[1]
+        if kind == 'string':
+            value = obj[1]
+            try:
+                value = value.encode('ascii')
+                return self.header(0x5, len(value)) + value
+            except UnicodeError:
+                value = value.encode('utf-16-be')
+                return self.header(0x6, len(value) // 2) + value
+        if kind == 'uid':
+            size = _uintsize(obj[1])
+            return chr(0x80 | (size - 1)) + _packuint(obj[1], size)
+        refs = obj[1] + obj[2] if kind == 'dict' else obj[1]
+        marker = 0xd if kind == 'dict' else 0xa
+        return (self.header(marker, len(obj[1])) +
+                ''.join(_packuint(ref, ref_size) for ref in refs))
+
+    def write(self, rootobject):
+        top = self.flatten(rootobject)
+        ref_size = _uintsize(len(self.objects))
+        parts = [MAGIC]
+        offsets = []
+        position = len(MAGIC)
+        for obj in self.objects:
+            encoded = self.encode(obj, ref_size)
+            offsets.append(position)
+            parts.append(encoded)
+            position += len(encoded)
+        offset_size = _uintsize(position)
+        parts.extend(_packuint(offset, offset_size) for offset in offsets)
+        parts.append(struct.pack(TRAILER_FORMAT, offset_size, ref_size,
+                                 len(self.objects), top, position))
+        return ''.join(parts)
+
+
+def writeplist(rootobject):
+    """Returns rootobject encoded as a binary plist."""
+    try:
+        return _Writer().write(rootobject)
+    except RuntimeError:
+        # nesting deeper than the recursion limit
+        raise Error('Objects nested too deeply')
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+digests
+
+Single-pass file hashing. A file is read once, in large chunks, and every
+requested hash function (plus the byte count) is fed from the same buffer.
+
+Results can be remembered in an on-disk cache keyed by the file's path,
+size, mtime and inode, so unchanged files are never hashed twice. The cache
+trusts stat information, so it is off unless a caller turns it on with
+setcache(); never use it to verify the integrity of a file.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+
+# Digests calculated by getdigests() when no algorithms are specified.
+DEFAULT_ALGORITHMS = ('sha1', 'sha256', 'md5')
+
+# Size of each read() when streaming a file through the hash functions.
+CHUNK_SIZE = 2**20
+
+# Files at least this large are hashed through mmap instead of read().
+MMAP_THRESHOLD = 2**26
+
+# Location and size bound of the default persistent digest cache.
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.munkilib', 'digests.db')
+CACHE_MAX_ENTRIES = 10000
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def hashfile(filename, hash_functions, chunksize=CHUNK_SIZE, use_mmap=None):
+    """
+    Feeds the contents of a file to one or more hash functions in one pass.
+
+    Args:
+      filename: The file name to read.
+      hash_functions: A list of hash function objects, instanciated before
+          calling this function, e.g. [hashlib.md5(), hashlib.sha1()].
+      chunksize: The number of bytes handed to the hash functions at a time.
+      use_mmap: True to map the file into memory, False to read() it, None
+          to decide based on MMAP_THRESHOLD.
+
+    Returns:
+      The number of bytes read.
+    """
+    if chunksize <= 0:
+        raise Error('Invalid chunk size: %s' % chunksize)
+
+    size = 0
+    f = open(filename, 'rb')
+    try:
+        filesize = os.fstat(f.fileno()).st_size
+        if use_mmap is None:
+            use_mmap = filesize >= MMAP_THRESHOLD
+        if use_mmap and filesize:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, filesize, chunksize):
+                    chunk = buffer(mapped, offset, chunksize)
+                    for hash_function in hash_functions:
+                        hash_function.update(chunk)
+                    size += len(chunk)
+            finally:
+                mapped.close()
+        else:
+            while 1:
+                chunk = f.read(chunksize)
+                if not chunk:
+                    break
+                for hash_function in hash_functions:
+                    hash_function.update(chunk)
+                size += len(chunk)
+    finally:
+        f.close()
+    return size
+
+
+def fileidentity(filename):
+    """
+    Returns the (path, size, mtime, inode) tuple used to decide whether a
+    cached digest still describes a file.
+    """
+    st = os.stat(filename)
+    return (os.path.realpath(filename), st.st_size, st.st_mtime, st.st_ino)
+
+
+class DigestCache(object):
+    """
+    Persistent sqlite store of file digests. Entries are invalidated when the
+    stat identity of a file changes, and the least recently used entries are
+    evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        """Returns a connection, reopening it in forked child processes."""
+        if self._conn is None or self._pid != os.getpid():
+            cachedir = os.path.dirname(self.path)
+            if cachedir and not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            self._conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS digests ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                'inode INTEGER, sha1 TEXT, sha256 TEXT, md5 TEXT, '
+                'last_used REAL)')
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, identity):
+        """Returns the cached digests for a file identity, or None."""
+        (path, size, mtime, inode) = identity
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT size, mtime, inode, sha1, sha256, md5 FROM digests '
+                'WHERE path = ?', (path,)).fetchone()
+            if row is None:
+                return None
+            if tuple(row[:3]) != (size, mtime, inode):
+                conn.execute('DELETE FROM digests WHERE path = ?', (path,))
+                conn.commit()
+                return None
+            conn.execute('UPDATE digests SET last_used = ? WHERE path = ?',
+                         (time.time(), path))
+            conn.commit()
+        return {'size': row[0], 'sha1': str(row[3]), 'sha256': str(row[4]),
+                'md5': str(row[5])}
+
+    def put(self, identity, info):
+        """Stores the digests of a file identity, evicting old entries."""
+        (path, size, mtime, inode) = identity
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO digests '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, size, mtime, inode, info['sha1'], info['sha256'],
+                 info['md5'], time.time()))
+            count = conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    'DELETE FROM digests WHERE path IN (SELECT path FROM '
+                    'digests ORDER BY last_used LIMIT ?)',
+                    (count - self.max_entries,))
+            conn.commit()
+
+    def clear(self):
+        """Removes every cached entry."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM digests')
+            conn.commit()
+
+
+# No caching unless a caller opts in with setcache()
+_CACHE = None
+
+
+def setcache(path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+    """Points the shared digest cache at path; None disables caching."""
+    global _CACHE
+    if path:
+        _CACHE = DigestCache(path, max_entries)
+    else:
+        _CACHE = None
+
+
+def getcache():
+    """Returns the shared DigestCache, or None if caching is disabled."""
+    return _CACHE
+
+
+def getdigests(filename, algorithms=DEFAULT_ALGORITHMS,
+               chunksize=CHUNK_SIZE, use_mmap=None, use_cache=True):
+    """
+    Returns a dictionary of hex digests for a file, keyed by algorithm name,
+    plus the file size under 'size'. The file is only read once no matter
+    how many algorithms are requested, and not at all if a digest cache
+    has been set up with setcache() and holds an entry for its current
+    identity.
+    """
+    cache = getcache()
+    if not use_cache or set(algorithms) - set(DEFAULT_ALGORITHMS):
+        cache = None
+
+    if cache:
+        identity = fileidentity(filename)
+        try:
+            info = cache.get(identity)
+        except (sqlite3.Error, OSError):
+            info = None
+        if info:
+            return info
+        # hash everything the cache stores so later lookups can be served
+        algorithms = DEFAULT_ALGORITHMS
+
+    hash_functions = [hashlib.new(name) for name in algorithms]
+    info = {}
+    info['size'] = hashfile(filename, hash_functions,
+                            chunksize=chunksize, use_mmap=use_mmap)
+    for name, hash_function in zip(algorithms, hash_functions):
+        info[name] = hash_function.hexdigest()
+
+    # don't remember digests of a file that changed while we read it
+    if cache and fileidentity(filename) == identity:
+        try:
+            cache.put(identity, info)
+        except (sqlite3.Error, OSError):
+            pass
+    return info
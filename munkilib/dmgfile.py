@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+dmgfile
+
+Reads UDIF disk images (.dmg) without attaching them. The koly trailer and
+the blkx tables in the image's XML property list map every range of disk
+sectors to a chunk of the data fork; DiskImage presents the whole disk as a
+read-only file object and decompresses only the chunks that are read.
+
+openvolume() finds the HFS+ partition of an image and returns it as an
+hfsplus.HFSVolume.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import bisect
+import bz2
+import collections
+import plistlib
+import struct
+import zlib
+
+import hfsplus
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import lzfse
+except ImportError:
+    lzfse = None
+
+
+SECTOR_SIZE = 512
+
+KOLY_MAGIC = 'koly'
+KOLY_FORMAT = '>4sIIIQQQQQII16sII128sQQ'
+KOLY_SIZE = 512
+
+MISH_MAGIC = 'mish'
+MISH_FORMAT = '>4sIQQQII'
+MISH_HEADER_SIZE = 204
+CHUNK_FORMAT = '>IIQQQQ'
+CHUNK_SIZE = struct.calcsize(CHUNK_FORMAT)
+
+# blkx chunk types
+CHUNK_ZERO = 0x00000000
+CHUNK_RAW = 0x00000001
+CHUNK_IGNORE = 0x00000002
+CHUNK_ADC = 0x80000004
+CHUNK_ZLIB = 0x80000005
+CHUNK_BZIP2 = 0x80000006
+CHUNK_LZFSE = 0x80000007
+CHUNK_LZMA = 0x80000008
+CHUNK_COMMENT = 0x7ffffffe
+CHUNK_LAST = 0xffffffff
+
+# Number of decompressed chunks kept in memory.
+CHUNK_CACHE_SIZE = 8
+
+# Largest chunk that is decompressed into memory. hdiutil writes 1MB
+# chunks; only zero chunks, which are never read into memory, get bigger.
+MAX_CHUNK_SIZE = 2**26
+
+ZERO_CHUNKS = (CHUNK_ZERO, CHUNK_IGNORE)
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def adc_decompress(data):
+    """Expands Apple Data Compression, as used by old UDCO images."""
+    data = bytearray(data)
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        byte = data[pos]
+        if byte & 0x80:
+            count = (byte & 0x7f) + 1
+            out += data[pos + 1:pos + 1 + count]
+            pos += count + 1
+            continue
+        if byte & 0x40:
+            count = (byte & 0x3f) + 4
+            distance = (data[pos + 1] << 8 | data[pos + 2]) + 1
+            pos += 3
+        else:
+            count = ((byte & 0x3c) >> 2) + 3
+            distance = ((byte & 0x03) << 8 | data[pos + 1]) + 1
+            pos += 2
+        if distance > len(out):
+            raise Error('Corrupt ADC data')
+        for dummy_i in xrange(count):
+            out.append(out[-distance])
+    return str(out)
+
+
+class DiskImage(object):
+    """
+    A UDIF disk image, read as a file object over the uncompressed disk.
+    partitions() lists the blkx entries, each one a partition or other
+    region of the disk.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fileobj = open(filename, 'rb')
+        self.position = 0
+        self.cache = collections.OrderedDict()
+        try:
+            self._read_tables()
+        except:
+            self.fileobj.close()
+            raise
+
+    def _read_tables(self):
+        self.fileobj.seek(0, 2)
+        self.filesize = self.fileobj.tell()
+        if self.filesize < KOLY_SIZE:
+            raise Error('%s is not a UDIF disk image' % self.filename)
+        self.fileobj.seek(self.filesize - KOLY_SIZE)
+        trailer = self.fileobj.read(KOLY_SIZE)
+        (magic, dummy_version, dummy_header_size, dummy_flags,
+         dummy_running_offset, self.data_fork_offset, dummy_data_fork_length,
+         dummy_rsrc_offset, dummy_rsrc_length, dummy_segment_number,
+         dummy_segment_count, dummy_segment_id, dummy_checksum_type,
+         dummy_checksum_size, dummy_checksum, xml_offset,
+         xml_length) = struct.unpack_from(
+             KOLY_FORMAT, trailer)
+        if magic != KOLY_MAGIC:
+            raise Error('%s is not a UDIF disk image' % self.filename)
+        if not xml_length:
+            raise Error('%s has no XML block table' % self.filename)
+        if xml_offset + xml_length > self.filesize:
+            raise Error('%s is truncated' % self.filename)
+
+        self.fileobj.seek(xml_offset)
+        try:
+            plist = plistlib.readPlistFromString(
+                self.fileobj.read(xml_length))
+            tables = [(entry.get('CFName') or entry.get('Name') or '',
+                       entry['Data'].data)
+                      for entry in plist['resource-fork']['blkx']]
+        except Exception, err:
+            raise Error('Bad block table in %s: %s' % (self.filename, err))
+
+        self._partitions = []
+        self.chunks = []
+        for (name, data) in tables:
+            self._add_mish(name, data)
+        self.chunks.sort()
+        self.chunk_starts = [chunk[0] for chunk in self.chunks]
+        if self.chunks:
+            self.size = (self.chunks[-1][0] + self.chunks[-1][1]) * SECTOR_SIZE
+        else:
+            self.size = 0
+
+    def _add_mish(self, name, data):
+        try:
+            (magic, dummy_version, first_sector, sector_count, data_offset,
+             dummy_buffers, dummy_descriptors) = struct.unpack_from(
+                 MISH_FORMAT, data)
+            if magic != MISH_MAGIC:
+                raise Error('Bad blkx entry %s in %s' % (name, self.filename))
+            count = struct.unpack_from('>I', data, MISH_HEADER_SIZE - 4)[0]
+            base = self.data_fork_offset + data_offset
+            for i in xrange(count):
+                (chunk_type, dummy_comment, sector, sectors, offset,
+                 length) = struct.unpack_from(
+                     CHUNK_FORMAT, data, MISH_HEADER_SIZE + i * CHUNK_SIZE)
+                if chunk_type in (CHUNK_COMMENT, CHUNK_LAST) or not sectors:
+                    continue
+                if chunk_type not in ZERO_CHUNKS and (
+                        sectors * SECTOR_SIZE > MAX_CHUNK_SIZE or
+                        base + offset + length > self.filesize):
+                    raise Error('Bad chunk in blkx entry %s in %s' %
+                                (name, self.filename))
+                self.chunks.append((first_sector + sector, sectors,
+                                    chunk_type, base + offset, length))
+        except struct.error, err:
+            raise Error('Bad blkx entry %s in %s: %s' %
+                        (name, self.filename, err))
+        self._partitions.append({
+            'name': name,
+            'offset': first_sector * SECTOR_SIZE,
+            'size': sector_count * SECTOR_SIZE,
+        })
+
+    def partitions(self):
+        """
+        Returns a list of dictionaries with the 'name', byte 'offset' and
+        'size' of every blkx entry, in block table order.
+        """
+        return [dict(partition) for partition in self._partitions]
+
+    def _chunk_data(self, index):
+        if index in self.cache:
+            data = self.cache.pop(index)
+            self.cache[index] = data
+            return data
+
+        (dummy_sector, sectors, chunk_type, offset, length) = self.chunks[index]
+        size = sectors * SECTOR_SIZE
+        self.fileobj.seek(offset)
+        data = self.fileobj.read(length)
+        if len(data) != length:
+            raise Error('%s is truncated' % self.filename)
+        try:
+            if chunk_type == CHUNK_RAW:
+                pass
+            elif chunk_type == CHUNK_ZLIB:
+                data = zlib.decompress(data)
+            elif chunk_type == CHUNK_BZIP2:
+                data = bz2.decompress(data)
+            elif chunk_type == CHUNK_ADC:
+                data = adc_decompress(data)
+            elif chunk_type == CHUNK_LZMA and lzma is not None:
+                data = lzma.decompress(data)
+            elif chunk_type == CHUNK_LZFSE and lzfse is not None:
+                data = lzfse.decompress(data)
+            else:
+                raise Error('Unsupported chunk type 0x%08x in %s' %
+                            (chunk_type, self.filename))
+        except (zlib.error, IOError, IndexError, ValueError), err:
+            raise Error('Unable to decompress chunk of %s: %s' %
+                        (self.filename, err))
+        if len(data) < size:
+            data += '\0' * (size - len(data))
+
+        self.cache[index] = data
+        if len(self.cache) > CHUNK_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(offset, 0)
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        """Reads up to size bytes of the uncompressed disk."""
+        end = self.size
+        if size >= 0:
+            end = min(end, self.position + size)
+        parts = []
+        while self.position < end:
+            sector = self.position // SECTOR_SIZE
+            index = bisect.bisect_right(self.chunk_starts, sector) - 1
+            if index < 0:
+                index = 0
+            (first, sectors) = self.chunks[index][:2]
+            chunk_start = first * SECTOR_SIZE
+            chunk_end = (first + sectors) * SECTOR_SIZE
+            if self.position < chunk_start:
+                # a gap between blkx entries reads as zeros
+                length = min(end, chunk_start) - self.position
+                parts.append('\0' * length)
+            elif self.position >= chunk_end:
+                following = self.chunk_starts[index + 1] * SECTOR_SIZE \
+                    if index + 1 < len(self.chunks) else end
+                length = min(end, following) - self.position
+                parts.append('\0' * length)
+            elif self.chunks[index][2] in ZERO_CHUNKS:
+                length = min(end, chunk_end) - self.position
+                parts.append('\0' * length)
+            else:
+                data = self._chunk_data(index)
+                start = self.position - chunk_start
+                length = min(end, chunk_end) - self.position
+                parts.append(data[start:start + length])
+            self.position += length
+        return ''.join(parts)
+
+    def close(self):
+        self.cache.clear()
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def openvolume(filename):
+    """
+    Opens the first HFS+ volume of a disk image. The returned
+    hfsplus.HFSVolume closes the image when it is closed.
+    """
+    image = DiskImage(filename)
+    try:
+        partitions = image.partitions()
+        # Prefer the partitions the image names as HFS, then probe the rest
+        partitions.sort(key=lambda partition: 'Apple_HFS' not in
+                        partition['name'])
+        apfs = False
+        for partition in partitions:
+            image.seek(partition['offset'] + hfsplus.HEADER_OFFSET)
+            if image.read(2) in hfsplus.SIGNATURES:
+                return hfsplus.HFSVolume(image, partition['offset'])
+            image.seek(partition['offset'] + 32)
+            if 'Apple_APFS' in partition['name'] or image.read(4) == 'NXSB':
+                apfs = True
+        if apfs:
+            raise Error('%s contains an APFS volume, which is not supported'
+                        % filename)
+        raise Error('%s contains no HFS+ volume' % filename)
+    except:
+        image.close()
+        raise
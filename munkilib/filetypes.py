@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+filetypes
+
+Identifies installer file formats from their contents rather than their
+names. A file is opened once; its first few KB and its last 512 bytes are
+enough to recognize every supported format.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import os
+import struct
+
+
+HEAD_SIZE = 2**12
+TRAILER_SIZE = 512
+
+# Root storage CLSID of Windows Installer databases, patches and transforms.
+MSI_CLSIDS = {
+    '\x84\x10\x0c\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00\x46': 'msi',
+    '\x86\x10\x0c\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00\x46': 'msp',
+    '\x82\x10\x0c\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00\x46': 'mst',
+}
+
+# MIME type reported for each file type.
+MIME_TYPES = {
+    'udif': 'application/x-apple-diskimage',
+    'xar': 'application/x-xar',
+    'zip': 'application/zip',
+    'pe': 'application/x-msdownload',
+    'mz': 'application/x-msdownload',
+    'msi': 'application/x-msdownload',
+    'msp': 'application/x-msdownload',
+    'mst': 'application/x-msdownload',
+    'ole': 'application/x-ole-storage',
+    'plist': 'application/x-plist',
+}
+
+
+def identify_pe(f, head):
+    """
+    Returns 'pe' if an MZ executable has a PE header, otherwise 'mz' (a DOS,
+    NE or LE executable).
+    """
+    if len(head) < 64:
+        return None
+    pe_offset = struct.unpack_from('<I', head, 0x3c)[0]
+    if pe_offset + 4 <= len(head):
+        signature = head[pe_offset:pe_offset + 4]
+    else:
+        f.seek(pe_offset)
+        signature = f.read(4)
+    if signature == 'PE\0\0':
+        return 'pe'
+    return 'mz'
+
+
+def identify_ole(f, head):
+    """Tells Windows Installer files from other OLE compound files."""
+    if len(head) < 512:
+        return 'ole'
+    sector_size = 1 << struct.unpack_from('<H', head, 0x1e)[0]
+    first_dir_sector = struct.unpack_from('<I', head, 0x30)[0]
+    if sector_size not in (512, 4096) or first_dir_sector > 0xfffffffa:
+        return 'ole'
+    offset = (first_dir_sector + 1) * sector_size
+    if offset + 128 <= len(head):
+        root = head[offset:offset + 128]
+    else:
+        f.seek(offset)
+        root = f.read(128)
+    return MSI_CLSIDS.get(root[80:96], 'ole')
+
+
+def identify(head, trailer, f=None):
+    """
+    Returns the file type for the first bytes and the last 512 bytes of a
+    file, or None if the format isn't recognized. f, if given, is used to
+    read the one extra header some formats need.
+    """
+    if len(trailer) >= 512 and trailer[-512:-508] == 'koly':
+        return 'udif'
+    if head.startswith('xar!'):
+        return 'xar'
+    if head[:4] in ('PK\x03\x04', 'PK\x05\x06', 'PK\x07\x08'):
+        return 'zip'
+    if head.startswith('MZ') and f is not None:
+        return identify_pe(f, head)
+    if head.startswith('\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        if f is None:
+            return 'ole'
+        return identify_ole(f, head)
+    if head.startswith('bplist'):
+        return 'plist'
+    text = head.lstrip('\xef\xbb\xbf \t\r\n')
+    if text.startswith('<?xml') or text.startswith('<!DOCTYPE plist') or \
+       text.startswith('<plist'):
+        if '<!DOCTYPE plist' in head or '<plist' in head:
+            return 'plist'
+    return None
+
+
+def classify(filename):
+    """
+    Returns a dictionary describing a file's format: 'type' (one of the
+    keys of MIME_TYPES, or None), 'mime' (or None) and 'size'. Directories
+    and unreadable files have a type of None.
+    """
+    descriptor = {'type': None, 'mime': None, 'size': None}
+    if not os.path.isfile(filename):
+        return descriptor
+
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return descriptor
+    try:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(HEAD_SIZE)
+        if size > len(head):
+            f.seek(max(size - TRAILER_SIZE, 0))
+            trailer = f.read(TRAILER_SIZE)
+        else:
+            trailer = head[-TRAILER_SIZE:]
+        try:
+            file_type = identify(head, trailer, f)
+        except struct.error:
+            file_type = None
+    finally:
+        f.close()
+
+    descriptor['type'] = file_type
+    descriptor['mime'] = MIME_TYPES.get(file_type)
+    descriptor['size'] = size
+    return descriptor
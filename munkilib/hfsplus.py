@@ -0,0 +1,472 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+hfsplus
+
+A read-only HFS+ (and HFSX) reader, enough to list a volume and read files
+from it without mounting it. The catalog B-tree is scanned once when the
+volume is opened; file contents, including files with HFS+ compression
+(decmpfs, zlib only), are read from their extents on demand.
+
+Paths are relative to the root of the volume, '/'-separated and UTF-8
+encoded, as os.walk() would return them below a mount point.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import cStringIO
+import stat
+import struct
+import zlib
+
+
+HEADER_OFFSET = 1024
+SIGNATURES = ('H+', 'HX')
+
+ROOT_FOLDER_ID = 2
+EXTENTS_FILE_ID = 3
+CATALOG_FILE_ID = 4
+ATTRIBUTES_FILE_ID = 8
+
+DATA_FORK = 0x00
+RESOURCE_FORK = 0xff
+
+FOLDER_RECORD = 1
+FILE_RECORD = 2
+
+NODE_INDEX = 0
+NODE_LEAF = -1
+
+# B-tree attribute: index nodes hold keys of varying length
+VARIABLE_INDEX_KEYS = 0x00000004
+
+# BSD owner flag marking a file stored with HFS+ compression
+UF_COMPRESSED = 0x20
+DECMPFS_XATTR = u'com.apple.decmpfs'.encode('utf-16-be')
+DECMPFS_MAGIC = 'fpmc'
+INLINE_ATTRIBUTE = 0x10
+
+HARDLINK_TYPE = 'hlnk'
+HARDLINK_CREATOR = 'hfs+'
+
+# Names the file system uses for its own bookkeeping at the volume root
+PRIVATE_NAMES = ('\0\0\0\0HFS+ Private Data', '.HFS+ Private Directory Data\r',
+                 '.journal', '.journal_info_block')
+
+MAX_SYMLINKS = 32
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def extents_key(key):
+    """Sort key of an extents overflow B-tree record."""
+    (fork_type, dummy_pad, file_id, start_block) = struct.unpack_from(
+        '>BBII', key)
+    return (file_id, fork_type, start_block)
+
+
+def attributes_key(key):
+    """Sort key of an attributes B-tree record."""
+    (dummy_pad, file_id, start_block, length) = struct.unpack_from(
+        '>HIIH', key)
+    return (file_id, key[12:12 + length * 2], start_block)
+
+
+class BTree(object):
+    """One of the B-trees of a volume: catalog, extents or attributes."""
+
+    def __init__(self, volume, fork, sort_key=None):
+        self.volume = volume
+        self.fork = fork
+        self.sort_key = sort_key
+        header = volume.read_fork(fork, 0, 106)
+        try:
+            (self.depth, self.root, dummy_leaf_records, self.first_leaf,
+             dummy_last_leaf, self.node_size, self.max_key_length,
+             dummy_total_nodes, dummy_free_nodes, dummy_reserved,
+             dummy_clump_size, dummy_type, dummy_compare_type,
+             self.attributes) = struct.unpack_from('>HIIIIHHIIHIBBI',
+                                                   header, 14)
+        except struct.error:
+            raise Error('Truncated B-tree header')
+        if self.node_size < 512:
+            raise Error('Bad B-tree node size %d' % self.node_size)
+
+    def node(self, number):
+        """Returns the kind, forward link and (key, value) records of a
+        node."""
+        data = self.volume.read_fork(
+            self.fork, number * self.node_size, self.node_size)
+        try:
+            (forward, dummy_backward, kind, dummy_height,
+             count) = struct.unpack_from('>IIbBH', data)
+            offsets = struct.unpack_from(
+                '>%dH' % (count + 1), data,
+                self.node_size - 2 * (count + 1))[::-1]
+            records = []
+            for i in xrange(count):
+                start = offsets[i]
+                key_length = struct.unpack_from('>H', data, start)[0]
+                key = data[start + 2:start + 2 + key_length]
+                if (kind == NODE_INDEX and
+                        not self.attributes & VARIABLE_INDEX_KEYS):
+                    key_length = self.max_key_length
+                records.append(
+                    (key, data[start + 2 + key_length:offsets[i + 1]]))
+        except struct.error:
+            raise Error('Corrupt B-tree node %d' % number)
+        return (kind, forward, records)
+
+    def records(self):
+        """Yields every leaf record, in key order."""
+        number = self.first_leaf
+        visited = set()
+        while number and number not in visited:
+            visited.add(number)
+            (kind, forward, records) = self.node(number)
+            if kind != NODE_LEAF:
+                raise Error('B-tree node %d is not a leaf' % number)
+            for record in records:
+                yield record
+            number = forward
+
+    def find(self, target):
+        """Returns the value of the leaf record whose sort key is target,
+        or None."""
+        try:
+            return self._find(target)
+        except struct.error:
+            raise Error('Corrupt B-tree record looking up %r' % (target, ))
+
+    def _find(self, target):
+        number = self.root
+        for dummy_level in xrange(max(self.depth, 1)):
+            if not number:
+                break
+            (kind, dummy_forward, records) = self.node(number)
+            if kind == NODE_LEAF:
+                for (key, value) in records:
+                    if self.sort_key(key) == target:
+                        return value
+                return None
+            if kind != NODE_INDEX:
+                raise Error('Unexpected B-tree node %d' % number)
+            number = None
+            for (key, value) in records:
+                if self.sort_key(key) > target:
+                    break
+                number = struct.unpack_from('>I', value)[0]
+        return None
+
+
+class HFSVolume(object):
+    """
+    An HFS+ volume starting at offset bytes into fileobj, which is closed
+    along with the volume. walk(), listdir(), read() and open() work like
+    their os and zipfile namesakes.
+    """
+
+    def __init__(self, fileobj, offset=0):
+        self.fileobj = fileobj
+        self.offset = offset
+        self.fileobj.seek(offset + HEADER_OFFSET)
+        header = self.fileobj.read(512)
+        if len(header) < 512 or header[:2] not in SIGNATURES:
+            raise Error('Not an HFS+ volume')
+        self.block_size = struct.unpack_from('>I', header, 40)[0]
+        if not self.block_size or self.block_size % 512:
+            raise Error('Bad HFS+ block size %d' % self.block_size)
+
+        self.extents_tree = None
+        self.extents_tree = BTree(
+            self, self.fork(header[192:272], EXTENTS_FILE_ID), extents_key)
+        self.catalog = BTree(
+            self, self.fork(header[272:352], CATALOG_FILE_ID))
+        self.attributes_tree = None
+        if struct.unpack_from('>Q', header, 352)[0]:
+            self.attributes_tree = BTree(
+                self, self.fork(header[352:432], ATTRIBUTES_FILE_ID),
+                attributes_key)
+        self._read_catalog()
+
+    def fork(self, data, file_id, fork_type=DATA_FORK):
+        """Returns the (size, extents) of an HFSPlusForkData structure,
+        looking up any extents that spilled into the overflow file."""
+        (size, dummy_clump_size, total_blocks) = struct.unpack_from(
+            '>QII', data)
+        values = struct.unpack_from('>16I', data, 16)
+        extents = [(values[i], values[i + 1]) for i in xrange(0, 16, 2)
+                   if values[i + 1]]
+        blocks = sum(count for (dummy_start, count) in extents)
+        while blocks < total_blocks:
+            record = None
+            if self.extents_tree is not None:
+                record = self.extents_tree.find((file_id, fork_type, blocks))
+            if not record:
+                raise Error('Missing extents for file %d' % file_id)
+            values = struct.unpack_from('>16I', record)
+            more = [(values[i], values[i + 1]) for i in xrange(0, 16, 2)
+                    if values[i + 1]]
+            if not more:
+                raise Error('Empty extents record for file %d' % file_id)
+            extents.extend(more)
+            blocks += sum(count for (dummy_start, count) in more)
+        return (size, extents)
+
+    def read_fork(self, fork, offset=0, length=None):
+        """Reads length bytes (or the rest) of a fork from offset."""
+        (size, extents) = fork
+        end = size if length is None else min(size, offset + length)
+        parts = []
+        position = offset
+        extent_start = 0
+        for (start_block, count) in extents:
+            extent_end = extent_start + count * self.block_size
+            if position < end and position < extent_end:
+                length = min(end, extent_end) - position
+                self.fileobj.seek(self.offset + start_block * self.block_size
+                                  + position - extent_start)
+                data = self.fileobj.read(length)
+                if len(data) != length:
+                    raise Error('Volume is truncated')
+                parts.append(data)
+                position += length
+            extent_start = extent_end
+        if position < end:
+            raise Error('Fork is shorter than its extents')
+        return ''.join(parts)
+
+    def _read_catalog(self):
+        self.entries = {}
+        self.names = {}
+        self.children = {}
+        hardlinks = []
+        for (key, value) in self.catalog.records():
+            try:
+                record_type = struct.unpack_from('>h', value)[0]
+                if record_type not in (FOLDER_RECORD, FILE_RECORD):
+                    continue
+                (parent, length) = struct.unpack_from('>IH', key)
+                name = key[6:6 + length * 2].decode('utf-16-be')
+                (cnid, ) = struct.unpack_from('>I', value, 8)
+                (owner_flags, mode, special) = struct.unpack_from(
+                    '>xBHI', value, 40)
+            except (struct.error, UnicodeDecodeError), err:
+                raise Error('Corrupt catalog record: %s' % err)
+            if record_type == FILE_RECORD and len(value) < 248:
+                raise Error('Truncated catalog record for file %d' % cnid)
+            # ':' is the path separator of the Carbon APIs and is stored
+            # as '/' on disk
+            name = name.replace(u'/', u':').encode('UTF-8')
+            entry = {
+                'name': name,
+                'parent': parent,
+                'isdir': record_type == FOLDER_RECORD,
+                'mode': mode,
+                'flags': owner_flags,
+                'id': cnid,
+            }
+            if record_type == FILE_RECORD:
+                entry['data'] = value[88:168]
+                entry['rsrc'] = value[168:248]
+                if value[48:56] == HARDLINK_TYPE + HARDLINK_CREATOR:
+                    hardlinks.append((entry, special))
+            self.entries[cnid] = entry
+            self.names[(parent, name)] = cnid
+            self.children.setdefault(parent, []).append(cnid)
+
+        # A hard link's contents live in an iNode file in a private folder
+        private = self.names.get((ROOT_FOLDER_ID, PRIVATE_NAMES[0]))
+        for (entry, inode) in hardlinks:
+            target = self.names.get((private, 'iNode%d' % inode))
+            if target in self.entries:
+                entry.update(
+                    dict((key, self.entries[target][key])
+                         for key in ('data', 'rsrc', 'mode', 'flags', 'id')))
+
+    def _lookup(self, path, follow=True):
+        """Returns the catalog entry for path, or None."""
+        parts = [part for part in path.split('/') if part not in ('', '.')]
+        cnid = ROOT_FOLDER_ID
+        links = 0
+        while parts:
+            part = parts.pop(0)
+            if part == '..':
+                if cnid != ROOT_FOLDER_ID:
+                    cnid = self.entries[cnid]['parent']
+                continue
+            child = self.names.get((cnid, part))
+            if child is None or (cnid == ROOT_FOLDER_ID and
+                                 part in PRIVATE_NAMES):
+                return None
+            entry = self.entries[child]
+            if stat.S_ISLNK(entry['mode']) and (parts or follow):
+                links += 1
+                if links > MAX_SYMLINKS:
+                    raise Error('Too many levels of symbolic links in %s'
+                                % path)
+                target = self._read_entry(entry)
+                if target.startswith('/'):
+                    # absolute links point outside the volume
+                    return None
+                parts = target.split('/') + parts
+                continue
+            if parts and not entry['isdir']:
+                return None
+            cnid = child
+        return self.entries.get(cnid)
+
+    def _read_entry(self, entry):
+        if entry['flags'] & UF_COMPRESSED:
+            return self._read_compressed(entry)
+        return self.read_fork(self.fork(entry['data'], entry['id']))
+
+    def _read_compressed(self, entry):
+        value = None
+        if self.attributes_tree is not None:
+            value = self.attributes_tree.find(
+                (entry['id'], DECMPFS_XATTR, 0))
+        if not value or struct.unpack_from('>I', value)[0] != \
+           INLINE_ATTRIBUTE:
+            raise Error('Missing compression header for file %d'
+                        % entry['id'])
+        size = struct.unpack_from('>I', value, 12)[0]
+        header = value[16:16 + size]
+        (magic, compression_type, uncompressed_size) = struct.unpack_from(
+            '<4sIQ', header)
+        if magic != DECMPFS_MAGIC:
+            raise Error('Bad compression header for file %d' % entry['id'])
+
+        try:
+            if compression_type == 1:
+                data = header[16:]
+            elif compression_type == 3:
+                # a low nibble of 0xf marks data stored uncompressed
+                if header[16:17] and ord(header[16]) & 0x0f == 0x0f:
+                    data = header[17:]
+                else:
+                    data = zlib.decompress(header[16:])
+            elif compression_type == 4:
+                rsrc = self.read_fork(
+                    self.fork(entry['rsrc'], entry['id'], RESOURCE_FORK))
+                data_offset = struct.unpack_from('>I', rsrc)[0] + 4
+                count = struct.unpack_from('<I', rsrc, data_offset)[0]
+                table = struct.unpack_from('<%dI' % (count * 2), rsrc,
+                                           data_offset + 4)
+                parts = []
+                for i in xrange(0, count * 2, 2):
+                    start = data_offset + table[i]
+                    block = rsrc[start:start + table[i + 1]]
+                    if block[:1] == '\xff':
+                        parts.append(block[1:])
+                    else:
+                        parts.append(zlib.decompress(block))
+                data = ''.join(parts)
+            else:
+                raise Error('Unsupported compression type %d for file %d'
+                            % (compression_type, entry['id']))
+        except (zlib.error, struct.error), err:
+            raise Error('Unable to decompress file %d: %s'
+                        % (entry['id'], err))
+        return data[:uncompressed_size]
+
+    def _listing(self, entry):
+        names = []
+        for cnid in self.children.get(entry['id'], []):
+            name = self.entries[cnid]['name']
+            if entry['id'] == ROOT_FOLDER_ID and name in PRIVATE_NAMES:
+                continue
+            names.append(name)
+        return names
+
+    def exists(self, path):
+        return self._lookup(path) is not None
+
+    def isdir(self, path):
+        entry = self._lookup(path)
+        return entry is not None and entry['isdir']
+
+    def isfile(self, path):
+        entry = self._lookup(path)
+        return entry is not None and not entry['isdir']
+
+    def islink(self, path):
+        entry = self._lookup(path, follow=False)
+        return entry is not None and stat.S_ISLNK(entry['mode'])
+
+    def listdir(self, path):
+        """Returns the names in a directory, in catalog order."""
+        entry = self._lookup(path)
+        if entry is None or not entry['isdir']:
+            raise Error('No such directory: %s' % path)
+        return self._listing(entry)
+
+    def walk(self, top=''):
+        """
+        Like os.walk(top) without following links: yields (dirpath,
+        dirnames, filenames) top-down, and dirnames may be pruned in place.
+        Symbolic links are listed among the files.
+        """
+        entry = self._lookup(top)
+        if entry is None or not entry['isdir']:
+            return
+        dirnames = []
+        filenames = []
+        for cnid in self.children.get(entry['id'], []):
+            child = self.entries[cnid]
+            if entry['id'] == ROOT_FOLDER_ID and child['name'] in PRIVATE_NAMES:
+                continue
+            if child['isdir']:
+                dirnames.append(child['name'])
+            else:
+                filenames.append(child['name'])
+        yield (top, dirnames, filenames)
+        for name in dirnames:
+            for result in self.walk(top + '/' + name if top else name):
+                yield result
+
+    def namelist(self):
+        """Returns every path on the volume, directories ending in '/'."""
+        names = []
+        for (dirpath, dirnames, filenames) in self.walk():
+            prefix = dirpath + '/' if dirpath else ''
+            names.extend(prefix + name + '/' for name in dirnames)
+            names.extend(prefix + name for name in filenames)
+        return names
+
+    def read(self, path):
+        """Returns the contents of a file."""
+        entry = self._lookup(path)
+        if entry is None or entry['isdir']:
+            raise Error('No such file: %s' % path)
+        return self._read_entry(entry)
+
+    def open(self, path):
+        """Returns a file object with the contents of a file."""
+        return cStringIO.StringIO(self.read(path))
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,416 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+msiinfo
+
+Reads the Property table and SummaryInformation stream of Windows Installer
+(.msi) databases.
+
+MSI files are OLE compound files. Only the header, the directory, the
+allocation table sectors on the way to the wanted streams and the streams
+themselves are read; embedded cabinets are never touched, so the cost of a
+lookup does not grow with the size of the package.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import struct
+
+
+OLE_SIGNATURE = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Special sector numbers in the allocation tables.
+MAXREGSECT = 0xfffffffa
+ENDOFCHAIN = 0xfffffffe
+FREESECT = 0xffffffff
+NOSTREAM = 0xffffffff
+
+STORAGE = 1
+STREAM = 2
+ROOT_STORAGE = 5
+
+# Upper bound on the length of a sector chain, as a guard against loops.
+MAX_CHAIN_LENGTH = 2**22
+
+# Characters of the base64-like alphabet MSI uses to compress stream names.
+STREAM_NAME_CHARS = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                     'abcdefghijklmnopqrstuvwxyz._')
+
+SUMMARY_INFORMATION = u'\x05SummaryInformation'
+
+# SummaryInformation property IDs and the names they are returned under.
+SUMMARY_PROPERTIES = {
+    2: 'title',
+    3: 'subject',
+    4: 'author',
+    5: 'keywords',
+    6: 'comments',
+    7: 'template',
+    9: 'revision_number',
+    14: 'page_count',
+    15: 'word_count',
+    18: 'creating_application',
+}
+
+VT_I2 = 2
+VT_I4 = 3
+VT_LPSTR = 30
+VT_FILETIME = 64
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def decodestreamname(name):
+    """Decodes a compressed MSI stream name; tables get a '!' prefix."""
+    decoded = []
+    for char in name:
+        code = ord(char)
+        if 0x3800 <= code < 0x4800:
+            code -= 0x3800
+            decoded.append(STREAM_NAME_CHARS[code & 0x3f])
+            decoded.append(STREAM_NAME_CHARS[(code >> 6) & 0x3f])
+        elif 0x4800 <= code < 0x4840:
+            decoded.append(STREAM_NAME_CHARS[code - 0x4800])
+        elif code == 0x4840:
+            decoded.append(u'!')
+        else:
+            decoded.append(char)
+    return u''.join(decoded)
+
+
+def pythoncodec(codepage):
+    """Returns the Python codec for a Windows code page."""
+    if codepage == 65001:
+        return 'utf-8'
+    if codepage in (0, 1200):
+        return 'cp1252'
+    return 'cp%d' % codepage
+
+
+class CompoundFile(object):
+    """
+    Read-only access to the streams of an OLE compound file. Allocation
+    table sectors are loaded one at a time as chains are followed.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        header = self._read(0, 512)
+        if header[:8] != OLE_SIGNATURE:
+            raise Error('Not an OLE compound file')
+
+        (sector_shift, mini_sector_shift) = struct.unpack_from(
+            '<HH', header, 0x1e)
+        if sector_shift not in (9, 12) or mini_sector_shift != 6:
+            raise Error('Unsupported sector size')
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+        self.entries_per_sector = self.sector_size / 4
+
+        (self.first_dir_sector, _, self.mini_stream_cutoff,
+         self.first_minifat_sector, self.num_minifat_sectors,
+         self.first_difat_sector, self.num_difat_sectors) = struct.unpack_from(
+             '<7I', header, 0x30)
+        self.difat = list(struct.unpack_from('<109I', header, 0x4c))
+        self._next_difat_sector = self.first_difat_sector
+
+        self._fat = {}
+        self._minifat = None
+        self._mini_stream_chain = None
+        self.entries = self._read_directory()
+        self.root = self.entries[0]
+
+    def _read(self, offset, size):
+        self.fileobj.seek(offset)
+        data = self.fileobj.read(size)
+        if len(data) != size:
+            raise Error('Truncated file reading %d bytes at %d' %
+                        (size, offset))
+        return data
+
+    def _sector(self, sector):
+        if sector > MAXREGSECT:
+            raise Error('Bad sector number: %#x' % sector)
+        return self._read((sector + 1) * self.sector_size, self.sector_size)
+
+    def _fat_sector_location(self, index):
+        """Returns the sector holding the index'th block of the FAT."""
+        while index >= len(self.difat):
+            if self._next_difat_sector > MAXREGSECT:
+                raise Error('FAT sector %d is missing from the DIFAT' % index)
+            entries = struct.unpack('<%dI' % self.entries_per_sector,
+                                    self._sector(self._next_difat_sector))
+            self.difat.extend(entries[:-1])
+            self._next_difat_sector = entries[-1]
+        return self.difat[index]
+
+    def _next(self, sector):
+        """Returns the sector after sector in its FAT chain."""
+        (index, position) = divmod(sector, self.entries_per_sector)
+        if index not in self._fat:
+            self._fat[index] = struct.unpack(
+                '<%dI' % self.entries_per_sector,
+                self._sector(self._fat_sector_location(index)))
+        return self._fat[index][position]
+
+    def _chain(self, start, length=None):
+        """
+        Returns the list of sectors starting at start, stopping early once
+        length sectors are known.
+        """
+        chain = []
+        sector = start
+        while sector != ENDOFCHAIN and (length is None or len(chain) < length):
+            if sector > MAXREGSECT or len(chain) > MAX_CHAIN_LENGTH:
+                raise Error('Corrupt sector chain at %#x' % sector)
+            chain.append(sector)
+            sector = self._next(sector)
+        return chain
+
+    def _read_chain(self, start, size):
+        sectors = -(-size // self.sector_size)
+        data = ''.join([self._sector(sector)
+                        for sector in self._chain(start, sectors)])
+        return data[:size]
+
+    def _read_directory(self):
+        entries = []
+        for sector in self._chain(self.first_dir_sector):
+            data = self._sector(sector)
+            for offset in range(0, self.sector_size, 128):
+                (name, name_length, entry_type, _, left, right,
+                 child) = struct.unpack_from('<64sHBBIII', data, offset)
+                (start, size) = struct.unpack_from('<IQ', data, offset + 116)
+                if self.sector_size == 512:
+                    # version 3 files may leave garbage in the high bits
+                    size &= 0xffffffff
+                entries.append({
+                    'name': name[:max(name_length - 2, 0)].decode(
+                        'utf-16-le', 'replace'),
+                    'type': entry_type,
+                    'left': left,
+                    'right': right,
+                    'child': child,
+                    'start': start,
+                    'size': size,
+                })
+        if not entries or entries[0]['type'] != ROOT_STORAGE:
+            raise Error('Missing root storage')
+        return entries
+
+    def listdir(self, storage=None):
+        """Returns the directory entries directly inside a storage."""
+        storage = storage or self.root
+        children = []
+        pending = [storage['child']]
+        while pending:
+            index = pending.pop()
+            if index == NOSTREAM or index >= len(self.entries):
+                continue
+            entry = self.entries[index]
+            children.append(entry)
+            pending.extend([entry['left'], entry['right']])
+            if len(children) > len(self.entries):
+                raise Error('Corrupt directory tree')
+        return children
+
+    def _read_mini(self, start, size):
+        if self._minifat is None:
+            data = self._read_chain(self.first_minifat_sector,
+                                    self.num_minifat_sectors * self.sector_size)
+            self._minifat = struct.unpack('<%dI' % (len(data) / 4), data)
+            self._mini_stream_chain = []
+
+        per_sector = self.sector_size / self.mini_sector_size
+        chunks = []
+        sector = start
+        while sector != ENDOFCHAIN and len(chunks) * self.mini_sector_size < size:
+            if sector >= len(self._minifat) or len(chunks) > MAX_CHAIN_LENGTH:
+                raise Error('Corrupt mini sector chain at %#x' % sector)
+            (index, position) = divmod(sector, per_sector)
+            if index >= len(self._mini_stream_chain):
+                self._mini_stream_chain = self._chain(self.root['start'],
+                                                      index + 1)
+            offset = ((self._mini_stream_chain[index] + 1) * self.sector_size
+                      + position * self.mini_sector_size)
+            chunks.append(self._read(offset, self.mini_sector_size))
+            sector = self._minifat[sector]
+        return ''.join(chunks)[:size]
+
+    def read(self, entry):
+        """Returns the contents of a stream directory entry."""
+        if entry['type'] != STREAM:
+            raise Error('%s is not a stream' % entry['name'])
+        if entry['size'] < self.mini_stream_cutoff:
+            return self._read_mini(entry['start'], entry['size'])
+        return self._read_chain(entry['start'], entry['size'])
+
+
+def readsummaryinformation(data):
+    """
+    Parses a SummaryInformation property set stream into a dictionary keyed
+    by the names in SUMMARY_PROPERTIES.
+    """
+    info = {}
+    if len(data) < 48 or struct.unpack_from('<H', data)[0] != 0xfffe:
+        return info
+    section = struct.unpack_from('<I', data, 44)[0]
+    (_, count) = struct.unpack_from('<II', data, section)
+    if section + 8 + count * 8 > len(data):
+        raise Error('Corrupt SummaryInformation property count')
+
+    properties = {}
+    for i in range(count):
+        (property_id, offset) = struct.unpack_from('<II', data,
+                                                   section + 8 + i * 8)
+        position = section + offset
+        value_type = struct.unpack_from('<I', data, position)[0] & 0xffff
+        if value_type == VT_I2:
+            properties[property_id] = struct.unpack_from(
+                '<h', data, position + 4)[0]
+        elif value_type == VT_I4:
+            properties[property_id] = struct.unpack_from(
+                '<i', data, position + 4)[0]
+        elif value_type == VT_LPSTR:
+            length = struct.unpack_from('<I', data, position + 4)[0]
+            properties[property_id] = data[
+                position + 8:position + 8 + length].split('\0', 1)[0]
+        elif value_type == VT_FILETIME:
+            properties[property_id] = struct.unpack_from(
+                '<Q', data, position + 4)[0]
+
+    codec = pythoncodec(properties.get(1, 0) & 0xffff)
+    for (property_id, name) in SUMMARY_PROPERTIES.items():
+        value = properties.get(property_id)
+        if isinstance(value, str):
+            value = value.decode(codec, 'replace')
+        if value is not None:
+            info[name] = value
+    return info
+
+
+class MsiDatabase(object):
+    """The string pool and tables of an MSI database."""
+
+    def __init__(self, fileobj):
+        self.compound_file = CompoundFile(fileobj)
+        self.streams = {}
+        for entry in self.compound_file.listdir():
+            if entry['type'] == STREAM:
+                self.streams[decodestreamname(entry['name'])] = entry
+        self._strings = None
+
+    def stream(self, name):
+        """Returns the contents of a stream, or None if it doesn't exist."""
+        if name not in self.streams:
+            return None
+        return self.compound_file.read(self.streams[name])
+
+    def strings(self):
+        """Returns the string pool as a list indexed by string ID."""
+        if self._strings is not None:
+            return self._strings
+
+        pool = self.stream(u'!_StringPool') or ''
+        data = self.stream(u'!_StringData') or ''
+        words = struct.unpack('<%dH' % (len(pool) / 2), pool[:len(pool) & ~1])
+        if len(words) < 2:
+            raise Error('Missing string pool')
+        codec = pythoncodec(words[0] | ((words[1] & 0x7fff) << 16))
+        self.string_ref_size = 3 if words[1] & 0x8000 else 2
+
+        strings = [u'']
+        offset = 0
+        i = 2
+        while i + 1 < len(words):
+            (length, refs) = (words[i], words[i + 1])
+            if length == 0 and refs == 0:
+                strings.append(u'')
+                i += 2
+                continue
+            if length == 0 and i + 3 < len(words):
+                # strings over 64KB store the high word of their length in
+                # the reference count of a preceding empty entry
+                length = (words[i + 3] << 16) + words[i + 2]
+                i += 4
+            else:
+                i += 2
+            strings.append(data[offset:offset + length].decode(codec, 'replace'))
+            offset += length
+        self._strings = strings
+        return strings
+
+    def properties(self):
+        """Returns the Property table as a dictionary."""
+        strings = self.strings()
+        data = self.stream(u'!Property') or ''
+        size = self.string_ref_size
+        rows = len(data) / (2 * size)
+
+        def column(offset):
+            refs = []
+            for row in range(rows):
+                position = offset + row * size
+                ref = struct.unpack_from('<H', data, position)[0]
+                if size == 3:
+                    ref += ord(data[position + 2]) << 16
+                refs.append(ref)
+            return refs
+
+        properties = {}
+        for (name, value) in zip(column(0), column(rows * size)):
+            if 0 < name < len(strings) and value < len(strings):
+                properties[strings[name]] = strings[value]
+        return properties
+
+    def summaryinformation(self):
+        """Returns the SummaryInformation properties as a dictionary."""
+        if SUMMARY_INFORMATION not in self.streams:
+            return {}
+        return readsummaryinformation(self.stream(SUMMARY_INFORMATION))
+
+
+def getmsiinfo(filename):
+    """
+    Returns a dictionary describing an MSI package: ProductName,
+    ProductVersion, ProductCode, UpgradeCode and Manufacturer from the
+    Property table (where present), the whole table under 'properties'
+    and the SummaryInformation stream under 'summary'.
+
+    Raises Error if the file isn't a readable MSI database.
+    """
+    f = open(filename, 'rb')
+    try:
+        try:
+            database = MsiDatabase(f)
+            properties = database.properties()
+            summary = database.summaryinformation()
+        except (struct.error, IndexError, LookupError), err:
+            # LookupError: a code page Python has no codec for
+            raise Error('Malformed MSI database: %s' % err)
+    finally:
+        f.close()
+
+    info = {'properties': properties, 'summary': summary}
+    for name in ['ProductName', 'ProductVersion', 'ProductCode',
+                 'UpgradeCode', 'Manufacturer']:
+        if name in properties:
+            info[name] = properties[name]
+    return info
@@ -45,6 +45,9 @@ from distutils import version
 from types import StringType
 from xml.dom import minidom
 
+import bomfile
+import digests
+import xarfile
 import munkistatus
 import FoundationPlist
 
@@ -1044,13 +1047,9 @@ def gethash(filename, hash_function):
     if not os.path.isfile(filename):
         return 'NOT A FILE'
 
-    f = open(filename, 'rb')
-    while 1:
-        chunk = f.read(2**16)
-        if not chunk:
-            break
-        hash_function.update(chunk)
-    f.close()
+    # always read the bytes; this is what integrity checks rely on, so
+    # it must not be answered from the digest cache
+    digests.hashfile(filename, [hash_function])
     return hash_function.hexdigest()
 
 
@@ -1203,13 +1202,16 @@ def pref(pref_name):
         'AppleSoftwareUpdatesOnly': False,
         'SoftwareUpdateServerURL': '',
         'DaysBetweenNotifications': 1,
-        'LastNotifiedDate': NSDate.dateWithTimeIntervalSince1970_(0),
+        'LastNotifiedDate': NSDate and NSDate.dateWithTimeIntervalSince1970_(0),
         'UseClientCertificate': False,
         'SuppressUserNotification': False,
         'SuppressAutoInstall': False,
         'SuppressStopButtonOnInstall': False,
         'PackageVerificationMode': 'hash'
     }
+    if CFPreferencesCopyAppValue is None:
+        # no CoreFoundation preferences (not on OS X), so use the defaults
+        return default_prefs.get(pref_name)
     pref_value = CFPreferencesCopyAppValue(pref_name, BUNDLE_ID)
     if pref_value == None:
         pref_value = default_prefs.get(pref_name)
@@ -1229,6 +1231,10 @@ def pref(pref_name):
 def getInstallerPkgInfo(filename):
     """Uses Apple's installer tool to get basic info
     about an installer item."""
+    if not os.path.exists('/usr/sbin/installer') and os.path.isfile(filename):
+        # no installer tool (e.g. not on OS X); read a flat package directly
+        return getFlatPkgInstallerInfo(filename)
+
     installerinfo = {}
     proc = subprocess.Popen(['/usr/sbin/installer', '-pkginfo', '-verbose',
                              '-plist', '-pkg', filename],
@@ -1277,6 +1283,56 @@ def getInstallerPkgInfo(filename):
     return installerinfo
 
 
+def getFlatPkgInstallerInfo(filename):
+    """Gets the same basic info as getInstallerPkgInfo from the
+    Distribution or PackageInfo file of a flat package, without
+    Apple's installer tool."""
+    installerinfo = {}
+    restart_actions = {'restart': 'RequireRestart',
+                       'logout': 'RequireLogout',
+                       'shutdown': 'RequireShutdown'}
+    try:
+        archive = xarfile.XarArchive(filename)
+        try:
+            toc = archive.namelist()
+            if 'Distribution' in toc:
+                dom = minidom.parseString(archive.read('Distribution'))
+            elif 'PackageInfo' in toc:
+                dom = minidom.parseString(archive.read('PackageInfo'))
+            else:
+                return installerinfo
+        finally:
+            archive.close()
+    except (xarfile.Error, IOError), err:
+        display_error('Unable to read %s: %s' % (filename, err))
+        return None
+
+    installed_size = 0
+    for ref in dom.getElementsByTagName('pkg-ref'):
+        if ref.getAttribute('installKBytes'):
+            installed_size += int(ref.getAttribute('installKBytes'))
+        action = ref.getAttribute('onConclusion')
+        if action and action != 'None':
+            installerinfo['RestartAction'] = action
+    for ref in dom.getElementsByTagName('pkg-info'):
+        action = restart_actions.get(ref.getAttribute('postinstall-action'))
+        if action:
+            installerinfo['RestartAction'] = action
+        for payload in ref.getElementsByTagName('payload'):
+            if payload.getAttribute('installKBytes'):
+                installed_size += int(payload.getAttribute('installKBytes'))
+    if installed_size:
+        installerinfo['installed_size'] = installed_size
+
+    installerinfo['description'] = ''
+    for tag, key in [('title', 'display_name'), ('description', 'description')]:
+        elements = dom.getElementsByTagName(tag)
+        if elements and elements[0].firstChild:
+            installerinfo[key] = elements[0].firstChild.wholeText.strip()
+
+    return installerinfo
+
+
 class MunkiLooseVersion(version.LooseVersion):
     '''Subclass version.LooseVersion to compare things like
     "10.6" and "10.6.0" as equal'''
@@ -1312,6 +1368,57 @@ class MunkiLooseVersion(version.LooseVersion):
         return cmp(self_cmp_version, other_cmp_version)
 
 
+# Parsed version keys, by version string. Keys used since the cache last
+# filled up are in _version_keys; _old_version_keys holds the generation
+# before, so the least recently used keys are the ones dropped.
+VERSION_KEY_CACHE_SIZE = 10000
+_version_keys = {}
+_old_version_keys = {}
+
+
+def _parseVersionKey(vstring):
+    """Parses vstring the way MunkiLooseVersion does and drops trailing
+    zero components"""
+    if vstring is None:
+        vstring = ''
+    elif isinstance(vstring, unicode):
+        vstring = vstring.encode('UTF-8')
+    components = [component for component in
+                  version.LooseVersion.component_re.split(str(vstring))
+                  if component and component != '.']
+    for index, component in enumerate(components):
+        try:
+            components[index] = int(component)
+        except ValueError:
+            pass
+    while components and components[-1] == 0:
+        components.pop()
+    return tuple(components)
+
+
+def versionSortKey(vstring):
+    """Returns a tuple that compares the way MunkiLooseVersion(vstring)
+    does: its components without trailing zeros, so "10.6" and "10.6.0"
+    get the same key. Suitable as a key= function for sorting. Keys are
+    cached, so a version string is only parsed once"""
+    global _version_keys, _old_version_keys
+    try:
+        return _version_keys[vstring]
+    except KeyError:
+        pass
+    except TypeError:
+        # unhashable; MunkiLooseVersion would use its str()
+        return _parseVersionKey(vstring)
+    key = _old_version_keys.get(vstring)
+    if key is None:
+        key = _parseVersionKey(vstring)
+    if len(_version_keys) >= VERSION_KEY_CACHE_SIZE:
+        _old_version_keys = _version_keys
+        _version_keys = {}
+    _version_keys[vstring] = key
+    return key
+
+
 def padVersionString(versString, tupleCount):
     """Normalize the format of a version string"""
     if versString == None:
@@ -1437,11 +1544,16 @@ def getBundleVersion(bundlepath, key=None):
     return '0.0.0.0.0'
 
 
-def parsePkgRefs(filename, path_to_pkg=None):
+def parsePkgRefs(filename, path_to_pkg=None, data=None):
     """Parses a .dist or PackageInfo file looking for pkg-ref or pkg-info tags
-    to get info on included sub-packages"""
+    to get info on included sub-packages. If data is given, it is parsed
+    instead of reading filename, which is then only used to resolve
+    relative package paths."""
     info = []
-    dom = minidom.parse(filename)
+    if data is not None:
+        dom = minidom.parseString(data)
+    else:
+        dom = minidom.parse(filename)
     pkgrefs = dom.getElementsByTagName('pkg-info')
     if pkgrefs:
         # this is a PackageInfo file
@@ -1522,70 +1634,57 @@ def getFlatPackageInfo(pkgpath):
     """
 
     infoarray = []
-    # get the absolute path to the pkg because we need to do a chdir later
+    # get the absolute path to the pkg; archive members are given paths
+    # inside it, so relative references never resolve to files on disk
     abspkgpath = os.path.abspath(pkgpath)
-    # make a tmp dir to expand the flat package into
-    pkgtmp = tempfile.mkdtemp(dir=tmpdir())
-    # record our current working dir
-    cwd = os.getcwd()
-    # change into our tmpdir so we can use xar to unarchive the flat package
-    os.chdir(pkgtmp)
-    # Get the TOC of the flat pkg so we can search it later
-    cmd_toc = ['/usr/bin/xar', '-tf', abspkgpath]
-    proc = subprocess.Popen(cmd_toc, bufsize=-1, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    (toc, err) = proc.communicate()
-    toc = toc.strip().split('\n')
-    if proc.returncode == 0:
+    try:
+        archive = xarfile.XarArchive(abspkgpath)
+    except (xarfile.Error, IOError), err:
+        display_warning(str(err))
+        return infoarray
+
+    try:
+        # Get the TOC of the flat pkg so we can search it later
+        toc = archive.namelist()
         # Walk trough the TOC entries
         for toc_entry in toc:
-            # If the TOC entry is a top-level PackageInfo, extract it
+            # If the TOC entry is a top-level PackageInfo, parse it
             if toc_entry.startswith('PackageInfo') and len(infoarray) == 0:
-                cmd_extract = ['/usr/bin/xar', '-xf', abspkgpath, toc_entry]
-                result = subprocess.call(cmd_extract)
-                if result == 0:
-                    packageinfoabspath = os.path.abspath(
-                        os.path.join(pkgtmp, toc_entry))
-                    infoarray = parsePkgRefs(packageinfoabspath)
+                try:
+                    infoarray = parsePkgRefs(
+                        os.path.join(abspkgpath, toc_entry),
+                        data=archive.read(toc_entry))
                     break
-                else:
+                except xarfile.Error, err:
                     display_warning("An error occurred while extracting %s: %s"
                                     % (toc_entry, err))
             # If there are PackageInfo files elsewhere, gather them up
             elif toc_entry.endswith('.pkg/PackageInfo'):
-                cmd_extract = ['/usr/bin/xar', '-xf', abspkgpath, toc_entry]
-                result = subprocess.call(cmd_extract)
-                if result == 0:
-                    packageinfoabspath = os.path.abspath(
-                        os.path.join(pkgtmp, toc_entry))
-                    infoarray.extend(parsePkgRefs(packageinfoabspath))
-                else:
+                try:
+                    infoarray.extend(parsePkgRefs(
+                        os.path.join(abspkgpath, toc_entry),
+                        data=archive.read(toc_entry)))
+                except xarfile.Error, err:
                     display_warning("An error occurred while extracting %s: %s"
                                     % (toc_entry, err))
         if len(infoarray) == 0:
             for toc_entry in [item for item in toc
                               if item.startswith('Distribution')]:
-                # Extract the Distribution file
-                cmd_extract = ['/usr/bin/xar', '-xf', abspkgpath, toc_entry]
-                result = subprocess.call(cmd_extract)
-                if result == 0:
-                    distributionabspath = os.path.abspath(
-                        os.path.join(pkgtmp, toc_entry))
-                    infoarray = parsePkgRefs(distributionabspath,
-                                             path_to_pkg=pkgpath)
+                # Parse the Distribution file
+                try:
+                    infoarray = parsePkgRefs(
+                        os.path.join(abspkgpath, toc_entry),
+                        path_to_pkg=pkgpath, data=archive.read(toc_entry))
                     break
-                else:
+                except xarfile.Error, err:
                     display_warning("An error occurred while extracting %s: %s"
                                     % (toc_entry, err))
 
         if len(infoarray) == 0:
             display_warning('No valid Distribution or PackageInfo found.')
-    else:
-        display_warning(err)
+    finally:
+        archive.close()
 
-    # change back to original working dir
-    os.chdir(cwd)
-    shutil.rmtree(pkgtmp)
     return infoarray
 
 
@@ -1603,13 +1702,12 @@ def getBomList(pkgpath):
                 bompath = os.path.join(pkgpath, 'Contents', 'Resources', item)
                 break
     if bompath:
-        proc = subprocess.Popen(['/usr/bin/lsbom', '-s', bompath],
-                                shell=False, stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        (output, dummy_err) = proc.communicate()
-        if proc.returncode == 0:
-            return output.splitlines()
+        try:
+            return [path.encode('UTF-8')
+                    for (path, dummy_mode, dummy_uid, dummy_gid)
+                    in bomfile.readbom(bompath)]
+        except (bomfile.Error, IOError), err:
+            display_warning('Unable to read %s: %s' % (bompath, err))
     return []
 
 
@@ -1784,8 +1882,8 @@ def getInstalledPackageVersion(pkgid):
                     foundbundleid = infoitem['packageid']
                     foundvers = infoitem['version']
                     if pkgid == foundbundleid:
-                        if (MunkiLooseVersion(foundvers) >
-                                MunkiLooseVersion(highestversion)):
+                        if (versionSortKey(foundvers) >
+                                versionSortKey(highestversion)):
                             highestversion = foundvers
 
         if highestversion != '0':
@@ -1929,8 +2027,8 @@ def getPackageMetaData(pkgitem):
     highestpkgversion = '0.0'
     installedsize = 0
     for infoitem in receiptinfo:
-        if (MunkiLooseVersion(infoitem['version']) >
-                MunkiLooseVersion(highestpkgversion)):
+        if (versionSortKey(infoitem['version']) >
+                versionSortKey(highestpkgversion)):
             highestpkgversion = infoitem['version']
         if 'installed_size' in infoitem:
             # note this is in KBytes
@@ -2255,12 +2353,15 @@ def getSPApplicationData():
 # we save APPDATA in a global to avoid querying LaunchServices more than
 # once per session
 APPDATA = None
+# lookup tables over APPDATA built by getAppDataIndex()
+APPDATA_INDEXES = {}
 def getAppData():
     """Gets info on currently installed apps.
     Returns a list of dicts containing path, name, version and bundleid"""
     global APPDATA
     if APPDATA is None:
         APPDATA = []
+        APPDATA_INDEXES.clear()
         display_debug1('Getting info on currently installed applications...')
         applist = set(getLSInstalledApplications())
         applist.update(getSpotlightInstalledApplications())
@@ -2293,6 +2394,28 @@ def getAppData():
     return APPDATA
 
 
+def getAppDataIndex(include_user_apps=False):
+    """Returns the apps from getAppData() indexed for lookups.
+    Returns a dict with 'bundleid' and 'name' dicts, each mapping a value
+    to the list of apps that have it, in getAppData() order. Apps in /Users
+    but not /Users/Shared are left out unless include_user_apps is True"""
+    appdata = getAppData()
+    if include_user_apps not in APPDATA_INDEXES:
+        index = {'bundleid': {}, 'name': {}}
+        for item in appdata:
+            if not include_user_apps:
+                if (item['path'].startswith('/Users/') and
+                        not item['path'].startswith('/Users/Shared/')):
+                    display_debug2('Skipped app %s with path %s',
+                                   item['name'], item['path'])
+                    continue
+            if item['bundleid']:
+                index['bundleid'].setdefault(item['bundleid'], []).append(item)
+            index['name'].setdefault(item['name'], []).append(item)
+        APPDATA_INDEXES[include_user_apps] = index
+    return APPDATA_INDEXES[include_user_apps]
+
+
 def getRunningProcesses():
     """Returns a list of paths of running processes"""
     proc = subprocess.Popen(['/bin/ps', '-axo' 'comm='],
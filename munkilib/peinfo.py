@@ -0,0 +1,353 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+peinfo
+
+Reads the version resource of Windows PE (.exe/.dll) files, and recognizes
+common installer wrappers, without parsing the rest of the image.
+
+Only the headers, the resource directory entries leading to VS_VERSIONINFO,
+the version resource itself and the start of any overlay are read, so the
+amount of I/O does not depend on the size of the file.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import struct
+
+
+# Upper bounds on how much of a file is read for each structure.
+MAX_SECTIONS = 96
+MAX_RESOURCE_ENTRIES = 4096
+MAX_VERSIONINFO_SIZE = 2**16
+# VS_VERSIONINFO -> StringFileInfo -> StringTable -> String
+MAX_VERSIONINFO_DEPTH = 8
+OVERLAY_SCAN_SIZE = 2**12
+
+RT_VERSION = 16
+VS_FIXEDFILEINFO_SIGNATURE = 0xFEEF04BD
+OLE_SIGNATURE = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+MACHINES = {
+    0x014c: 'x86',
+    0x0200: 'IA64',
+    0x01c0: 'ARM',
+    0x01c4: 'ARM',
+    0x8664: 'x64',
+    0xaa64: 'ARM64',
+}
+
+SUBSYSTEMS = {
+    1: 'Native',
+    2: 'Windows GUI',
+    3: 'Windows CUI',
+    9: 'Windows CE GUI',
+}
+
+# Command line arguments for an unattended install, by installer type.
+SILENT_ARGS = {
+    'nsis': '/S',
+    'inno': '/VERYSILENT /SUPPRESSMSGBOXES /NORESTART',
+    'installshield': '/s /v"/qn"',
+    'wixburn': '/quiet /norestart',
+    'msi': '/qn',
+}
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def readat(fileobj, offset, size):
+    """Reads exactly size bytes at offset, or raises Error."""
+    fileobj.seek(offset)
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise Error('Truncated file reading %d bytes at %d' % (size, offset))
+    return data
+
+
+def align(offset):
+    """Rounds offset up to the next 32 bit boundary."""
+    return (offset + 3) & ~3
+
+
+def formatversion(most, least):
+    """Formats a VS_FIXEDFILEINFO version pair as a.b.c.d."""
+    return '%d.%d.%d.%d' % (most >> 16, most & 0xffff,
+                            least >> 16, least & 0xffff)
+
+
+class PEImage(object):
+    """
+    The headers and section table of a PE file, read on creation. Other
+    structures are only read when asked for.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        fileobj.seek(0, 2)
+        self.filesize = fileobj.tell()
+
+        dos_header = readat(fileobj, 0, 64)
+        if dos_header[:2] != 'MZ':
+            raise Error('Not an MZ executable')
+        self.dos_header = dos_header
+        pe_offset = struct.unpack_from('<I', dos_header, 0x3c)[0]
+        if readat(fileobj, pe_offset, 4) != 'PE\0\0':
+            raise Error('Not a PE executable')
+
+        (self.machine, nsections, self.timestamp, _, _,
+         optional_size, self.characteristics) = struct.unpack(
+             '<HHIIIHH', readat(fileobj, pe_offset + 4, 20))
+        if nsections > MAX_SECTIONS:
+            raise Error('Too many sections: %d' % nsections)
+
+        optional = readat(fileobj, pe_offset + 24, optional_size)
+        magic = struct.unpack_from('<H', optional)[0]
+        if magic == 0x10b:
+            directories = 96
+        elif magic == 0x20b:
+            directories = 112
+        else:
+            raise Error('Unknown optional header magic: %#x' % magic)
+        self.is_64bit = magic == 0x20b
+        self.subsystem = struct.unpack_from('<H', optional, 68)[0]
+        ndirectories = struct.unpack_from('<I', optional, directories - 4)[0]
+        self.directories = []
+        for i in range(min(ndirectories, (optional_size - directories) / 8)):
+            self.directories.append(
+                struct.unpack_from('<II', optional, directories + i * 8))
+
+        section_table = readat(fileobj, pe_offset + 24 + optional_size,
+                               nsections * 40)
+        self.sections = []
+        for i in range(nsections):
+            (name, virtual_size, virtual_address, raw_size,
+             raw_offset) = struct.unpack_from('<8sIIII', section_table, i * 40)
+            self.sections.append({
+                'name': name.rstrip('\0'),
+                'virtual_address': virtual_address,
+                'virtual_size': max(virtual_size, raw_size),
+                'raw_offset': raw_offset,
+                'raw_size': raw_size,
+            })
+
+    @property
+    def is_dll(self):
+        return bool(self.characteristics & 0x2000)
+
+    def directory(self, index):
+        """Returns the (rva, size) of a data directory, or (0, 0)."""
+        if index < len(self.directories):
+            return self.directories[index]
+        return (0, 0)
+
+    def offset(self, rva):
+        """Converts a relative virtual address to a file offset."""
+        for section in self.sections:
+            start = section['virtual_address']
+            if start <= rva < start + section['virtual_size']:
+                return rva - start + section['raw_offset']
+        raise Error('Address %#x is outside every section' % rva)
+
+    def overlay_offset(self):
+        """
+        Returns the file offset of data appended after the last section,
+        not counting an Authenticode signature, or None if there is none.
+        """
+        end = max([s['raw_offset'] + s['raw_size'] for s in self.sections]
+                  or [0])
+        (cert_offset, cert_size) = self.directory(4)
+        limit = self.filesize
+        if cert_size and cert_offset >= end:
+            limit = cert_offset
+        if end < limit:
+            return end
+        return None
+
+    def _resource_entries(self, base, offset):
+        """Returns the [(id, is_directory, offset)] of a resource directory."""
+        header = readat(self.fileobj, base + offset, 16)
+        (named, ids) = struct.unpack_from('<HH', header, 12)
+        count = min(named + ids, MAX_RESOURCE_ENTRIES)
+        data = readat(self.fileobj, base + offset + 16, count * 8)
+        entries = []
+        for i in range(count):
+            (name, target) = struct.unpack_from('<II', data, i * 8)
+            entries.append((None if name & 0x80000000 else name,
+                            bool(target & 0x80000000), target & 0x7fffffff))
+        return entries
+
+    def resource(self, type_id):
+        """
+        Returns the data of the first resource of a type (any name and
+        language), or None.
+        """
+        (rva, size) = self.directory(2)
+        if not rva or not size:
+            return None
+        base = self.offset(rva)
+
+        entries = [entry for entry in self._resource_entries(base, 0)
+                   if entry[0] == type_id]
+        for depth in range(2):
+            if not entries or not entries[0][1]:
+                return None
+            entries = self._resource_entries(base, entries[0][2])
+        if not entries or entries[0][1]:
+            return None
+
+        (data_rva, data_size) = struct.unpack(
+            '<II', readat(self.fileobj, base + entries[0][2], 8))
+        if data_size > MAX_VERSIONINFO_SIZE:
+            raise Error('Resource too large: %d bytes' % data_size)
+        return readat(self.fileobj, self.offset(data_rva), data_size)
+
+    def versioninfo(self):
+        """
+        Returns (fixed, strings) from the VS_VERSIONINFO resource: a
+        dictionary of the VS_FIXEDFILEINFO version numbers and a dictionary
+        of the first StringFileInfo string table, either of which may be
+        empty.
+        """
+        fixed = {}
+        strings = {}
+        data = self.resource(RT_VERSION)
+        if not data:
+            return (fixed, strings)
+
+        (key, value, children) = parsenode(data, 0)
+        if key != u'VS_VERSION_INFO':
+            raise Error('Bad version resource key: %r' % key)
+        if len(value) >= 52:
+            fields = struct.unpack_from('<13I', value)
+            if fields[0] == VS_FIXEDFILEINFO_SIGNATURE:
+                fixed['file_version'] = formatversion(fields[2], fields[3])
+                fixed['product_version'] = formatversion(fields[4], fields[5])
+
+        for (key, value, tables) in children:
+            if key != u'StringFileInfo' or not tables:
+                continue
+            for (string_key, string_value, _) in tables[0][2]:
+                strings[string_key] = string_value.decode(
+                    'utf-16-le', 'replace').split(u'\0', 1)[0].strip()
+            break
+        return (fixed, strings)
+
+    def wrapper(self, strings=None):
+        """
+        Returns the installer framework the executable was built with:
+        'nsis', 'inno', 'installshield', 'wixburn' or 'msi', or None.
+        """
+        section_names = set([section['name'] for section in self.sections])
+        if '.wixburn' in section_names:
+            return 'wixburn'
+        if '.ndata' in section_names:
+            return 'nsis'
+        if self.dos_header[0x30:0x34] == 'Inno':
+            return 'inno'
+
+        text = u' '.join((strings or {}).values())
+        if 'Inno Setup' in text:
+            return 'inno'
+        if 'InstallShield' in text:
+            return 'installshield'
+
+        overlay = self.overlay_offset()
+        if overlay is not None:
+            self.fileobj.seek(overlay)
+            head = self.fileobj.read(OVERLAY_SCAN_SIZE)
+            if 'NullsoftInst' in head:
+                return 'nsis'
+            if head.startswith('idska32\x1a') or head.startswith('zlb\x1a'):
+                return 'inno'
+            if 'InstallShield' in head or 'ISSetupStream' in head:
+                return 'installshield'
+            if OLE_SIGNATURE in head:
+                return 'msi'
+        return None
+
+
+def parsenode(data, offset, depth=0):
+    """
+    Parses a VS_VERSIONINFO style node at offset. Returns (key, value,
+    children), where value is the raw value bytes and children is a list
+    of parsed child nodes.
+    """
+    if depth > MAX_VERSIONINFO_DEPTH:
+        raise Error('Version resource nested too deeply')
+    (length, value_length, value_type) = struct.unpack_from(
+        '<HHH', data, offset)
+    end = min(offset + length, len(data))
+    if length < 6:
+        raise Error('Bad version resource node length: %d' % length)
+
+    key_start = key_end = offset + 6
+    while key_end + 1 < end and data[key_end:key_end + 2] != '\0\0':
+        key_end += 2
+    key = data[key_start:key_end].decode('utf-16-le', 'replace')
+
+    value_start = align(key_end + 2)
+    if value_type == 1:
+        value_length *= 2
+    value = data[value_start:min(value_start + value_length, end)]
+
+    children = []
+    child = align(value_start + value_length)
+    while child + 6 <= end:
+        child_length = struct.unpack_from('<H', data, child)[0]
+        if not child_length:
+            break
+        children.append(parsenode(data[:end], child, depth + 1))
+        child = align(child + child_length)
+    return (key, value, children)
+
+
+def getpeinfo(filename):
+    """
+    Returns a dictionary describing a PE file: machine, subsystem, is_dll,
+    timestamp, the fixed file_version/product_version, the StringFileInfo
+    strings under 'strings', the installer wrapper under 'installer_type'
+    and the matching unattended install arguments under 'silent_args'.
+
+    Raises Error if the file isn't a PE executable.
+    """
+    f = open(filename, 'rb')
+    try:
+        try:
+            image = PEImage(f)
+            (fixed, strings) = image.versioninfo()
+            installer_type = image.wrapper(strings)
+        except struct.error, err:
+            raise Error('Malformed executable: %s' % err)
+    finally:
+        f.close()
+
+    info = {
+        'machine': MACHINES.get(image.machine, '%#x' % image.machine),
+        'subsystem': SUBSYSTEMS.get(image.subsystem, str(image.subsystem)),
+        'is_dll': image.is_dll,
+        'is_64bit': image.is_64bit,
+        'timestamp': image.timestamp,
+        'strings': strings,
+        'installer_type': installer_type,
+        'silent_args': SILENT_ARGS.get(installer_type),
+    }
+    info.update(fixed)
+    return info
@@ -31,6 +31,7 @@ import optparse
 import subprocess
 import sqlite3
 import time
+import bomfile
 import munkistatus
 import munkicommon
 import FoundationPlist
@@ -274,58 +275,43 @@ def ImportPackage(packagepath, curs):
            values (?, ?, ?, ?, ?, ?)''', values_t)
     pkgkey = curs.lastrowid
 
-    cmd = ["/usr/bin/lsbom", bompath]
-    proc = subprocess.Popen(cmd, shell=False, bufsize=1,
-                            stdin=subprocess.PIPE,
-                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-    while True:
-        line = proc.stdout.readline().decode('UTF-8')
-        if not line and (proc.poll() != None):
-            break
-
-        try:
-            item = line.rstrip("\n").split("\t")
-            path = item[0]
-            perms = item[1]
-            uidgid = item[2].split("/")
-            uid = uidgid[0]
-            gid = uidgid[1]
-        except IndexError:
-            # we really only care about the path
-            perms = "0000"
-            uid = "0"
-            gid = "0"
-
-        try:
-            if path != ".":
-                # special case for MS Office 2008 installers
-                if ppath == "tmp/com.microsoft.updater/office_location":
-                    ppath = "Applications"
-
-                # prepend the ppath so the paths match the actual install
-                # locations
-                path = path.lstrip("./")
-                if ppath:
-                    path = ppath + "/" + path
+    try:
+        for (path, mode, uid, gid) in bomfile.readbom(bompath):
+            # perms are recorded in octal, as lsbom prints them
+            perms = "%o" % mode
+
+            try:
+                if path != ".":
+                    # special case for MS Office 2008 installers
+                    if ppath == "tmp/com.microsoft.updater/office_location":
+                        ppath = "Applications"
+
+                    # prepend the ppath so the paths match the actual install
+                    # locations
+                    path = path.lstrip("./")
+                    if ppath:
+                        path = ppath + "/" + path
+
+                    values_t = (path, )
+                    row = curs.execute(
+                        'SELECT path_key from paths where path = ?',
+                        values_t).fetchone()
+                    if not row:
+                        curs.execute(
+                            'INSERT INTO paths (path) values (?)', values_t)
+                        pathkey = curs.lastrowid
+                    else:
+                        pathkey = row[0]
 
-                values_t = (path, )
-                row = curs.execute(
-                    'SELECT path_key from paths where path = ?',
-                    values_t).fetchone()
-                if not row:
+                    values_t = (pkgkey, pathkey, uid, gid, perms)
                     curs.execute(
-                        'INSERT INTO paths (path) values (?)', values_t)
-                    pathkey = curs.lastrowid
-                else:
-                    pathkey = row[0]
-
-                values_t = (pkgkey, pathkey, uid, gid, perms)
-                curs.execute(
-                    'INSERT INTO pkgs_paths (pkg_key, path_key, uid, gid, '
-                    'perms) values (?, ?, ?, ?, ?)', values_t)
-        except sqlite3.DatabaseError:
-            pass
+                        'INSERT INTO pkgs_paths (pkg_key, path_key, uid, gid, '
+                        'perms) values (?, ?, ?, ?, ?)', values_t)
+            except sqlite3.DatabaseError:
+                pass
+    except (bomfile.Error, IOError), err:
+        munkicommon.display_warning(
+            "Unable to read %s: %s", bompath, err)
 
 
 def ImportBom(bompath, curs):
@@ -370,53 +356,40 @@ def ImportBom(bompath, curs):
            values (?, ?, ?, ?, ?, ?)''', values_t)
     pkgkey = curs.lastrowid
 
-    cmd = ["/usr/bin/lsbom", bompath]
-    proc = subprocess.Popen(cmd, shell=False, bufsize=1,
-                            stdin=subprocess.PIPE,
-                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        for (path, mode, uid, gid) in bomfile.readbom(bompath):
+            # perms are recorded in octal, as lsbom prints them
+            perms = "%o" % mode
 
-    while True:
-        line = proc.stdout.readline().decode('UTF-8')
-        if not line and (proc.poll() != None):
-            break
-        try:
-            item = line.rstrip("\n").split("\t")
-            path = item[0]
-            perms = item[1]
-            uidgid = item[2].split("/")
-            uid = uidgid[0]
-            gid = uidgid[1]
-        except IndexError:
-            # we really only care about the path
-            perms = "0000"
-            uid = "0"
-            gid = "0"
+            if path != ".":
+                # special case for MS Office 2008 installers
+                if ppath == "tmp/com.microsoft.updater/office_location":
+                    ppath = "Applications"
 
-        if path != ".":
-            # special case for MS Office 2008 installers
-            if ppath == "tmp/com.microsoft.updater/office_location":
-                ppath = "Applications"
+                #prepend the ppath so the paths match the actual install
+                #locations
+                path = path.lstrip("./")
+                if ppath:
+                    path = ppath + "/" + path
 
-            #prepend the ppath so the paths match the actual install locations
-            path = path.lstrip("./")
-            if ppath:
-                path = ppath + "/" + path
+                values_t = (path, )
+                row = curs.execute(
+                    'SELECT path_key from paths where path = ?',
+                    values_t).fetchone()
+                if not row:
+                    curs.execute(
+                        'INSERT INTO paths (path) values (?)', values_t)
+                    pathkey = curs.lastrowid
+                else:
+                    pathkey = row[0]
 
-            values_t = (path, )
-            row = curs.execute(
-                'SELECT path_key from paths where path = ?',
-                values_t).fetchone()
-            if not row:
+                values_t = (pkgkey, pathkey, uid, gid, perms)
                 curs.execute(
-                    'INSERT INTO paths (path) values (?)', values_t)
-                pathkey = curs.lastrowid
-            else:
-                pathkey = row[0]
-
-            values_t = (pkgkey, pathkey, uid, gid, perms)
-            curs.execute(
-                'INSERT INTO pkgs_paths (pkg_key, path_key, uid, gid, perms) '
-                'values (?, ?, ?, ?, ?)', values_t)
+                    'INSERT INTO pkgs_paths (pkg_key, path_key, uid, gid, perms) '
+                    'values (?, ?, ?, ?, ?)', values_t)
+    except (bomfile.Error, IOError), err:
+        munkicommon.display_warning(
+            "Unable to read %s: %s", bompath, err)
 
 
 def ImportFromPkgutil(pkgname, curs):
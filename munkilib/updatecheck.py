@@ -113,8 +113,18 @@ def makeCatalogDB(catalogitems):
     # convert to set and back to list to get list of unique names
     autoremoveitems = list(set(autoremoveitems))
 
+    # order the items of each name by version, latest first, once here
+    # instead of on every lookup
+    latest_table = {}
+    for name, versions in name_table.iteritems():
+        versionlist = sorted(
+            versions, key=munkicommon.versionSortKey, reverse=True)
+        latest_table[name] = [index for vers in versionlist
+                              for index in versions[vers]]
+
     pkgdb = {}
     pkgdb['named'] = name_table
+    pkgdb['latest'] = latest_table
     pkgdb['receipts'] = pkgid_table
     pkgdb['updaters'] = updaters
     pkgdb['autoremoveitems'] = autoremoveitems
@@ -126,30 +136,21 @@ def makeCatalogDB(catalogitems):
 def addPackageids(catalogitems, itemname_to_pkgid, pkgid_to_itemname):
     """Adds packageids from each catalogitem to two dictionaries.
     One maps itemnames to receipt pkgids, the other maps receipt pkgids
-    to itemnames"""
+    to itemnames. The versions of each pairing are kept as a set"""
     for item in catalogitems:
         name = item.get('name')
         if not name:
             continue
         if item.get('receipts'):
-            if not name in itemname_to_pkgid:
-                itemname_to_pkgid[name] = {}
+            pkgids_for_name = itemname_to_pkgid.setdefault(name, {})
 
             for receipt in item['receipts']:
                 if 'packageid' in receipt:
                     pkgid = receipt['packageid']
                     vers = receipt['version']
-                    if not pkgid in itemname_to_pkgid[name]:
-                        itemname_to_pkgid[name][pkgid] = []
-                    if not vers in itemname_to_pkgid[name][pkgid]:
-                        itemname_to_pkgid[name][pkgid].append(vers)
-
-                    if not pkgid in pkgid_to_itemname:
-                        pkgid_to_itemname[pkgid] = {}
-                    if not name in pkgid_to_itemname[pkgid]:
-                        pkgid_to_itemname[pkgid][name] = []
-                    if not vers in pkgid_to_itemname[pkgid][name]:
-                        pkgid_to_itemname[pkgid][name].append(vers)
+                    pkgids_for_name.setdefault(pkgid, set()).add(vers)
+                    pkgid_to_itemname.setdefault(pkgid, {}).setdefault(
+                        name, set()).add(vers)
 
 
 INSTALLEDPKGS = {}
@@ -194,8 +195,8 @@ def getInstalledPackages():
                         # installed, since presumably
                         # the newer package replaced the older one
                         storedversion = INSTALLEDPKGS[pkgid]
-                        if (munkicommon.MunkiLooseVersion(thisversion) >
-                                munkicommon.MunkiLooseVersion(storedversion)):
+                        if (munkicommon.versionSortKey(thisversion) >
+                                munkicommon.versionSortKey(storedversion)):
                             INSTALLEDPKGS[pkgid] = thisversion
 
     #ManagedInstallDir = munkicommon.pref('ManagedInstallDir')
@@ -246,24 +247,22 @@ def analyzeInstalledPkgs():
     installed = []
     partiallyinstalled = []
     installedpkgsmatchedtoname = {}
+    # the number of installed or partially installed items that claim
+    # each receipt found on disk
+    pkgid_refcount = {}
     for name in itemname_to_pkgid.keys():
         # name is a Munki install item name
-        somepkgsfound = False
-        allpkgsfound = True
-        for pkgid in itemname_to_pkgid[name].keys():
-            if pkgid in INSTALLEDPKGS.keys():
-                somepkgsfound = True
-                if not name in installedpkgsmatchedtoname:
-                    installedpkgsmatchedtoname[name] = []
-                # record this pkgid for Munki install item name
-                installedpkgsmatchedtoname[name].append(pkgid)
-            else:
-                # didn't find pkgid in INSTALLEDPKGS
-                allpkgsfound = False
-        if allpkgsfound:
+        foundpkgs = [pkgid for pkgid in itemname_to_pkgid[name]
+                     if pkgid in INSTALLEDPKGS]
+        if foundpkgs:
+            # record the pkgids found for this Munki install item name
+            installedpkgsmatchedtoname[name] = foundpkgs
+            for pkgid in foundpkgs:
+                pkgid_refcount[pkgid] = pkgid_refcount.get(pkgid, 0) + 1
+        if len(foundpkgs) == len(itemname_to_pkgid[name]):
             # we found all receipts by pkgid on disk
             installed.append(name)
-        elif somepkgsfound:
+        elif foundpkgs:
             # we found only some receipts for the item
             # on disk
             partiallyinstalled.append(name)
@@ -272,31 +271,23 @@ def analyzeInstalledPkgs():
     # we need to see if there are any packages that are unique to this item
     # if there aren't, then this item probably isn't installed, and we're
     # just finding receipts that are shared with other items.
+    # A receipt is unique to an item if no other installed or partially
+    # installed item claims it.
     for name in partiallyinstalled:
-        # get a list of pkgs for this item that are installed
-        pkgsforthisname = installedpkgsmatchedtoname[name]
-        # now build a list of all the pkgs referred to by all the other
-        # items that are either partially or entirely installed
-        allotherpkgs = []
-        for othername in installed:
-            allotherpkgs.extend(installedpkgsmatchedtoname[othername])
-        for othername in partiallyinstalled:
-            if othername != name:
-                allotherpkgs.extend(installedpkgsmatchedtoname[othername])
-        # use Python sets to find pkgs that are unique to this name
-        uniquepkgs = list(set(pkgsforthisname) - set(allotherpkgs))
-        if uniquepkgs:
+        if [pkgid for pkgid in installedpkgsmatchedtoname[name]
+                if pkgid_refcount[pkgid] == 1]:
             installed.append(name)
 
     # now filter partiallyinstalled to remove those items we moved to installed
+    installed_names = set(installed)
     partiallyinstalled = [item for item in partiallyinstalled
-                          if item not in installed]
+                          if item not in installed_names]
 
     # build our reference table. For each item we think is installed,
     # record the receipts on disk matched to the item
     references = {}
     for name in installed:
-        for pkgid in installedpkgsmatchedtoname[name]:
+        for pkgid in installedpkgsmatchedtoname.get(name, []):
             if not pkgid in references:
                 references[pkgid] = []
             references[pkgid].append(name)
@@ -319,8 +310,9 @@ def analyzeInstalledPkgs():
 
     # process matched_orphans
     for name in matched_orphans:
-        if name not in installed:
+        if name not in installed_names:
             installed.append(name)
+            installed_names.add(name)
         if name in partiallyinstalled:
             partiallyinstalled.remove(name)
         for pkgid in installedpkgsmatchedtoname[name]:
@@ -375,11 +367,11 @@ def compareVersions(thisvers, thatvers):
       1 if thisvers is the same as thatvers
       2 if thisvers is newer than thatvers
     """
-    if (munkicommon.MunkiLooseVersion(thisvers) <
-            munkicommon.MunkiLooseVersion(thatvers)):
+    thiskey = munkicommon.versionSortKey(thisvers)
+    thatkey = munkicommon.versionSortKey(thatvers)
+    if thiskey < thatkey:
         return -1
-    elif (munkicommon.MunkiLooseVersion(thisvers) ==
-          munkicommon.MunkiLooseVersion(thatvers)):
+    elif thiskey == thatkey:
         return 1
     else:
         return 2
@@ -428,23 +420,12 @@ def compareApplicationVersion(app):
     munkicommon.display_debug1(
         'Looking for application %s with bundleid: %s, version %s...' %
         (name, bundleid, versionstring))
-    appinfo = []
-    appdata = munkicommon.getAppData()
-    if appdata:
-        for item in appdata:
-            # Skip applications in /Users but not /Users/Shared, for now.
-            if 'path' in item:
-                if item['path'].startswith('/Users/') and \
-                    not item['path'].startswith('/Users/Shared/'):
-                    munkicommon.display_debug2(
-                        'Skipped app %s with path %s',
-                        item['name'], item['path'])
-                    continue
-            if bundleid:
-                if item['bundleid'] == bundleid:
-                    appinfo.append(item)
-            elif name and item['name'] == name:
-                appinfo.append(item)
+    # the index leaves out applications in /Users but not /Users/Shared
+    appindex = munkicommon.getAppDataIndex()
+    if bundleid:
+        appinfo = appindex['bundleid'].get(bundleid, [])
+    else:
+        appinfo = appindex['name'].get(name, [])
 
     if not appinfo:
         # app isn't present!
@@ -745,13 +726,14 @@ def getInstalledVersion(item_plist):
                     return plist.get('CFBundleShortVersionString', 'UNKNOWN')
                 except FoundationPlist.NSPropertyListSerializationException:
                     # that didn't work, fall through to the slow way
+                    appindex = munkicommon.getAppDataIndex(
+                        include_user_apps=True)
                     appinfo = []
-                    appdata = munkicommon.getAppData()
-                    if appdata:
-                        for ad_item in appdata:
-                            if bundleid and ad_item['bundleid'] == bundleid:
-                                appinfo.append(ad_item)
-                            elif name and ad_item['name'] == name:
+                    if bundleid:
+                        appinfo.extend(appindex['bundleid'].get(bundleid, []))
+                    if name:
+                        for ad_item in appindex['name'].get(name, []):
+                            if ad_item not in appinfo:
                                 appinfo.append(ad_item)
 
                     maxversion = '0.0.0.0.0'
@@ -904,37 +886,38 @@ def getAllItemsWithName(name, cataloglist):
       list of pkginfo items; sorted with newest version first. No precedence
       is given to catalog order.
     """
-    def compare_item_versions(a, b):
-        """Internal comparison function for use with sorting"""
-        return cmp(munkicommon.MunkiLooseVersion(b['version']),
-                   munkicommon.MunkiLooseVersion(a['version']))
-
     itemlist = []
+    # items already in itemlist, by version; only items with the same
+    # version can be duplicates
+    itemsbyversion = {}
     # we'll throw away any included version info
     name = nameAndVersion(name)[0]
 
     munkicommon.display_debug1('Looking for all items matching: %s...', name)
     for catalogname in cataloglist:
-        if not catalogname in CATALOG.keys():
+        if not catalogname in CATALOG:
             # in case catalogname refers to a non-existent catalog...
             continue
         # is name in the catalog name table?
-        if name in CATALOG[catalogname]['named']:
-            versionsmatchingname = CATALOG[catalogname]['named'][name]
-            for vers in versionsmatchingname.keys():
-                if vers != 'latest':
-                    indexlist = CATALOG[catalogname]['named'][name][vers]
-                    for index in indexlist:
-                        thisitem = CATALOG[catalogname]['items'][index]
-                        if not thisitem in itemlist:
-                            munkicommon.display_debug1(
-                                'Adding item %s, version %s from catalog %s...',
-                                name, thisitem['version'], catalogname)
-                            itemlist.append(thisitem)
-
-    if itemlist:
-        # sort so latest version is first
-        itemlist.sort(compare_item_versions)
+        if name in CATALOG[catalogname]['latest']:
+            for index in CATALOG[catalogname]['latest'][name]:
+                thisitem = CATALOG[catalogname]['items'][index]
+                vers = thisitem.get('version')
+                if vers == 'latest':
+                    continue
+                sameversion = itemsbyversion.setdefault(vers, [])
+                if not thisitem in sameversion:
+                    munkicommon.display_debug1(
+                        'Adding item %s, version %s from catalog %s...',
+                        name, thisitem['version'], catalogname)
+                    sameversion.append(thisitem)
+                    itemlist.append(thisitem)
+
+    if len(cataloglist) > 1:
+        # sort so latest version is first; each catalog's items already are
+        itemlist.sort(
+            key=lambda item: munkicommon.versionSortKey(item['version']),
+            reverse=True)
     return itemlist
 
 
@@ -964,11 +947,6 @@ def getItemDetail(name, cataloglist, vers=''):
     If no version is given at all, the latest version is assumed.
     Returns a pkginfo item.
     """
-    def compare_version_keys(a, b):
-        """Internal comparison function for use in sorting"""
-        return cmp(munkicommon.MunkiLooseVersion(b),
-                   munkicommon.MunkiLooseVersion(a))
-
     if vers == 'apple_update_metadata':
         vers = 'latest'
     else:
@@ -985,7 +963,7 @@ def getItemDetail(name, cataloglist, vers=''):
         'Looking for detail for: %s, version %s...', name, vers)
     rejected_items = []
     for catalogname in cataloglist:
-        if not catalogname in CATALOG.keys():
+        if not catalogname in CATALOG:
             # in case the list refers to a non-existent catalog
             continue
 
@@ -994,11 +972,8 @@ def getItemDetail(name, cataloglist, vers=''):
             itemsmatchingname = CATALOG[catalogname]['named'][name]
             indexlist = []
             if vers == 'latest':
-                # order all our items, latest first
-                versionlist = itemsmatchingname.keys()
-                versionlist.sort(compare_version_keys)
-                for versionkey in versionlist:
-                    indexlist.extend(itemsmatchingname[versionkey])
+                # all our items, already ordered latest first
+                indexlist = CATALOG[catalogname]['latest'][name]
 
             elif vers in itemsmatchingname:
                 # get the specific requested version
@@ -1018,8 +993,8 @@ def getItemDetail(name, cataloglist, vers=''):
                         item['name'], item['version'], min_munki_vers)
                     munkicommon.display_debug1(
                         'Our Munki version is %s', MACHINE['munki_version'])
-                    if (munkicommon.MunkiLooseVersion(MACHINE['munki_version'])
-                            < munkicommon.MunkiLooseVersion(min_munki_vers)):
+                    if (munkicommon.versionSortKey(MACHINE['munki_version'])
+                            < munkicommon.versionSortKey(min_munki_vers)):
                         # skip this one, go to the next
                         reason = ('Rejected item %s, version %s '
                                   'with minimum Munki version required %s. '
@@ -1039,8 +1014,8 @@ def getItemDetail(name, cataloglist, vers=''):
                         item['name'], item['version'], min_os_vers)
                     munkicommon.display_debug1(
                         'Our OS version is %s', MACHINE['os_vers'])
-                    if (munkicommon.MunkiLooseVersion(MACHINE['os_vers']) <
-                            munkicommon.MunkiLooseVersion(min_os_vers)):
+                    if (munkicommon.versionSortKey(MACHINE['os_vers']) <
+                            munkicommon.versionSortKey(min_os_vers)):
                         # skip this one, go to the next
                         reason = ('Rejected item %s, version %s '
                                   'with minimum os version required %s. '
@@ -1059,8 +1034,8 @@ def getItemDetail(name, cataloglist, vers=''):
                         item['name'], item['version'], max_os_vers)
                     munkicommon.display_debug1(
                         'Our OS version is %s', MACHINE['os_vers'])
-                    if (munkicommon.MunkiLooseVersion(MACHINE['os_vers']) >
-                            munkicommon.MunkiLooseVersion(max_os_vers)):
+                    if (munkicommon.versionSortKey(MACHINE['os_vers']) >
+                            munkicommon.versionSortKey(max_os_vers)):
                         # skip this one, go to the next
                         reason = ('Rejected item %s, version %s '
                                   'with maximum os version required %s. '
@@ -2471,10 +2446,74 @@ def getManifestValueForKey(manifestpath, keyname):
 
 
 # global to hold our catalog DBs
+# Bump this whenever makeCatalogDB changes what it builds, so databases
+# saved by older versions are rebuilt.
+CATALOG_DB_VERSION = 1
+
+
+def writeCatalogDB(pkgdb, dbpath, catalog_hash):
+    """Saves a database built by makeCatalogDB as a binary plist, along
+    with the hash of the catalog it was built from"""
+    snapshot = dict(pkgdb)
+    # updaters are items of the catalog; save their indexes rather than
+    # a second copy of each
+    snapshot['updaters'] = [index for (index, item)
+                            in enumerate(pkgdb['items'])
+                            if item.get('update_for')]
+    snapshot['catalog_hash'] = catalog_hash
+    snapshot['db_version'] = CATALOG_DB_VERSION
+    try:
+        FoundationPlist.writeBinaryPlist(snapshot, dbpath)
+    except FoundationPlist.FoundationPlistException, err:
+        munkicommon.display_debug1(
+            'Could not save catalog database %s: %s', dbpath, err)
+        try:
+            os.unlink(dbpath)
+        except (OSError, IOError):
+            pass
+
+
+def readCatalogDB(dbpath, catalog_hash):
+    """Returns the database saved by writeCatalogDB, or None if there is
+    none or it was not built from a catalog with catalog_hash"""
+    if not os.path.exists(dbpath):
+        return None
+    try:
+        snapshot = FoundationPlist.readPlist(dbpath)
+    except FoundationPlist.NSPropertyListSerializationException:
+        return None
+    try:
+        if (snapshot.get('db_version') != CATALOG_DB_VERSION or
+                snapshot.get('catalog_hash') != catalog_hash):
+            return None
+        pkgdb = {}
+        for (key, keytype) in [('named', dict), ('latest', dict),
+                               ('receipts', dict), ('autoremoveitems', list),
+                               ('items', list)]:
+            if not isinstance(snapshot[key], keytype):
+                return None
+            pkgdb[key] = snapshot[key]
+        pkgdb['updaters'] = []
+        for index in snapshot['updaters']:
+            if (not isinstance(index, (int, long)) or
+                    not 0 <= index < len(pkgdb['items']) or
+                    not isinstance(pkgdb['items'][index], dict)):
+                return None
+            pkgdb['updaters'].append(pkgdb['items'][index])
+    except (AttributeError, KeyError, TypeError):
+        # not a database writeCatalogDB saved
+        return None
+    return pkgdb
+
+
 CATALOG = {}
 def getCatalogs(cataloglist):
     """Retrieves the catalogs from the server and populates our catalogs
     dictionary.
+
+    The database built from each catalog is saved in the catalogdb
+    directory, so a catalog that has not changed since the last run is
+    loaded from there instead of being parsed and indexed again.
     """
     #global CATALOG
     catalogbaseurl = munkicommon.pref('CatalogURL') or \
@@ -2484,6 +2523,15 @@ def getCatalogs(cataloglist):
     munkicommon.display_debug2('Catalog base URL is: %s', catalogbaseurl)
     catalog_dir = os.path.join(munkicommon.pref('ManagedInstallDir'),
                                'catalogs')
+    catalogdb_dir = os.path.join(munkicommon.pref('ManagedInstallDir'),
+                                 'catalogdb')
+    if not os.path.exists(catalogdb_dir):
+        try:
+            os.makedirs(catalogdb_dir, 0755)
+        except OSError, err:
+            munkicommon.display_debug1(
+                'Could not create %s: %s', catalogdb_dir, err)
+            catalogdb_dir = None
 
     for catalogname in cataloglist:
         if not catalogname in CATALOG:
@@ -2498,7 +2546,17 @@ def getCatalogs(cataloglist):
                 munkicommon.display_error(
                     'Could not retrieve catalog %s from server: %s',
                     catalogname, err)
-            else:
+                continue
+
+            pkgdb = None
+            if catalogdb_dir:
+                dbpath = os.path.join(catalogdb_dir, catalogname)
+                catalog_hash = munkicommon.getsha256hash(catalogpath)
+                pkgdb = readCatalogDB(dbpath, catalog_hash)
+                if pkgdb is not None:
+                    munkicommon.display_debug1(
+                        'Using saved database for catalog %s', catalogname)
+            if pkgdb is None:
                 try:
                     catalogdata = FoundationPlist.readPlist(catalogpath)
                 except FoundationPlist.NSPropertyListSerializationException:
@@ -2508,17 +2566,24 @@ def getCatalogs(cataloglist):
                         os.unlink(catalogpath)
                     except (OSError, IOError):
                         pass
-                else:
-                    CATALOG[catalogname] = makeCatalogDB(catalogdata)
+                    continue
+                pkgdb = makeCatalogDB(catalogdata)
+                if catalogdb_dir:
+                    writeCatalogDB(pkgdb, dbpath, catalog_hash)
+            CATALOG[catalogname] = pkgdb
 
 
 def cleanUpCatalogs():
-    """Removes any catalog files that are no longer in use by this client"""
-    catalog_dir = os.path.join(munkicommon.pref('ManagedInstallDir'),
-                               'catalogs')
-    for item in os.listdir(catalog_dir):
-        if item not in CATALOG.keys():
-            os.unlink(os.path.join(catalog_dir, item))
+    """Removes any catalog files and saved catalog databases that are no
+    longer in use by this client"""
+    for subdir in ['catalogs', 'catalogdb']:
+        catalog_dir = os.path.join(munkicommon.pref('ManagedInstallDir'),
+                                   subdir)
+        if not os.path.isdir(catalog_dir):
+            continue
+        for item in os.listdir(catalog_dir):
+            if item not in CATALOG.keys():
+                os.unlink(os.path.join(catalog_dir, item))
 
 
 class ManifestException(Exception):
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# encoding: utf-8
+#
+# Copyright 2015 The Pennsylvania State University.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+xarfile
+
+Reads xar archives, such as flat installer packages, in process. The table
+of contents is decompressed and checked against its checksum once when the
+archive is opened; members are read straight from the heap, checked and
+decompressed in memory only when asked for.
+
+Note: this module should be 100% free of ObjC-dependant Python imports.
+"""
+
+
+import bz2
+import hashlib
+import os
+import struct
+import zlib
+from xml.etree import ElementTree
+
+
+XAR_MAGIC = 'xar!'
+HEADER_FORMAT = '>4sHHQQI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Largest member read() will decompress into memory.
+MAX_MEMBER_SIZE = 2**28
+
+# Checksum styles that are verified; others (and 'none') are not checked.
+CHECKSUM_STYLES = ('md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512')
+
+
+class Error(Exception):
+    """Class for domain specific exceptions."""
+
+
+def _checksum(element):
+    """Returns the (style, hex digest) of a checksum element, or None."""
+    if element is None or element.get('style') not in CHECKSUM_STYLES:
+        return None
+    return (element.get('style'), (element.text or '').strip().lower())
+
+
+class XarArchive(object):
+    """
+    An open xar archive. namelist() lists the members in table of contents
+    order, with directories joined by '/', and read() returns the contents
+    of one member.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fileobj = open(filename, 'rb')
+        try:
+            self._read_toc()
+        except:
+            self.fileobj.close()
+            raise
+
+    def _read_toc(self):
+        header = self.fileobj.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise Error('%s is not a xar archive' % self.filename)
+        (magic, header_size, dummy_version, toc_compressed,
+         dummy_toc_size, dummy_checksum) = struct.unpack(HEADER_FORMAT, header)
+        if magic != XAR_MAGIC:
+            raise Error('%s is not a xar archive' % self.filename)
+
+        self.size = os.fstat(self.fileobj.fileno()).st_size
+        self.heap_offset = header_size + toc_compressed
+        if self.heap_offset > self.size:
+            raise Error('Truncated table of contents in %s' % self.filename)
+        self.fileobj.seek(header_size)
+        compressed = self.fileobj.read(toc_compressed)
+        self.members = []
+        self._index = {}
+        try:
+            root = ElementTree.fromstring(zlib.decompress(compressed))
+            toc_element = root.find('toc')
+            if toc_element is not None:
+                self._check_toc(compressed, toc_element.find('checksum'))
+                self._add_files(toc_element, '')
+        except (zlib.error, SyntaxError, ValueError), err:
+            raise Error('Bad table of contents in %s: %s' %
+                        (self.filename, err))
+
+    def _read_heap(self, offset, length, name):
+        if (offset < 0 or length < 0 or
+                self.heap_offset + offset + length > self.size):
+            raise Error('%s is truncated' % name)
+        self.fileobj.seek(self.heap_offset + offset)
+        data = self.fileobj.read(length)
+        if len(data) != length:
+            raise Error('%s is truncated' % name)
+        return data
+
+    def _verify(self, data, checksum, name):
+        if checksum is None:
+            return
+        (style, expected) = checksum
+        if hashlib.new(style, data).hexdigest() != expected:
+            raise Error('%s of %s does not match its %s checksum' %
+                        (name, self.filename, style))
+
+    def _check_toc(self, compressed, element):
+        """The heap holds the checksum of the compressed TOC."""
+        checksum = _checksum(element)
+        if checksum is None:
+            return
+        stored = self._read_heap(int(element.findtext('offset', '0')),
+                                 int(element.findtext('size', '0')),
+                                 'table of contents checksum')
+        self._verify(compressed, (checksum[0], stored.encode('hex')),
+                     'table of contents')
+
+    def _add_files(self, parent, prefix):
+        for element in parent.findall('file'):
+            name = prefix + (element.findtext('name') or '')
+            member = {
+                'name': name,
+                'type': element.findtext('type'),
+            }
+            data = element.find('data')
+            if data is not None:
+                encoding = data.find('encoding')
+                member['offset'] = int(data.findtext('offset', '0'))
+                member['length'] = int(data.findtext('length', '0'))
+                member['size'] = int(data.findtext('size', '0'))
+                member['encoding'] = (encoding.get('style')
+                                      if encoding is not None else None)
+                member['archived_checksum'] = _checksum(
+                    data.find('archived-checksum'))
+                member['extracted_checksum'] = _checksum(
+                    data.find('extracted-checksum'))
+            self.members.append(member)
+            self._index.setdefault(name, member)
+            self._add_files(element, name + '/')
+
+    def namelist(self):
+        """Returns the names of all members."""
+        return [member['name'] for member in self.members]
+
+    def getmember(self, name):
+        """Returns the table of contents entry of a member."""
+        if name not in self._index:
+            raise Error('%s has no member %s' % (self.filename, name))
+        return self._index[name]
+
+    def read(self, name):
+        """Returns the decompressed contents of a member."""
+        member = self.getmember(name)
+        if 'offset' not in member:
+            return ''
+        if member['size'] > MAX_MEMBER_SIZE:
+            raise Error('%s is too large to read into memory' % name)
+
+        data = self._read_heap(member['offset'], member['length'], name)
+        self._verify(data, member['archived_checksum'], name)
+
+        encoding = member['encoding'] or 'application/octet-stream'
+        try:
+            if encoding == 'application/x-gzip':
+                data = zlib.decompress(data)
+            elif encoding == 'application/x-bzip2':
+                data = bz2.decompress(data)
+            elif encoding != 'application/octet-stream':
+                raise Error('Unsupported encoding %s for %s' % (encoding, name))
+        except (zlib.error, IOError), err:
+            raise Error('Unable to decompress %s: %s' % (name, err))
+        self._verify(data, member['extracted_checksum'], name)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
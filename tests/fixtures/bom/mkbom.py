@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+Writes the BOM fixtures used by tests/test_bomfile.py.
+
+The files are laid out the way mkbom writes them: a null block 0, BomInfo,
+Paths, HLIndex, VIndex and Size64 variables, and a Paths tree whose root
+is an index node over several leaves. Each fixture's .lsbom file is the
+`lsbom -s` listing of its BOM, and its .lsbom-long file the plain `lsbom`
+listing, with the mode, uid/gid, size, checksum and link target of each
+entry.
+
+These are not BOMs taken from Apple packages; they follow the layout
+mkbom documents and lsbom reads, with every checksum left 0.
+
+Run from this directory to regenerate: python mkbom.py
+"""
+
+import os
+import struct
+
+FILE, DIRECTORY, LINK = 1, 2, 3
+
+# (id, parent id, name, type, mode, uid, gid, size, link target)
+APP_ENTRIES = [
+    (1, 0, '.', DIRECTORY, 040755, 0, 0, 0, ''),
+    (2, 1, 'Applications', DIRECTORY, 040775, 0, 80, 0, ''),
+    (3, 2, 'Foo.app', DIRECTORY, 040755, 0, 80, 0, ''),
+    (4, 3, 'Contents', DIRECTORY, 040755, 0, 80, 0, ''),
+    (5, 4, 'Info.plist', FILE, 0100644, 0, 80, 1210, ''),
+    (6, 4, 'MacOS', DIRECTORY, 040755, 0, 80, 0, ''),
+    (7, 6, 'Foo', FILE, 0100755, 0, 80, 48304, ''),
+    (8, 4, 'PkgInfo', FILE, 0100644, 0, 80, 8, ''),
+    (9, 4, 'Resources', DIRECTORY, 040755, 0, 80, 0, ''),
+    (10, 9, 'Foo.icns', FILE, 0100644, 0, 80, 70125, ''),
+    (11, 9, 'English.lproj', DIRECTORY, 040755, 0, 80, 0, ''),
+    (12, 11, 'InfoPlist.strings', FILE, 0100644, 0, 80, 92, ''),
+    (13, 9, 'Fran\xc3\xa7ais.lproj', DIRECTORY, 040755, 0, 80, 0, ''),
+    (14, 13, 'InfoPlist.strings', FILE, 0100644, 0, 80, 96, ''),
+    (15, 4, 'Frameworks', DIRECTORY, 040755, 0, 80, 0, ''),
+    (16, 15, 'Bar.framework', DIRECTORY, 040755, 0, 80, 0, ''),
+    (17, 16, 'Bar', LINK, 0120755, 0, 80, 24, 'Versions/Current/Bar'),
+    (18, 16, 'Versions', DIRECTORY, 040755, 0, 80, 0, ''),
+    (19, 18, 'Current', LINK, 0120755, 0, 80, 1, 'A'),
+    (20, 18, 'A', DIRECTORY, 040755, 0, 80, 0, ''),
+    (21, 20, 'Bar', FILE, 0100755, 0, 80, 20544, ''),
+]
+
+# An old bundle receipt whose BOM lives in Contents/Resources and whose
+# entries were not written in parent-first order.
+RECEIPT_ENTRIES = [
+    (1, 0, '.', DIRECTORY, 041775, 0, 80, 0, ''),
+    (2, 1, 'Library', DIRECTORY, 041775, 0, 80, 0, ''),
+    (5, 4, 'com.example.baz.plist', FILE, 0100644, 0, 0, 612, ''),
+    (3, 2, 'LaunchDaemons', DIRECTORY, 040755, 0, 0, 0, ''),
+    (4, 2, 'Preferences', DIRECTORY, 040755, 0, 80, 0, ''),
+    (6, 3, 'com.example.baz.plist', FILE, 0100644, 0, 0, 471, ''),
+]
+
+
+def path_info2(entry_type, mode, uid, gid, size, link):
+    """A BOMPathInfo2 record."""
+    info = struct.pack('>BBHHIIII', entry_type, 1, 0x0f, mode, uid, gid,
+                       1420070400, size)
+    info += struct.pack('>BII', 1, 0, len(link) + 1 if link else 0)
+    if link:
+        info += link + '\0'
+    return info
+
+
+def tree(child, count):
+    """A BOMTree header."""
+    return 'tree' + struct.pack('>IIIIB', 1, child, 4096, count, 0)
+
+
+def node(is_leaf, pairs, forward=0, backward=0):
+    """A BOMPaths node."""
+    return (struct.pack('>HHII', is_leaf, len(pairs), forward, backward) +
+            ''.join(struct.pack('>II', a, b) for (a, b) in pairs))
+
+
+def build(entries, per_leaf):
+    """Returns the contents of a BOM file listing entries."""
+    blocks = ['']
+
+    def add(data):
+        blocks.append(data)
+        return len(blocks) - 1
+
+    bominfo = add(struct.pack('>III', 1, len(entries), 0))
+
+    pairs = []
+    for (entry_id, parent, name, entry_type, mode, uid, gid, size,
+         link) in entries:
+        info2 = add(path_info2(entry_type, mode, uid, gid, size, link))
+        info1 = add(struct.pack('>II', entry_id, info2))
+        key = add(struct.pack('>I', parent) + name + '\0')
+        pairs.append((info1, key))
+
+    chunks = [pairs[i:i + per_leaf] for i in range(0, len(pairs), per_leaf)]
+    leaves = [add('') for dummy_chunk in chunks]
+    for (i, (leaf, chunk)) in enumerate(zip(leaves, chunks)):
+        forward = leaves[i + 1] if i + 1 < len(leaves) else 0
+        backward = leaves[i - 1] if i else 0
+        blocks[leaf] = node(1, chunk, forward, backward)
+    # An index node points at each leaf, keyed by the leaf's last key.
+    root = add(node(0, [(leaf, chunk[-1][1])
+                        for (leaf, chunk) in zip(leaves, chunks)]))
+    paths = add(tree(root, len(entries)))
+
+    hlindex = add(tree(add(node(1, [])), 0))
+    vtree = add(tree(add(node(1, [])), 0))
+    vindex = add(struct.pack('>IIIB', 1, vtree, 0, 0))
+    size64 = add(tree(add(node(1, [])), 0))
+
+    variables = [('BomInfo', bominfo), ('Paths', paths), ('HLIndex', hlindex),
+                 ('VIndex', vindex), ('Size64', size64)]
+
+    body = ''
+    table = []
+    for block in blocks:
+        table.append((512 + len(body) if block else 0, len(block)))
+        body += block
+    index_offset = 512 + len(body)
+    index = struct.pack('>I', len(table)) + ''.join(
+        struct.pack('>II', *item) for item in table)
+    body += index
+    vars_offset = 512 + len(body)
+    vars_data = struct.pack('>I', len(variables)) + ''.join(
+        struct.pack('>IB', block, len(name)) + name
+        for (name, block) in variables)
+    body += vars_data
+
+    header = 'BOMStore' + struct.pack('>6I', 1, len(blocks), index_offset,
+                                      len(index), vars_offset, len(vars_data))
+    return header.ljust(512, '\0') + body
+
+
+def lsbom(entries):
+    """The `lsbom -s` listing of entries."""
+    names = dict((entry[0], (entry[1], entry[2])) for entry in entries)
+
+    def fullpath(entry_id):
+        (parent, name) = names[entry_id]
+        if parent in names:
+            return fullpath(parent) + '/' + name
+        return name
+
+    return ''.join(fullpath(entry[0]) + '\n' for entry in entries)
+
+
+def lsbom_long(entries):
+    """The plain `lsbom` listing of entries."""
+    lines = []
+    for (path, entry) in zip(lsbom(entries).splitlines(), entries):
+        (entry_type, mode, uid, gid, size, link) = entry[3:]
+        fields = [path, '%o' % mode, '%d/%d' % (uid, gid)]
+        if entry_type != DIRECTORY:
+            fields.extend(['%d' % size, '0'])
+        if entry_type == LINK:
+            fields.append(link)
+        lines.append('\t'.join(fields) + '\n')
+    return ''.join(lines)
+
+
+def write(bompath, entries, per_leaf):
+    """Writes a fixture BOM and its listing."""
+    if not os.path.isdir(os.path.dirname(bompath)):
+        os.makedirs(os.path.dirname(bompath))
+    with open(bompath, 'wb') as f:
+        f.write(build(entries, per_leaf))
+    with open(bompath.split('/', 1)[0] + '.lsbom', 'wb') as f:
+        f.write(lsbom(entries))
+    with open(bompath.split('/', 1)[0] + '.lsbom-long', 'wb') as f:
+        f.write(lsbom_long(entries))
+
+
+if __name__ == '__main__':
+    write('Foo.pkg/Contents/Archive.bom', APP_ENTRIES, 8)
+    write('Baz.pkg/Contents/Resources/Baz.bom', RECEIPT_ENTRIES, 4)
@@ -0,0 +1,443 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+Writes the disk image fixture used by tests/test_dmgfile.py.
+
+hfsvolume() lays out an HFS+ volume with 4KB blocks and nodes. The
+catalog file is fragmented over more than eight extents, so the rest are
+found through the extents overflow B-tree. The attributes B-tree holds
+the decmpfs headers of compressed files. udif() wraps a volume in a
+UDIF image: a zero-filled protective MBR entry, then the volume in 32KB
+chunks. Each chunk is zero, raw, zlib, bzip2 or ADC compressed, cycling
+through the kinds it is given.
+
+The tests build the image with these functions rather than reading a
+checked-in copy. Run from this directory to write one for inspection:
+python mkdmg.py
+"""
+
+import bz2
+import os
+import plistlib
+import struct
+import zlib
+
+SECTOR_SIZE = 512
+BLOCK_SIZE = 4096
+NODE_SIZE = 4096
+CHUNK_SECTORS = 64
+
+CHUNK_TYPES = {
+    'zero': 0x00000000,
+    'raw': 0x00000001,
+    'adc': 0x80000004,
+    'zlib': 0x80000005,
+    'bzip2': 0x80000006,
+}
+CHUNK_LAST = 0xffffffff
+
+FOLDER_RECORD = 1
+FILE_RECORD = 2
+FOLDER_THREAD = 3
+FILE_THREAD = 4
+ROOT_PARENT_ID = 1
+ROOT_FOLDER_ID = 2
+FIRST_USER_ID = 16
+PRIVATE_FOLDER_ID = 3000
+INODE_ID = 4000
+
+UF_COMPRESSED = 0x20
+PRIVATE_DATA = '\0\0\0\0HFS+ Private Data'
+
+
+def utf16(name):
+    return name.decode('UTF-8').encode('utf-16-be')
+
+
+def adc_compress(data):
+    """Apple Data Compression with literal runs and both copy forms."""
+    out = []
+    literal = []
+    last_seen = {}
+    pos = 0
+
+    def flush():
+        while literal:
+            run = ''.join(literal[:128])
+            del literal[:128]
+            out.append(chr(0x80 | (len(run) - 1)) + run)
+
+    while pos < len(data):
+        candidate = last_seen.get(data[pos:pos + 4])
+        last_seen[data[pos:pos + 4]] = pos
+        count = 0
+        if candidate is not None and pos - candidate <= 65536:
+            while (count < 67 and pos + count < len(data) and
+                   data[candidate + count] == data[pos + count]):
+                count += 1
+        if count < 4:
+            literal.append(data[pos])
+            pos += 1
+            continue
+        flush()
+        distance = pos - candidate - 1
+        if count <= 18 and distance < 1024:
+            out.append(chr((count - 3) << 2 | distance >> 8) +
+                       chr(distance & 0xff))
+        else:
+            out.append(chr(0x40 | (count - 4)) + struct.pack('>H', distance))
+        pos += count
+    flush()
+    return ''.join(out)
+
+
+class Volume(object):
+    """Hands out allocation blocks and catalog node IDs."""
+
+    def __init__(self):
+        self.blocks = {}
+        self.next_block = 1
+        self.next_id = FIRST_USER_ID
+
+    def allocate(self, data, scattered=False):
+        """Stores data, one block apart if scattered; returns its fork."""
+        count = max(1, -(-len(data) // BLOCK_SIZE))
+        extents = []
+        for i in range(count):
+            block = self.next_block
+            self.next_block += 2 if scattered else 1
+            self.blocks[block] = data[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]
+            if extents and sum(extents[-1]) == block:
+                extents[-1][1] += 1
+            else:
+                extents.append([block, 1])
+        return (len(data), extents, count)
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+
+EMPTY_FORK = (0, [], 0)
+
+
+def forkdata(fork):
+    """An HFSPlusForkData with the first eight extents of fork."""
+    (size, extents, total_blocks) = fork
+    data = struct.pack('>QII', size, 0, total_blocks)
+    data += ''.join(struct.pack('>II', *extent) for extent in extents[:8])
+    return data.ljust(80, '\0')
+
+
+def node(kind, height, records, forward=0, backward=0):
+    data = struct.pack('>IIbBHH', forward, backward, kind, height,
+                       len(records), 0)
+    offsets = []
+    for record in records:
+        offsets.append(len(data))
+        data += record
+    offsets.append(len(data))
+    table = ''.join(struct.pack('>H', offset) for offset in reversed(offsets))
+    assert len(data) + len(table) <= NODE_SIZE
+    return data + '\0' * (NODE_SIZE - len(data) - len(table)) + table
+
+
+def btree(records, per_leaf, max_key_length, attributes):
+    """The nodes of a B-tree of sorted (key, value) records: a header
+    node, the leaves, and an index node over them if there are several."""
+    leaves = [records[i:i + per_leaf]
+              for i in range(0, len(records), per_leaf)] or [[]]
+    nodes = [None]
+    for (i, leaf) in enumerate(leaves):
+        nodes.append(node(
+            -1, 1, [struct.pack('>H', len(key)) + key + value
+                    for (key, value) in leaf],
+            forward=i + 2 if i + 1 < len(leaves) else 0,
+            backward=i if i else 0))
+    if len(leaves) > 1:
+        nodes.append(node(0, 2, [struct.pack('>H', len(leaf[0][0])) +
+                                 leaf[0][0] + struct.pack('>I', i + 1)
+                                 for (i, leaf) in enumerate(leaves)]))
+        (depth, root) = (2, len(nodes) - 1)
+    else:
+        (depth, root) = (1, 1)
+    header = struct.pack('>HIIIIHHIIHIBBI', depth, root, len(records), 1,
+                         len(leaves), NODE_SIZE, max_key_length, len(nodes),
+                         0, 0, 0, 0, 0, attributes).ljust(106, '\0')
+    nodes[0] = node(1, 0, [header, '\0' * 128, '\0' * 256])
+    return ''.join(nodes)
+
+
+def bsdinfo(mode, flags=0, special=0):
+    return struct.pack('>IIBBHI', 501, 20, 0, flags, mode, special)
+
+
+def folderrecord(cnid, mode=040755):
+    return (struct.pack('>hHII', FOLDER_RECORD, 0, 0, cnid) + '\0' * 20 +
+            bsdinfo(mode) + '\0' * 40)
+
+
+def filerecord(cnid, data=EMPTY_FORK, rsrc=EMPTY_FORK, mode=0100644,
+               flags=0, special=0, file_type=''):
+    return (struct.pack('>hHII', FILE_RECORD, 0, 0, cnid) + '\0' * 20 +
+            bsdinfo(mode, flags, special) + file_type.ljust(16, '\0') +
+            '\0' * 24 + forkdata(data) + forkdata(rsrc))
+
+
+def threadrecord(kind, parent, name):
+    return (struct.pack('>hHIH', kind, 0, parent, len(utf16(name)) // 2) +
+            utf16(name))
+
+
+def inline_attribute(value):
+    return struct.pack('>IIII', 0x10, 0, 0, len(value)) + value
+
+
+def decmpfs_type3(data, stored=False):
+    """A decmpfs xattr holding data inline, zlib compressed or stored."""
+    payload = '\xff' + data if stored else zlib.compress(data)
+    return struct.pack('<4sIQ', 'fpmc', 3, len(data)) + payload
+
+
+def decmpfs_type4(data, stored_blocks=()):
+    """A decmpfs header and the resource fork of 64KB blocks it points
+    to; the blocks listed in stored_blocks are stored uncompressed."""
+    blocks = [data[i:i + 65536] for i in range(0, len(data), 65536)]
+    compressed = ['\xff' + block if i in stored_blocks
+                  else zlib.compress(block)
+                  for (i, block) in enumerate(blocks)]
+    table = struct.pack('<I', len(blocks))
+    body = ''
+    for block in compressed:
+        table += struct.pack('<II', 4 + 8 * len(blocks) + len(body),
+                             len(block))
+        body += block
+    resource = table + body
+    rsrc = (struct.pack('>I', 0x100) + '\0' * 0xfc +
+            struct.pack('>I', len(resource)) + resource)
+    return (struct.pack('<4sIQ', 'fpmc', 4, len(data)), rsrc)
+
+
+def hfsvolume(specs):
+    """
+    Returns the bytes of an HFS+ volume holding specs, a list of (path,
+    kind, ...) tuples:
+
+        (path, 'dir')
+        (path, 'file', data)            scattered over every other block
+        (path, 'decmpfs3', data)        zlib compressed in the xattr
+        (path, 'decmpfs3-stored', data) stored in the xattr
+        (path, 'decmpfs4', data)        compressed in the resource fork
+        (path, 'symlink', target)
+        (path, 'hardlink', data)        an iNode in the private folder
+    """
+    volume = Volume()
+    catalog = []
+    attributes = []
+    ids = {'': ROOT_FOLDER_ID}
+
+    catalog.append((ROOT_PARENT_ID, 'Untitled', folderrecord(ROOT_FOLDER_ID)))
+    catalog.append((ROOT_FOLDER_ID, '',
+                    threadrecord(FOLDER_THREAD, ROOT_PARENT_ID, 'Untitled')))
+    catalog.append((ROOT_FOLDER_ID, PRIVATE_DATA,
+                    folderrecord(PRIVATE_FOLDER_ID)))
+    inodes = 0
+    for spec in sorted(specs, key=lambda spec: spec[0].count('/')):
+        (path, kind) = spec[:2]
+        parent = ids[os.path.dirname(path)]
+        name = os.path.basename(path)
+        cnid = ids[path] = volume.new_id()
+        if kind == 'dir':
+            catalog.append((parent, name, folderrecord(cnid)))
+            catalog.append((cnid, '', threadrecord(FOLDER_THREAD, parent,
+                                                    name)))
+            continue
+        data = spec[2]
+        if kind == 'file':
+            record = filerecord(cnid, volume.allocate(data, scattered=True))
+        elif kind == 'symlink':
+            record = filerecord(cnid, volume.allocate(data), mode=0120755)
+        elif kind == 'hardlink':
+            inodes += 1
+            catalog.append((PRIVATE_FOLDER_ID, 'iNode%d' % inodes,
+                            filerecord(INODE_ID + inodes,
+                                       volume.allocate(data))))
+            record = filerecord(cnid, special=inodes, file_type='hlnkhfs+')
+        elif kind.startswith('decmpfs3'):
+            attributes.append((cnid, 'com.apple.decmpfs', inline_attribute(
+                decmpfs_type3(data, stored=kind.endswith('stored')))))
+            record = filerecord(cnid, flags=UF_COMPRESSED)
+        elif kind == 'decmpfs4':
+            (header, rsrc) = decmpfs_type4(data, stored_blocks=[1])
+            attributes.append((cnid, 'com.apple.decmpfs',
+                               inline_attribute(header)))
+            record = filerecord(cnid, rsrc=volume.allocate(rsrc),
+                                flags=UF_COMPRESSED)
+        catalog.append((parent, name, record))
+        catalog.append((cnid, '', threadrecord(FILE_THREAD, parent, name)))
+        attributes.append((cnid, 'com.apple.quarantine',
+                           inline_attribute('0081;55555555;Safari;')))
+
+    def catalogkey(parent, name):
+        # '/' is stored as ':' on disk
+        name = name.replace(':', '/')
+        return struct.pack('>IH', parent, len(utf16(name)) // 2) + utf16(name)
+
+    catalog.sort(key=lambda record: (record[0], record[1].lower()))
+    catalog_data = btree([(catalogkey(parent, name), value)
+                          for (parent, name, value) in catalog],
+                         6, 516, 6)
+    catalog_fork = volume.allocate(catalog_data, scattered=True)
+    assert len(catalog_fork[1]) > 8
+
+    overflow = []
+    extents = catalog_fork[1]
+    for i in range(8, len(extents), 8):
+        start_block = sum(count for (dummy_start, count) in extents[:i])
+        overflow.append((
+            struct.pack('>BBII', 0, 0, 4, start_block),
+            ''.join(struct.pack('>II', *extent)
+                    for extent in extents[i:i + 8]).ljust(64, '\0')))
+    extents_fork = volume.allocate(btree(overflow, 20, 10, 2))
+
+    attributes.sort(key=lambda record: (record[0], utf16(record[1])))
+    attributes_fork = volume.allocate(btree(
+        [(struct.pack('>HIIH', 0, file_id, 0, len(utf16(name)) // 2) +
+          utf16(name), value) for (file_id, name, value) in attributes],
+        5, 266, 6))
+
+    total_blocks = volume.next_block + 4
+    files = len([spec for spec in specs if spec[1] != 'dir'])
+    header = ('H+' + struct.pack('>H17IQ', 4, 0x100, 0, 0,
+                                 0, 0, 0, 0, files, len(specs) - files,
+                                 BLOCK_SIZE, total_blocks, 0, 0, 0, 0,
+                                 volume.next_id, 0, 0))
+    header = header.ljust(112, '\0')
+    header += ''.join(forkdata(fork) for fork in [
+        EMPTY_FORK, extents_fork, catalog_fork, attributes_fork,
+        EMPTY_FORK])
+    assert len(header) == 512
+
+    image = bytearray(total_blocks * BLOCK_SIZE)
+    image[1024:1536] = header
+    for (block, data) in volume.blocks.items():
+        image[block * BLOCK_SIZE:block * BLOCK_SIZE + len(data)] = data
+    return str(image)
+
+
+def mish(first_sector, data, kinds, data_fork):
+    """
+    A blkx table for data, appending its chunks to data_fork. If data is
+    a number of sectors, they are all zero and make one chunk.
+    """
+    chunks = []
+    if isinstance(data, (int, long)):
+        sectors = data
+        chunks.append((CHUNK_TYPES['zero'], 0, 0, sectors, 0, 0))
+        data = ''
+    else:
+        sectors = len(data) // SECTOR_SIZE
+    for (i, sector) in enumerate(range(0, len(data) // SECTOR_SIZE,
+                                       CHUNK_SECTORS)):
+        count = min(CHUNK_SECTORS, sectors - sector)
+        piece = data[sector * SECTOR_SIZE:(sector + count) * SECTOR_SIZE]
+        kind = 'zero' if not piece.strip('\0') else kinds[i % len(kinds)]
+        stored = {'zero': '', 'raw': piece, 'adc': adc_compress(piece),
+                  'zlib': zlib.compress(piece),
+                  'bzip2': bz2.compress(piece)}[kind]
+        offset = sum(len(part) for part in data_fork)
+        chunks.append((CHUNK_TYPES[kind], 0, sector, count, offset,
+                       len(stored)))
+        data_fork.append(stored)
+    chunks.append((CHUNK_LAST, 0, sectors, 0,
+                   sum(len(part) for part in data_fork), 0))
+    table = (struct.pack('>4sIQQQII', 'mish', 1, first_sector, sectors, 0,
+                         0x208, len(chunks)) + '\0' * 24 +
+             struct.pack('>II', 2, 32) + '\0' * 128 +
+             struct.pack('>I', len(chunks)))
+    return table + ''.join(struct.pack('>IIQQQQ', *chunk) for chunk in chunks)
+
+
+def udif(partitions):
+    """A UDIF image of (name, data or sectors, chunk kinds) partitions, in
+    order."""
+    data_fork = []
+    blkx = []
+    sector = 0
+    for (i, (name, data, kinds)) in enumerate(partitions):
+        blkx.append({'Attributes': '0x0050', 'CFName': name, 'Name': name,
+                     'ID': str(i - 1),
+                     'Data': plistlib.Data(mish(sector, data, kinds,
+                                                data_fork))})
+        sector += (data if isinstance(data, (int, long))
+                   else len(data) // SECTOR_SIZE)
+    data_fork = ''.join(data_fork)
+    xml = plistlib.writePlistToString({'resource-fork': {'blkx': blkx}})
+    koly = struct.pack('>4sIIIQQQQQII16sII128sQQ', 'koly', 4, 512, 1, 0, 0,
+                       len(data_fork), 0, 0, 1, 1, '\0' * 16, 2, 32,
+                       '\0' * 128, len(data_fork), len(xml))
+    return data_fork + xml + koly.ljust(512, '\0')
+
+
+INFO_PLIST = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" \
+"http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+    <key>CFBundleExecutable</key>
+    <string>Foo</string>
+    <key>CFBundleIdentifier</key>
+    <string>com.example.foo</string>
+    <key>CFBundleName</key>
+    <string>Foo</string>
+    <key>CFBundlePackageType</key>
+    <string>APPL</string>
+    <key>CFBundleShortVersionString</key>
+    <string>3.1.4</string>
+    <key>CFBundleVersion</key>
+    <string>314</string>
+</dict>
+</plist>
+'''
+
+# more than 64KB of repetitive text: four resource fork blocks
+BIG_TEXT = ''.join('line %06d of the big compressed file\n' % i
+                   for i in range(6000))
+
+EXECUTABLE = '\xcf\xfa\xed\xfe' + ''.join(chr(i * 7 % 256)
+                                          for i in range(9000))
+
+SPECS = [
+    ('.journal', 'file', 'J' * 100),
+    ('Applications', 'symlink', '/Applications'),
+    ('Foo.app', 'dir'),
+    ('Foo.app/Contents', 'dir'),
+    ('Foo.app/Contents/Info.plist', 'decmpfs3', INFO_PLIST),
+    ('Foo.app/Contents/MacOS', 'dir'),
+    ('Foo.app/Contents/MacOS/Foo', 'file', EXECUTABLE),
+    ('Foo.app/Contents/Current', 'symlink', 'MacOS'),
+    ('Foo.app/Contents/Resources', 'dir'),
+    ('Foo.app/Contents/Resources/big.txt', 'decmpfs4', BIG_TEXT),
+    ('Foo.app/Contents/Resources/tiny', 'decmpfs3-stored', 'tiny stored'),
+    ('Foo.app/Contents/Resources/a:b', 'file', 'colon'),
+    ('Foo.app/Contents/Resources/Caf\xc3\xa9', 'file', 'accented'),
+    ('Foo.app/Contents/Resources/Loop', 'symlink', 'Loop'),
+    ('Read Me', 'hardlink', 'hard link contents'),
+    ('Filler', 'dir'),
+] + [('Filler/f%03d' % i, 'decmpfs3', 'filler %d' % i) for i in range(40)]
+
+CHUNK_KINDS = ['zlib', 'bzip2', 'raw', 'adc']
+
+
+def image(specs=SPECS, kinds=CHUNK_KINDS):
+    """Returns the raw volume and the UDIF image of it."""
+    volume = hfsvolume(specs)
+    return (volume, udif([
+        ('Protective Master Boot Record (MBR : 0)', '\0' * SECTOR_SIZE,
+         ['raw']),
+        ('disk image (Apple_HFS : 1)', volume, kinds)]))
+
+
+if __name__ == '__main__':
+    with open('Foo.dmg', 'wb') as f:
+        f.write(image()[1])
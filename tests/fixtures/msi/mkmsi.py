@@ -0,0 +1,294 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+Writes the MSI fixtures used by tests/test_msiinfo.py.
+
+An MSI database is an OLE compound file (version 3, 512 byte sectors)
+whose tables are streams with compressed names: _StringPool and
+_StringData hold the string pool and Property is two columns of string
+references. Streams under 4096 bytes live in the mini stream. The
+tests also call compoundfile() directly to build databases too large to
+check in: one with more than 0xFFFF strings, which widens string
+references to three bytes, and one big enough that the FAT sector list
+spills out of the header into DIFAT sectors.
+
+Run from this directory to regenerate: python mkmsi.py
+"""
+
+import struct
+
+SECTOR_SIZE = 512
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+HEADER_DIFAT_ENTRIES = 109
+
+FREESECT = 0xffffffff
+ENDOFCHAIN = 0xfffffffe
+FATSECT = 0xfffffffd
+DIFSECT = 0xfffffffc
+NOSTREAM = 0xffffffff
+
+OLE_SIGNATURE = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+MSI_CLSID = '\x84\x10\x0c\x00\x00\x00\x00\x00\xc0\x00\x00\x00\x00\x00\x00\x46'
+
+STREAM_NAME_CHARS = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                     'abcdefghijklmnopqrstuvwxyz._')
+
+VT_I2 = 2
+VT_I4 = 3
+VT_LPSTR = 30
+
+
+def pad(data, size):
+    return data + '\0' * (-len(data) % size)
+
+
+def sectors(data, size=SECTOR_SIZE):
+    return -(-len(data) // size)
+
+
+def pack_longs(values):
+    return struct.pack('<%dI' % len(values), *values)
+
+
+def streamname(name, table=False):
+    """Compresses a stream name the way msi.dll does."""
+    encoded = [unichr(0x4840)] if table else []
+    i = 0
+    while i < len(name):
+        if name[i] not in STREAM_NAME_CHARS:
+            encoded.append(name[i])
+            i += 1
+        elif i + 1 < len(name) and name[i + 1] in STREAM_NAME_CHARS:
+            encoded.append(unichr(0x3800 +
+                                  STREAM_NAME_CHARS.index(name[i]) +
+                                  (STREAM_NAME_CHARS.index(name[i + 1]) << 6)))
+            i += 2
+        else:
+            encoded.append(unichr(0x4800 + STREAM_NAME_CHARS.index(name[i])))
+            i += 1
+    return u''.join(encoded)
+
+
+def stringpool(strings, codepage=1252, long_refs=False):
+    """
+    Returns the _StringPool and _StringData streams for strings, which get
+    IDs from 1 in order. None leaves an unused slot.
+    """
+    pool = [struct.pack('<HH', codepage & 0xffff,
+                        (codepage >> 16) | (0x8000 if long_refs else 0))]
+    data = []
+    for string in strings:
+        if string is None:
+            pool.append(struct.pack('<HH', 0, 0))
+            continue
+        encoded = string.encode('cp%d' % codepage)
+        if len(encoded) > 0xffff:
+            pool.append(struct.pack('<HHHH', 0, len(encoded) >> 16,
+                                    len(encoded) & 0xffff, 1))
+        else:
+            pool.append(struct.pack('<HH', len(encoded), 1))
+        data.append(encoded)
+    return (''.join(pool), ''.join(data))
+
+
+def propertytable(properties, string_ids, long_refs=False):
+    """The Property table: a column of names, then a column of values."""
+    def ref(string):
+        string_id = string_ids[string]
+        if long_refs:
+            return struct.pack('<HB', string_id & 0xffff, string_id >> 16)
+        return struct.pack('<H', string_id)
+
+    return (''.join(ref(name) for (name, _) in properties) +
+            ''.join(ref(value) for (_, value) in properties))
+
+
+def summaryinformation(properties, codepage=1252):
+    """A SummaryInformation property set of (id, type, value) tuples."""
+    offset = 8 + 8 * len(properties)
+    entries = []
+    values = []
+    for (property_id, value_type, value) in properties:
+        if value_type == VT_LPSTR:
+            encoded = value.encode('cp%d' % codepage) + '\0'
+            packed = struct.pack('<II', value_type, len(encoded)) + encoded
+        elif value_type == VT_I2:
+            packed = struct.pack('<Ih', value_type, value)
+        else:
+            packed = struct.pack('<Ii', value_type, value)
+        entries.append(struct.pack('<II', property_id, offset))
+        values.append(pad(packed, 4))
+        offset += len(values[-1])
+    section = (struct.pack('<II', offset, len(properties)) +
+               ''.join(entries) + ''.join(values))
+    # byte order, version, OS, CLSID, one section: FMTID_SummaryInformation
+    return (struct.pack('<HHI', 0xfffe, 0, 0x00020006) + '\0' * 16 +
+            struct.pack('<I', 1) +
+            '\xe0\x85\x9f\xf2\xf9\x4f\x68\x10\xab\x91\x08\x00\x2b\x27\xb3\xd9' +
+            struct.pack('<I', 48) + section)
+
+
+def direntry(name, entry_type, start, size, child=NOSTREAM, right=NOSTREAM,
+             clsid='\0' * 16):
+    encoded = (name + u'\0').encode('utf-16-le')
+    return (encoded.ljust(64, '\0') +
+            struct.pack('<HBBIII', len(encoded), entry_type, 1, NOSTREAM,
+                        right, child) +
+            clsid + '\0' * 20 + struct.pack('<IQ', start, size))
+
+
+def compoundfile(streams):
+    """
+    Returns a compound file holding streams, a list of (name, data), in
+    the root storage. Sectors are laid out as the mini stream, the
+    MiniFAT, the regular streams, the directory, the FAT and the DIFAT.
+    """
+    mini_stream = []
+    minifat = []
+    regular = []
+    entries = []
+    for (name, data) in streams:
+        if not data:
+            entries.append([name, ENDOFCHAIN, 0])
+        elif len(data) < MINI_STREAM_CUTOFF:
+            start = len(minifat)
+            count = sectors(data, MINI_SECTOR_SIZE)
+            minifat.extend(range(start + 1, start + count) + [ENDOFCHAIN])
+            mini_stream.append(pad(data, MINI_SECTOR_SIZE))
+            entries.append([name, start, len(data)])
+        else:
+            entries.append([name, len(regular), len(data)])
+            regular.append(data)
+    mini_stream = ''.join(mini_stream)
+    minifat.extend([FREESECT] * (-len(minifat) % (SECTOR_SIZE / 4)))
+    directory_size = (len(entries) + 1) * 128
+
+    chains = [sectors(mini_stream), sectors(pack_longs(minifat))]
+    chains.extend(sectors(data) for data in regular)
+    chains.append(sectors('\0' * directory_size))
+    starts = []
+    fat = []
+    for count in chains:
+        if not count:
+            starts.append(ENDOFCHAIN)
+            continue
+        starts.append(len(fat))
+        fat.extend(range(len(fat) + 1, len(fat) + count) + [ENDOFCHAIN])
+
+    entries_per_sector = SECTOR_SIZE / 4
+    fat_sectors = 1
+    while True:
+        difat_sectors = max(0, -(-(fat_sectors - HEADER_DIFAT_ENTRIES) //
+                                 (entries_per_sector - 1)))
+        if (fat_sectors * entries_per_sector >=
+                len(fat) + fat_sectors + difat_sectors):
+            break
+        fat_sectors += 1
+    fat_locations = range(len(fat), len(fat) + fat_sectors)
+    difat_locations = range(len(fat) + fat_sectors,
+                            len(fat) + fat_sectors + difat_sectors)
+    fat.extend([FATSECT] * fat_sectors + [DIFSECT] * difat_sectors)
+    fat.extend([FREESECT] * (fat_sectors * entries_per_sector - len(fat)))
+
+    for entry in entries:
+        if entry[2] >= MINI_STREAM_CUTOFF:
+            entry[1] = starts[2 + entry[1]]
+    directory = [direntry(u'Root Entry', 5, starts[0], len(mini_stream),
+                          child=1 if entries else NOSTREAM, clsid=MSI_CLSID)]
+    for (i, (name, start, size)) in enumerate(entries):
+        directory.append(direntry(
+            name, 2, start, size,
+            right=i + 2 if i + 1 < len(entries) else NOSTREAM))
+
+    body = [pad(mini_stream, SECTOR_SIZE), pack_longs(minifat)]
+    body.extend(pad(data, SECTOR_SIZE) for data in regular)
+    body.append(pad(''.join(directory), SECTOR_SIZE))
+    body.append(pack_longs(fat))
+    spilled = fat_locations[HEADER_DIFAT_ENTRIES:]
+    for (i, location) in enumerate(difat_locations):
+        part = spilled[i * (entries_per_sector - 1):
+                       (i + 1) * (entries_per_sector - 1)]
+        part += [FREESECT] * (entries_per_sector - 1 - len(part))
+        following = (difat_locations[i + 1]
+                     if i + 1 < len(difat_locations) else ENDOFCHAIN)
+        body.append(pack_longs(part + [following]))
+
+    header_difat = fat_locations[:HEADER_DIFAT_ENTRIES]
+    header_difat += [FREESECT] * (HEADER_DIFAT_ENTRIES - len(header_difat))
+    header = (OLE_SIGNATURE + '\0' * 16 +
+              struct.pack('<HHHHH', 0x3e, 3, 0xfffe, 9, 6) + '\0' * 6 +
+              struct.pack('<IIIIIIIII', 0, fat_sectors, starts[-1], 0,
+                          MINI_STREAM_CUTOFF, starts[1],
+                          sectors(pack_longs(minifat)),
+                          difat_locations[0] if difat_locations
+                          else ENDOFCHAIN,
+                          len(difat_locations)) +
+              pack_longs(header_difat))
+    return header + ''.join(body)
+
+
+def database(properties, summary=None, strings=(), long_refs=False,
+             streams=()):
+    """
+    Returns an MSI database with a Property table. Extra strings go in
+    the pool ahead of the property names and values; extra streams go
+    ahead of the tables.
+    """
+    strings = list(strings)
+    for (name, value) in properties:
+        strings.extend([name, value])
+    (pool, data) = stringpool(strings, long_refs=long_refs)
+    string_ids = dict((string, i + 1) for (i, string) in enumerate(strings)
+                      if string is not None)
+    tables = [(streamname(u'_StringPool', True), pool),
+              (streamname(u'_StringData', True), data),
+              (streamname(u'Property', True),
+               propertytable(properties, string_ids, long_refs))]
+    if summary is not None:
+        tables.append((u'\x05SummaryInformation', summaryinformation(summary)))
+    return compoundfile(list(streams) + tables)
+
+
+PRODUCT_PROPERTIES = [
+    (u'Manufacturer', u'Example Software, Inc.'),
+    (u'ProductCode', u'{6F330B47-2577-43AD-9095-1861BA25889B}'),
+    (u'ProductLanguage', u'1033'),
+    (u'ProductName', u'Example Widget'),
+    (u'ProductVersion', u'2.5.1'),
+    (u'UpgradeCode', u'{2C8B6E13-4A3C-4F5A-9D3E-7B1F0C2A6D41}'),
+    (u'ALLUSERS', u'1'),
+    (u'ARPCOMMENTS', u'Caf\xe9 edition'),
+]
+
+PRODUCT_SUMMARY = [
+    (1, VT_I2, 1252),
+    (2, VT_LPSTR, u'Installation Database'),
+    (3, VT_LPSTR, u'Example Widget'),
+    (4, VT_LPSTR, u'Example Software, Inc.'),
+    (5, VT_LPSTR, u'Installer, MSI, Database'),
+    (6, VT_LPSTR, u'This installer database contains the logic and data '
+                  u'required to install Example Widget.'),
+    (7, VT_LPSTR, u'x64;1033'),
+    (9, VT_LPSTR, u'{1D3F66C2-5A0B-4E4F-8C0A-29E1D5B7F0AE}'),
+    (14, VT_I4, 200),
+    (15, VT_I4, 2),
+    (18, VT_LPSTR, u'Windows Installer XML Toolset (3.10.3.3007)'),
+]
+
+# The strings of the other tables, which push _StringData out of the
+# mini stream as it is in any real package.
+COMPONENT_STRINGS = [u'Component%03d' % i for i in range(400)]
+
+FIXTURES = {
+    'product.msi': dict(properties=PRODUCT_PROPERTIES,
+                        summary=PRODUCT_SUMMARY,
+                        strings=COMPONENT_STRINGS),
+    'nosummary.msi': dict(properties=PRODUCT_PROPERTIES[:5]),
+}
+
+
+if __name__ == '__main__':
+    for (name, options) in sorted(FIXTURES.items()):
+        with open(name, 'wb') as f:
+            f.write(database(**options))
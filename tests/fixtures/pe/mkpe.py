@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+Writes the PE fixtures used by tests/test_peinfo.py.
+
+Each image has a DOS stub, PE32 or PE32+ headers, a .text section and,
+unless it has no version information, a .rsrc section holding a single
+RT_VERSION resource: VS_VERSIONINFO with a VS_FIXEDFILEINFO, a
+StringFileInfo table and a VarFileInfo translation. Installer wrappers
+are marked the way their builders mark them: an extra section, the Inno
+Setup DOS header tag, or data appended after the last section.
+
+Run from this directory to regenerate: python mkpe.py
+"""
+
+import struct
+
+FILE_ALIGNMENT = 0x200
+SECTION_ALIGNMENT = 0x1000
+OLE_SIGNATURE = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def pad(data, size):
+    return data + '\0' * (-len(data) % size)
+
+
+def utf16(text):
+    return text.encode('utf-16-le') + '\0\0'
+
+
+def node(key, value='', value_type=0, children=()):
+    """A VS_VERSIONINFO style node."""
+    body = pad(struct.pack('<HHH', 0, 0, value_type) + utf16(key), 4)
+    body = pad(body + value, 4)
+    for child in children:
+        body = pad(body, 4) + child
+    value_length = len(value) // 2 if value_type == 1 else len(value)
+    return struct.pack('<HHH', len(body), value_length, value_type) + body[6:]
+
+
+def string_node(key, value):
+    return node(key, utf16(value), 1)
+
+
+def versioninfo(file_version, product_version, strings, var_first=False):
+    """A VS_VERSIONINFO resource."""
+    def split(version):
+        (a, b, c, d) = [int(part) for part in version.split('.')]
+        return ((a << 16) | b, (c << 16) | d)
+
+    fixed = struct.pack('<13I', 0xFEEF04BD, 0x10000,
+                        *(split(file_version) + split(product_version) +
+                          (0x3f, 0, 0x40004, 1, 0, 0, 0)))
+    stringfileinfo = node(u'StringFileInfo', '', 1, [
+        node(u'040904b0', '', 1,
+             [string_node(key, value) for (key, value) in strings])])
+    varfileinfo = node(u'VarFileInfo', '', 1, [
+        node(u'Translation', struct.pack('<HH', 0x409, 1200), 0)])
+    children = [stringfileinfo, varfileinfo]
+    if var_first:
+        children.reverse()
+    return node(u'VS_VERSION_INFO', fixed, 0, children)
+
+
+def resources(rva, data):
+    """A .rsrc section with data as its only RT_VERSION resource."""
+    def directory(entry_id, target):
+        return struct.pack('<IIHHHH', 0, 0, 4, 0, 0, 1) + \
+            struct.pack('<II', entry_id, target)
+
+    section = directory(16, 0x80000000 | 24)         # type: RT_VERSION
+    section += directory(1, 0x80000000 | 48)         # name: 1
+    section += directory(0x409, 72)                  # language: en-US
+    section += struct.pack('<IIII', rva + 88, len(data), 1200, 0)
+    return section + data
+
+
+def image(machine=0x14c, is_64bit=False, is_dll=False, version=None,
+          extra_sections=(), dos_tag='', overlay=''):
+    """Returns the bytes of a PE image."""
+    sections = [('.text', pad('\xc3', FILE_ALIGNMENT), 0x60000020)]
+    rsrc_index = None
+    if version is not None:
+        rsrc_index = len(sections)
+        sections.append(('.rsrc', None, 0x40000040))
+    for name in extra_sections:
+        sections.append((name, '', 0xc0000080))
+
+    optional_size = 240 if is_64bit else 224
+    headers_size = 64 + 4 + 20 + optional_size + 40 * len(sections)
+    raw_offset = len(pad('\0' * headers_size, FILE_ALIGNMENT))
+
+    table = ''
+    body = ''
+    rsrc = (0, 0)
+    for (index, (name, data, flags)) in enumerate(sections):
+        virtual_address = SECTION_ALIGNMENT * (index + 1)
+        if index == rsrc_index:
+            data = resources(virtual_address, version)
+            rsrc = (virtual_address, len(data))
+            data = pad(data, FILE_ALIGNMENT)
+        virtual_size = max(len(data), 0x100)
+        table += struct.pack('<8sIIIIIIHHI', name, virtual_size,
+                             virtual_address, len(data),
+                             raw_offset + len(body) if data else 0,
+                             0, 0, 0, 0, flags)
+        body += data
+    image_size = SECTION_ALIGNMENT * (len(sections) + 1)
+
+    directories = [(0, 0)] * 16
+    directories[2] = rsrc
+    if is_64bit:
+        optional = struct.pack('<HBBIIIIIQIIHHHHHHIIIIHHQQQQII',
+                               0x20b, 14, 0, 0x200, 0, 0, 0x1000, 0x1000,
+                               0x140000000, SECTION_ALIGNMENT, FILE_ALIGNMENT,
+                               6, 0, 0, 0, 6, 0, 0, image_size, raw_offset, 0,
+                               2, 0x8160, 0x100000, 0x1000, 0x100000, 0x1000,
+                               0, 16)
+    else:
+        optional = struct.pack('<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII',
+                               0x10b, 14, 0, 0x200, 0, 0, 0x1000, 0x1000,
+                               0x2000, 0x400000, SECTION_ALIGNMENT,
+                               FILE_ALIGNMENT, 6, 0, 0, 0, 6, 0, 0,
+                               image_size, raw_offset, 0, 2, 0x8140,
+                               0x100000, 0x1000, 0x100000, 0x1000, 0, 16)
+    optional += ''.join(struct.pack('<II', *entry) for entry in directories)
+    assert len(optional) == optional_size
+
+    characteristics = 0x0102 | (0x2000 if is_dll else 0)
+    if is_64bit:
+        characteristics = 0x0022 | (0x2000 if is_dll else 0)
+    dos = bytearray(64)
+    dos[0:2] = 'MZ'
+    dos[0x30:0x30 + len(dos_tag)] = dos_tag
+    struct.pack_into('<I', dos, 0x3c, 64)
+    headers = (str(dos) + 'PE\0\0' +
+               struct.pack('<HHIIIHH', machine, len(sections), 0x5f5e1000,
+                           0, 0, optional_size, characteristics) +
+               optional + table)
+    return pad(headers, FILE_ALIGNMENT) + body + overlay
+
+
+SETUP_STRINGS = [
+    (u'CompanyName', u'Example Software, Inc.'),
+    (u'FileDescription', u'Example Widget Setup'),
+    (u'FileVersion', u'2.5.1.300'),
+    (u'InternalName', u'setup'),
+    (u'LegalCopyright', u'\xa9 2015 Example Software, Inc.'),
+    (u'OriginalFilename', u'setup.exe'),
+    (u'ProductName', u'Example Widget'),
+    (u'ProductVersion', u'2.5.1'),
+    (u'Comments', u'Installs Example Widget'),
+]
+
+TOOL_STRINGS = [
+    (u'CompanyName', u'Example Software, Inc.'),
+    (u'FileDescription', u'Example Widget Tools'),
+    (u'LegalTrademarks', u'Widget is a trademark of Example Software'),
+]
+
+FIXTURES = {
+    'setup.exe': dict(version=versioninfo('2.5.1.300', '2.5.1.0',
+                                          SETUP_STRINGS)),
+    'tools64.dll': dict(machine=0x8664, is_64bit=True, is_dll=True,
+                        version=versioninfo('7.0.0.12', '7.0.0.0',
+                                            TOOL_STRINGS, var_first=True)),
+    'noversion.exe': dict(),
+    'nsis.exe': dict(version=versioninfo('3.0.0.0', '3.0.0.0',
+                                         SETUP_STRINGS[:2]),
+                     extra_sections=['.ndata']),
+    'nsis-overlay.exe': dict(overlay='\0\0\0\0\xef\xbe\xad\xdeNullsoftInst' +
+                             '\0' * 64),
+    'inno.exe': dict(dos_tag='Inno'),
+    'wixburn.exe': dict(extra_sections=['.wixburn']),
+    'msi-overlay.exe': dict(overlay=OLE_SIGNATURE + '\0' * 504),
+}
+
+
+if __name__ == '__main__':
+    for (name, options) in sorted(FIXTURES.items()):
+        with open(name, 'wb') as f:
+            f.write(image(**options))
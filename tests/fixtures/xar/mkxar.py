@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+Writes the flat package fixtures used by tests/test_xarfile.py.
+
+Each package is a xar archive laid out the way pkgbuild and productbuild
+write one: a 28 byte header, the zlib compressed table of contents, and
+a heap that starts with the SHA-1 of the compressed TOC. Members carry
+SHA-1 archived and extracted checksums and are stored gzip compressed,
+bzip2 compressed or raw as listed in FIXTURES.
+
+Run from this directory to regenerate: python mkxar.py
+"""
+
+import bz2
+import hashlib
+import struct
+import zlib
+from xml.sax.saxutils import escape
+
+HEADER_FORMAT = '>4sHHQQI'
+CHECKSUM_SHA1 = 1
+
+ENCODINGS = {
+    'gzip': ('application/x-gzip', zlib.compress),
+    'bzip2': ('application/x-bzip2', bz2.compress),
+    'raw': ('application/octet-stream', lambda data: data),
+}
+
+
+def tree(members):
+    """Nests (path, data, encoding) members under their directories."""
+    root = []
+    directories = {'': root}
+    for (path, data, encoding) in members:
+        parts = path.split('/')
+        for depth in range(1, len(parts)):
+            directory = '/'.join(parts[:depth])
+            if directory not in directories:
+                children = []
+                directories['/'.join(parts[:depth - 1])].append(
+                    (parts[depth - 1], None, None, children))
+                directories[directory] = children
+        directories['/'.join(parts[:-1])].append(
+            (parts[-1], data, encoding, None))
+    return root
+
+
+def archive(members):
+    """Returns a xar archive of (path, data, encoding) members."""
+    heap = [hashlib.sha1('').digest()]     # replaced by the TOC checksum
+    position = [20]
+    file_ids = [0]
+
+    def fileelement(name, data, encoding, children):
+        file_ids[0] += 1
+        xml = ['<file id="%d"><name>%s</name>' % (file_ids[0], escape(name))]
+        if children is not None:
+            xml.append('<type>directory</type>')
+            xml.extend(fileelement(*child) for child in children)
+        else:
+            (style, compress) = ENCODINGS[encoding]
+            archived = compress(data)
+            xml.append(
+                '<type>file</type><data>'
+                '<length>%d</length><offset>%d</offset><size>%d</size>'
+                '<encoding style="%s"/>'
+                '<archived-checksum style="sha1">%s</archived-checksum>'
+                '<extracted-checksum style="sha1">%s</extracted-checksum>'
+                '</data>' % (len(archived), position[0], len(data), style,
+                             hashlib.sha1(archived).hexdigest(),
+                             hashlib.sha1(data).hexdigest()))
+            heap.append(archived)
+            position[0] += len(archived)
+        xml.append('</file>')
+        return ''.join(xml)
+
+    files = ''.join(fileelement(*child) for child in tree(members))
+    toc = ('<?xml version="1.0" encoding="UTF-8"?>\n<xar><toc>'
+           '<creation-time>2015-06-01T12:00:00</creation-time>'
+           '<checksum style="sha1"><offset>0</offset><size>20</size>'
+           '</checksum>%s</toc></xar>' % files)
+    compressed = zlib.compress(toc)
+    heap[0] = hashlib.sha1(compressed).digest()
+    header = struct.pack(HEADER_FORMAT, 'xar!', struct.calcsize(HEADER_FORMAT),
+                         1, len(compressed), len(toc), CHECKSUM_SHA1)
+    return header + compressed + ''.join(heap)
+
+
+FOO_PACKAGEINFO = '''<?xml version="1.0" encoding="utf-8"?>
+<pkg-info overwrite-permissions="true" relocatable="false"
+          identifier="com.example.foo" postinstall-action="restart"
+          auth="root" version="1.2.3" format-version="2">
+    <payload numberOfFiles="21" installKBytes="1400"/>
+    <bundle path="./Foo.app" id="com.example.Foo"
+            CFBundleShortVersionString="1.2.3" CFBundleVersion="123"/>
+    <scripts>
+        <postinstall file="./postinstall"/>
+    </scripts>
+</pkg-info>
+'''
+
+BAR_PACKAGEINFO = '''<?xml version="1.0" encoding="utf-8"?>
+<pkg-info identifier="com.example.bar" version="2.0" auth="root"
+          format-version="2">
+    <payload numberOfFiles="3" installKBytes="52"/>
+</pkg-info>
+'''
+
+# No payload, so installing it leaves no receipt.
+SCRIPTS_PACKAGEINFO = '''<?xml version="1.0" encoding="utf-8"?>
+<pkg-info identifier="com.example.scripts" version="1.0" auth="root"
+          format-version="2">
+    <scripts>
+        <preinstall file="./preinstall"/>
+    </scripts>
+</pkg-info>
+'''
+
+DISTRIBUTION = '''<?xml version="1.0" encoding="utf-8"?>
+<installer-gui-script minSpecVersion="1">
+    <title>Foo Suite</title>
+    <description>Installs Foo and Bar.</description>
+    <options customize="never" require-scripts="false"/>
+    <choices-outline>
+        <line choice="default">
+            <line choice="com.example.foo"/>
+            <line choice="com.example.bar"/>
+        </line>
+    </choices-outline>
+    <choice id="default"/>
+    <choice id="com.example.foo" visible="false">
+        <pkg-ref id="com.example.foo"/>
+    </choice>
+    <choice id="com.example.bar" visible="false">
+        <pkg-ref id="com.example.bar"/>
+    </choice>
+    <pkg-ref id="com.example.foo" version="1.2.3" installKBytes="1400"
+             onConclusion="RequireRestart">#Foo.pkg</pkg-ref>
+    <pkg-ref id="com.example.bar" version="2.0"
+             installKBytes="52">#Bar%20Tools.pkg</pkg-ref>
+</installer-gui-script>
+'''
+
+# 'Payload' stands in for the cpio archive; it is never parsed.
+PAYLOAD = ''.join(chr(i % 251) for i in range(4096))
+
+FIXTURES = {
+    # a component package, as pkgbuild writes it
+    'Foo.pkg': [
+        ('Bom', 'BOMStore' + '\0' * 504, 'raw'),
+        ('Payload', PAYLOAD, 'raw'),
+        ('Scripts', '0707070000000000000000' * 8, 'bzip2'),
+        ('PackageInfo', FOO_PACKAGEINFO, 'gzip'),
+    ],
+    # a product archive, as productbuild writes it
+    'FooSuite.pkg': [
+        ('Distribution', DISTRIBUTION, 'raw'),
+        ('Resources/en.lproj/Welcome.rtf', '{\\rtf1 Welcome}', 'gzip'),
+        ('Foo.pkg/Bom', 'BOMStore' + '\0' * 504, 'raw'),
+        ('Foo.pkg/Payload', PAYLOAD, 'raw'),
+        ('Foo.pkg/PackageInfo', FOO_PACKAGEINFO, 'gzip'),
+        ('Bar Tools.pkg/PackageInfo', BAR_PACKAGEINFO, 'bzip2'),
+        ('Bar Tools.pkg/Payload', PAYLOAD[:100], 'gzip'),
+        ('Scripts.pkg/PackageInfo', SCRIPTS_PACKAGEINFO, 'raw'),
+    ],
+    # a product archive whose component packages live outside it
+    'FooSuite-dist.pkg': [
+        ('Distribution', DISTRIBUTION, 'bzip2'),
+        ('Resources/en.lproj/License.txt', 'Use it well.\n', 'raw'),
+    ],
+}
+
+
+if __name__ == '__main__':
+    for (name, members) in sorted(FIXTURES.items()):
+        with open(name, 'wb') as f:
+            f.write(archive(members))
@@ -0,0 +1,23 @@
+"""
+Shared setup for the tests: puts the repository on sys.path and, where
+PyObjC is missing, stubs the OS X modules munkilib imports the same way
+bigfiximport does, so the pure-python parts of munkilib can be tested on
+any platform.
+"""
+
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_DIR, 'tests', 'fixtures')
+
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+import bigfiximport
+
+if not bigfiximport.DARWIN_FOUNDATION_AVAILABLE:
+    bigfiximport.stub_missing_modules(bigfiximport.DARWIN_MODULES)
+    # gurl subclasses NSObject, so it can't be loaded against the stubs
+    sys.modules.setdefault('munkilib.gurl',
+                           bigfiximport.DummyModule('munkilib.gurl'))
@@ -0,0 +1,137 @@
+"""Adobe setup info read from a zip matches the info of its extracted copy."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+
+from tests import support
+from munkilib import adobeutils
+
+PROXY_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<PayloadInfo version="1.0">
+  <InstallerProperties>
+    <Property name="AdobeCode">%(code)s</Property>
+    <Property name="ProductName">%(name)s</Property>
+    <Property name="ProductVersion">%(version)s</Property>
+  </InstallerProperties>
+  <InstallDestinationMetadata>
+    <TotalSize>%(size)d</TotalSize>
+  </InstallDestinationMetadata>
+</PayloadInfo>
+'''
+
+SETUP_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<Setup>
+  <Driver folder="%s" sapCode="FOO"/>
+</Setup>
+'''
+
+
+def proxy_xml(code, name, version, size):
+    return PROXY_XML % {'code': code, 'name': name, 'version': version,
+                        'size': size}
+
+
+def media_db(path, payload_xml):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('CREATE TABLE PayloadData '
+                     '(PayloadID TEXT, key TEXT, value TEXT)')
+        conn.execute('INSERT INTO PayloadData VALUES (?, ?, ?)',
+                     ('{CODE}', 'PayloadInfo', payload_xml.decode('utf-8')))
+        conn.commit()
+    finally:
+        conn.close()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class SetupInfoFromZipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.listdir = os.listdir
+        # getAdobeSetupInfo ran on HFS+, which lists names sorted
+        os.listdir = lambda path: sorted(self.listdir(path))
+
+    def tearDown(self):
+        os.listdir = self.listdir
+        shutil.rmtree(self.tempdir)
+
+    def make_zip(self, members):
+        """
+        Writes members, a list of (name, data), to a zip and returns its
+        path and that of a copy extracted the way the Adobe Windows
+        handler used to: every member except .zip and .exe files.
+        """
+        zippath = os.path.join(self.tempdir, 'update.zip')
+        extractdir = os.path.join(self.tempdir, 'extracted')
+        zf = zipfile.ZipFile(zippath, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            for (name, data) in members:
+                zf.writestr(name, data)
+        finally:
+            zf.close()
+        zf = zipfile.ZipFile(zippath, 'r')
+        try:
+            for name in zf.namelist():
+                if not name.endswith('.zip') and not name.endswith('.exe'):
+                    zf.extract(name, extractdir)
+        finally:
+            zf.close()
+        return (zippath, extractdir)
+
+    def assertSameInfo(self, members):
+        (zippath, extractdir) = self.make_zip(members)
+        info = adobeutils.getAdobeSetupInfoFromZip(zippath)
+        self.assertEqual(info, adobeutils.getAdobeSetupInfo(extractdir))
+        return info
+
+    def test_payloads_layout(self):
+        db = media_db(os.path.join(self.tempdir, 'Media_db.db'),
+                      proxy_xml('{BAR-2}', 'Adobe Bar', '2.0.1', 4096000))
+        info = self.assertSameInfo([
+            ('AdobeFoo/payloads/setup.xml', SETUP_XML % 'AdobeFoo1.0All'),
+            ('AdobeFoo/payloads/AdobeFoo1.0All/AdobeFoo1.0All.proxy.xml',
+             proxy_xml('{FOO-1}', 'Adobe Foo', '1.0.2', 2048000)),
+            ('AdobeFoo/payloads/AdobeFoo1.0All/Assets1_1.zip', 'PK'),
+            ('AdobeFoo/payloads/AdobeBar2.0All/Media_db.db', db),
+            ('AdobeFoo/payloads/AdobeEmpty/readme.txt', 'nothing here'),
+            ('AdobeFoo/Set-up.exe', 'MZ'),
+        ])
+        self.assertEqual(info['display_name'], 'Adobe Foo')
+        self.assertEqual(info['version'], '1.0.2')
+        self.assertEqual(info['AdobeSetupType'], 'ProductInstall')
+        self.assertEqual(len(info['payloads']), 2)
+
+    def test_extensions_layout(self):
+        # "Updater-Extra/extensions" sorts before "Updater/extensions", but
+        # a top-down walk reaches "Updater/extensions" first
+        info = self.assertSameInfo([
+            ('Updater/extensions/ExtA/ExtA.proxy.xml',
+             proxy_xml('{EXT-A}', 'Adobe Ext A', '3.1', 1024)),
+            ('Updater/extensions/LanguagePack_fr/Lang.proxy.xml',
+             proxy_xml('{LANG}', 'French', '3.1', 1024)),
+            ('Updater-Extra/extensions/ExtB/ExtB.proxy.xml',
+             proxy_xml('{EXT-B}', 'Adobe Ext B', '9.0', 1024)),
+        ])
+        self.assertEqual(info['display_name'], 'Adobe Ext A')
+        self.assertEqual(info['version'], '3.1')
+
+    def test_setup_xml_case(self):
+        # an extracted copy on a case-sensitive volume has no setup.xml
+        info = self.assertSameInfo([
+            ('AdobeFoo/payloads/Setup.xml', SETUP_XML % 'AdobeFoo1.0All'),
+            ('AdobeFoo/payloads/AdobeFoo1.0All/AdobeFoo1.0All.proxy.xml',
+             proxy_xml('{FOO-1}', 'Adobe Foo', '1.0.2', 2048000)),
+            ('AdobeFoo/payloads/AdobeBar2.0All/AdobeBar2.0All.proxy.xml',
+             proxy_xml('{BAR-2}', 'Adobe Bar', '2.0.1', 4096000)),
+        ])
+        self.assertFalse('AdobeSetupType' in info)
+
+
+if __name__ == '__main__':
+    unittest.main()
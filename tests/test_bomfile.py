@@ -0,0 +1,162 @@
+"""bomfile and munkicommon.getBomList against `lsbom -s` listings."""
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+
+from tests import support
+from munkilib import bomfile, munkicommon, removepackages
+
+BOM_DIR = os.path.join(support.FIXTURES_DIR, 'bom')
+
+
+def lsbom(pkgname):
+    with open(os.path.join(BOM_DIR, pkgname + '.lsbom'), 'rb') as f:
+        return f.read().splitlines()
+
+
+def lsbom_long(pkgname):
+    """(path, mode, uid, gid) of each entry of the plain `lsbom` listing."""
+    entries = []
+    with open(os.path.join(BOM_DIR, pkgname + '.lsbom-long'), 'rb') as f:
+        for line in f.read().splitlines():
+            fields = line.split('\t')
+            (uid, gid) = fields[2].split('/')
+            entries.append((fields[0].decode('utf-8'), int(fields[1], 8),
+                            int(uid), int(gid)))
+    return entries
+
+
+class FakePkgutil(object):
+    """Stands in for `pkgutil --pkg-info-plist` in a subprocess.Popen."""
+
+    install_location = None
+
+    def __init__(self, cmd, **dummy_kwargs):
+        self.cmd = cmd
+
+    def communicate(self):
+        if self.install_location is None:
+            return ('', 'No receipt for \'%s\' found.' % self.cmd[-1])
+        return (munkicommon.FoundationPlist.writePlistToString(
+            {'pkgid': self.cmd[-1], 'pkg-version': '1.2.3',
+             'install-location': self.install_location,
+             'install-time': 1420070400}), '')
+
+
+class GetBomListTest(unittest.TestCase):
+
+    def test_archive_bom(self):
+        self.assertEqual(
+            munkicommon.getBomList(os.path.join(BOM_DIR, 'Foo.pkg')),
+            lsbom('Foo.pkg'))
+
+    def test_resources_bom(self):
+        self.assertEqual(
+            munkicommon.getBomList(os.path.join(BOM_DIR, 'Baz.pkg')),
+            lsbom('Baz.pkg'))
+
+    def test_unreadable_bom(self):
+        warnings = []
+        display_warning = munkicommon.display_warning
+        munkicommon.display_warning = warnings.append
+        tempdir = tempfile.mkdtemp()
+        try:
+            contents = os.path.join(tempdir, 'Broken.pkg', 'Contents')
+            os.makedirs(contents)
+            with open(os.path.join(BOM_DIR, 'Foo.pkg', 'Contents',
+                                   'Archive.bom'), 'rb') as f:
+                data = f.read()
+            with open(os.path.join(contents, 'Archive.bom'), 'wb') as f:
+                f.write(data[:len(data) // 2])
+            self.assertEqual(
+                munkicommon.getBomList(os.path.join(tempdir, 'Broken.pkg')),
+                [])
+            self.assertEqual(len(warnings), 1)
+        finally:
+            munkicommon.display_warning = display_warning
+            shutil.rmtree(tempdir)
+
+
+class ReadBomTest(unittest.TestCase):
+
+    def test_modes_and_owners(self):
+        entries = dict(
+            (path, (mode, uid, gid)) for (path, mode, uid, gid)
+            in bomfile.readbom(os.path.join(BOM_DIR, 'Foo.pkg', 'Contents',
+                                            'Archive.bom')))
+        self.assertEqual(entries['.'], (040755, 0, 0))
+        self.assertEqual(entries['./Applications'], (040775, 0, 80))
+        self.assertEqual(
+            entries['./Applications/Foo.app/Contents/MacOS/Foo'],
+            (0100755, 0, 80))
+        self.assertEqual(
+            entries['./Applications/Foo.app/Contents/Frameworks/'
+                    'Bar.framework/Versions/Current'],
+            (0120755, 0, 80))
+
+    def test_same_as_lsbom(self):
+        for bompath in ['Foo.pkg/Contents/Archive.bom',
+                        'Baz.pkg/Contents/Resources/Baz.bom']:
+            self.assertEqual(
+                list(bomfile.readbom(os.path.join(BOM_DIR, bompath))),
+                lsbom_long(bompath.split('/')[0]))
+
+    def test_not_a_bom(self):
+        self.assertRaises(
+            bomfile.Error, list,
+            bomfile.readbom(os.path.join(BOM_DIR, 'Foo.pkg.lsbom')))
+
+
+class ImportBomTest(unittest.TestCase):
+    """The paths and perms removepackages records from a BOM."""
+
+    def setUp(self):
+        self.popen = subprocess.Popen
+        subprocess.Popen = FakePkgutil
+        self.conn = sqlite3.connect(':memory:')
+        self.curs = self.conn.cursor()
+        removepackages.CreateTables(self.curs)
+
+    def tearDown(self):
+        subprocess.Popen = self.popen
+        FakePkgutil.install_location = None
+        self.conn.close()
+
+    def imported(self, bompath):
+        removepackages.ImportBom(os.path.join(BOM_DIR, bompath), self.curs)
+        return self.curs.execute(
+            'SELECT path, uid, gid, perms FROM pkgs_paths '
+            'JOIN paths ON pkgs_paths.path_key = paths.path_key '
+            'ORDER BY pkgs_paths.rowid').fetchall()
+
+    def expected(self, pkgname, ppath):
+        # perms are stored as lsbom prints the mode, and the root
+        # entry is left out
+        return [((ppath + '/' if ppath else '') + path.lstrip('./'),
+                 uid, gid, int('%o' % mode))
+                for (path, mode, uid, gid) in lsbom_long(pkgname)
+                if path != '.']
+
+    def test_without_receipt(self):
+        self.assertEqual(self.imported('Foo.pkg/Contents/Archive.bom'),
+                         self.expected('Foo.pkg', ''))
+        self.assertEqual(
+            self.curs.execute('SELECT pkgid, vers, ppath FROM pkgs')
+            .fetchall(), [('Archive', '1.0', '')])
+
+    def test_install_location(self):
+        FakePkgutil.install_location = './Library/Baz/'
+        self.assertEqual(self.imported('Baz.pkg/Contents/Resources/Baz.bom'),
+                         self.expected('Baz.pkg', 'Library/Baz'))
+        self.assertEqual(
+            self.curs.execute('SELECT timestamp, pkgid, vers, ppath '
+                              'FROM pkgs').fetchall(),
+            [(1420070400, 'Baz', '1.2.3', 'Library/Baz')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+# encoding: utf-8
+"""bplist writer/reader round trips and malformed binary plists."""
+
+import datetime
+import plistlib
+import random
+import struct
+import unittest
+
+from tests import support
+from munkilib import bplist
+
+INTEGERS = [0, 1, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**40,
+            2**63 - 1, 2**63, 2**64 - 1, -1, -256, -2**31, -2**63]
+
+ROOT = {
+    'string': 'ascii',
+    'unicode': u'Caf\xe9 ☃',
+    'empty string': '',
+    'long string': 'x' * 300,
+    'true': True,
+    'false': False,
+    'integers': INTEGERS,
+    'reals': [0.0, 3.5, -2.5e300, 0.1],
+    'dates': [datetime.datetime(2015, 6, 1, 12, 30, 15),
+              datetime.datetime(2001, 1, 1),
+              datetime.datetime(1970, 1, 1),
+              datetime.datetime(2038, 1, 19, 3, 14, 7, 500000)],
+    'data': plistlib.Data('\x00\xff' * 20),
+    'empty data': plistlib.Data(''),
+    'uids': [{'CF$UID': 0}, {'CF$UID': 7}, {'CF$UID': 70000}],
+    'nested': {'a': {'b': [[], {}]}},
+    # 300 distinct strings: more than 255 objects needs two byte refs
+    'many': ['item %d' % i for i in range(300)],
+}
+
+
+def assemble(objects, top=0, offset_size=1, ref_size=1):
+    """A binary plist of already encoded objects."""
+    parts = [bplist.MAGIC]
+    offsets = []
+    position = len(bplist.MAGIC)
+    for obj in objects:
+        offsets.append(position)
+        parts.append(obj)
+        position += len(obj)
+    for offset in offsets:
+        parts.append(''.join(chr(offset >> (8 * i) & 0xff)
+                             for i in reversed(range(offset_size))))
+    parts.append(struct.pack(bplist.TRAILER_FORMAT, offset_size, ref_size,
+                             len(objects), top, position))
+    return ''.join(parts)
+
+
+def trailer(data):
+    return struct.unpack_from(bplist.TRAILER_FORMAT, data,
+                              len(data) - bplist.TRAILER_SIZE)
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def test_every_type(self):
+        data = bplist.writeplist(ROOT)
+        self.assertTrue(bplist.isbplist(data))
+        self.assertEqual(bplist.readplist(data), ROOT)
+
+    def test_two_byte_refs(self):
+        (offset_size, ref_size, count, _, _) = trailer(
+            bplist.writeplist(ROOT))
+        self.assertTrue(count > 255)
+        self.assertEqual((offset_size, ref_size), (2, 2))
+
+    def test_shared_objects(self):
+        # equal strings and numbers are stored once
+        data = bplist.writeplist(['same', 'same', 7, 7, ['same']])
+        self.assertEqual(trailer(data)[2], 4)
+        self.assertEqual(bplist.readplist(data),
+                         ['same', 'same', 7, 7, ['same']])
+
+    def test_integer_encodings(self):
+        for (value, marker) in [(255, '\x10'), (65535, '\x11'),
+                                (2**32 - 1, '\x12'), (2**40, '\x13'),
+                                (-1, '\x13'), (2**63, '\x14')]:
+            data = bplist.writeplist([value])
+            self.assertEqual(data[10], marker, value)
+            self.assertEqual(bplist.readplist(data), [value])
+
+    def test_utf8_str(self):
+        self.assertEqual(bplist.readplist(bplist.writeplist('Caf\xc3\xa9')),
+                         u'Caf\xe9')
+
+    def test_tuple_and_bytearray(self):
+        self.assertEqual(
+            bplist.readplist(bplist.writeplist((1, bytearray('ab')))),
+            [1, plistlib.Data('ab')])
+
+    def test_types_the_writer_never_uses(self):
+        # null, a 32-bit real, a set and three byte offsets
+        data = assemble(['\xa3\x01\x02\x03', '\x00',
+                         '\x22' + struct.pack('>f', 1.5),
+                         '\xc1\x01'], offset_size=3)
+        self.assertEqual(bplist.readplist(data), [None, 1.5, [None]])
+
+
+class MalformedTest(unittest.TestCase):
+
+    def assertMalformed(self, data):
+        self.assertRaises(bplist.Error, bplist.readplist, data)
+
+    def test_not_bplist(self):
+        self.assertMalformed('')
+        self.assertMalformed('<?xml version="1.0" encoding="UTF-8"?>' +
+                             ' ' * 64)
+        self.assertMalformed('bplist01' + bplist.writeplist([1])[8:])
+
+    def test_bad_trailer(self):
+        self.assertMalformed(assemble(['\x08'], top=1))
+        self.assertMalformed(assemble(['\x08'], offset_size=0))
+        self.assertMalformed(bplist.writeplist([1, 2, 3])[:-40] + '\0' * 32)
+
+    def test_bad_reference(self):
+        self.assertMalformed(assemble(['\xa1\x05', '\x08']))
+
+    def test_contains_itself(self):
+        self.assertMalformed(assemble(['\xa1\x00']))
+        self.assertMalformed(assemble(['\xd1\x01\x00', '\x51a']))
+
+    def test_unknown_type(self):
+        self.assertMalformed(assemble(['\x70']))
+        self.assertMalformed(assemble(['\x24' + '\0' * 16]))
+
+    def test_huge_lengths(self):
+        self.assertMalformed(assemble(['\xaf\x13' + struct.pack('>Q', 2**60)]))
+        self.assertMalformed(assemble(['\xdf\x12' + struct.pack('>I', 2**31)]))
+        self.assertMalformed(assemble(['\x5f\x20' + '\0' * 8]))
+
+    def test_deep_nesting(self):
+        depth = 5000
+        objects = ['\xa1' + struct.pack('>H', i + 1) for i in range(depth)]
+        data = assemble(objects + ['\xa0'], offset_size=2, ref_size=2)
+        self.assertMalformed(data)
+
+    def test_dates_out_of_range(self):
+        for seconds in [1e20, -1e12, float('inf'), float('nan')]:
+            self.assertMalformed(assemble(['\x33' + struct.pack('>d',
+                                                                seconds)]))
+
+    def test_truncated(self):
+        data = bplist.writeplist(ROOT)
+        for length in range(0, len(data), 7):
+            try:
+                bplist.readplist(data[:length])
+            except bplist.Error:
+                pass
+
+    def test_corrupted(self):
+        rng = random.Random(20)
+        data = bplist.writeplist(ROOT)
+        for dummy_case in range(500):
+            damaged = bytearray(data)
+            for dummy_byte in range(rng.randint(1, 8)):
+                damaged[rng.randrange(len(damaged))] = rng.randrange(256)
+            try:
+                bplist.readplist(str(damaged))
+            except bplist.Error:
+                pass
+
+
+class UnwritableTest(unittest.TestCase):
+
+    def assertUnwritable(self, obj):
+        self.assertRaises(bplist.Error, bplist.writeplist, obj)
+
+    def test_unsupported_types(self):
+        self.assertUnwritable(None)
+        self.assertUnwritable([object()])
+        self.assertUnwritable({1: 'one'})
+
+    def test_integers_out_of_range(self):
+        self.assertUnwritable(2**64)
+        self.assertUnwritable(-2**63 - 1)
+
+    def test_contains_itself(self):
+        root = []
+        root.append(root)
+        self.assertUnwritable(root)
+
+    def test_deep_nesting(self):
+        root = []
+        for dummy_level in range(5000):
+            root = [root]
+        self.assertUnwritable(root)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+# encoding: utf-8
+"""dmgfile and hfsplus on UDIF images built by mkdmg."""
+
+import cStringIO
+import imp
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+from munkilib import dmgfile, hfsplus
+
+DMG_DIR = os.path.join(support.FIXTURES_DIR, 'dmg')
+mkdmg = imp.load_source('mkdmg', os.path.join(DMG_DIR, 'mkdmg.py'))
+
+
+class ImageTest(unittest.TestCase):
+    """Builds the image once for the tests of a class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        (cls.raw_volume, data) = mkdmg.image()
+        cls.path = cls.write('Foo.dmg', data)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    @classmethod
+    def write(cls, name, data):
+        path = os.path.join(cls.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+class ADCTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = mkdmg.BIG_TEXT[:40000] + mkdmg.EXECUTABLE
+        compressed = mkdmg.adc_compress(data)
+        self.assertTrue(len(compressed) < len(data) / 4)
+        self.assertEqual(dmgfile.adc_decompress(compressed), data)
+
+    def test_copy_forms(self):
+        # a literal, a two byte copy and a three byte copy overlapping
+        # its own output
+        self.assertEqual(dmgfile.adc_decompress('\x83abcd' + '\x0c\x03' +
+                                                '\x4c\x00\x00'),
+                         'abcd' + 'abcdab' + 'b' * 16)
+
+    def test_bad_distance(self):
+        self.assertRaises(dmgfile.Error, dmgfile.adc_decompress,
+                          '\x80a\x00\x05')
+
+
+class DiskImageTest(ImageTest):
+
+    def test_partitions(self):
+        with dmgfile.DiskImage(self.path) as image:
+            self.assertEqual(image.partitions(), [
+                {'name': 'Protective Master Boot Record (MBR : 0)',
+                 'offset': 0, 'size': 512},
+                {'name': 'disk image (Apple_HFS : 1)',
+                 'offset': 512, 'size': len(self.raw_volume)}])
+            self.assertEqual(image.size, 512 + len(self.raw_volume))
+
+    def test_chunk_types(self):
+        with dmgfile.DiskImage(self.path) as image:
+            self.assertEqual(
+                sorted(set(chunk[2] for chunk in image.chunks)),
+                [dmgfile.CHUNK_ZERO, dmgfile.CHUNK_RAW, dmgfile.CHUNK_ADC,
+                 dmgfile.CHUNK_ZLIB, dmgfile.CHUNK_BZIP2])
+
+    def test_read_whole_disk(self):
+        with dmgfile.DiskImage(self.path) as image:
+            self.assertEqual(image.read(512), '\0' * 512)
+            self.assertEqual(image.read(), self.raw_volume)
+            self.assertEqual(image.read(), '')
+
+    def test_read_across_chunks(self):
+        chunk = mkdmg.CHUNK_SECTORS * mkdmg.SECTOR_SIZE
+        with dmgfile.DiskImage(self.path) as image:
+            for start in range(512 + chunk - 100, len(self.raw_volume),
+                               chunk * 3 - 7):
+                image.seek(start)
+                self.assertEqual(image.read(300),
+                                 self.raw_volume[start - 512:start - 212])
+            image.seek(-10, 2)
+            self.assertEqual(image.tell(), image.size - 10)
+            self.assertEqual(image.read(100), self.raw_volume[-10:])
+
+    def test_not_udif(self):
+        path = self.write('plain.dmg', self.raw_volume)
+        self.assertRaises(dmgfile.Error, dmgfile.DiskImage, path)
+
+    def test_truncated(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        path = self.write('truncated.dmg', data[:len(data) // 2])
+        self.assertRaises(dmgfile.Error, dmgfile.DiskImage, path)
+
+    def test_corrupt_chunk(self):
+        with dmgfile.DiskImage(self.path) as image:
+            (sector, dummy_sectors, dummy_type, offset, length) = [
+                chunk for chunk in image.chunks
+                if chunk[2] == dmgfile.CHUNK_ZLIB][1]
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        path = self.write('corrupt.dmg', data[:offset + 10] +
+                          '\xff' * (length - 10) + data[offset + length:])
+        with dmgfile.DiskImage(path) as image:
+            image.seek(sector * mkdmg.SECTOR_SIZE)
+            self.assertRaises(dmgfile.Error, image.read, 512)
+
+    def test_large_zero_chunk(self):
+        # 8GB of free space, read without being held in memory
+        sectors = 2**24
+        path = self.write('sparse.dmg', mkdmg.udif([
+            ('disk image (Apple_Free : 1)', sectors, ['raw']),
+            ('disk image (Apple_HFS : 2)', self.raw_volume, ['zlib'])]))
+        with dmgfile.DiskImage(path) as image:
+            image.seek(sectors * 512 - 10)
+            self.assertEqual(image.read(20), '\0' * 10 + self.raw_volume[:10])
+        with dmgfile.openvolume(path) as volume:
+            self.assertEqual(volume.read('Read Me'), 'hard link contents')
+
+    def test_corrupted(self):
+        rng = random.Random(19)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        table = data.index('<?xml')
+        for dummy_case in range(200):
+            damaged = bytearray(data)
+            for dummy_byte in range(rng.randint(1, 4)):
+                # the block table and trailer, or the chunks
+                position = rng.choice([rng.randrange(table, len(data)),
+                                       rng.randrange(table)])
+                damaged[position] = rng.choice('ABCDEFabcdef0189+/' +
+                                               chr(rng.randrange(256)))
+            path = self.write('damaged.dmg', str(damaged))
+            try:
+                with dmgfile.openvolume(path) as volume:
+                    for name in volume.namelist():
+                        if not name.endswith('/'):
+                            volume.read(name)
+            except (dmgfile.Error, hfsplus.Error):
+                pass
+
+    def test_no_hfs_volume(self):
+        path = self.write('empty.dmg', mkdmg.udif([
+            ('disk image (Apple_Free : 1)', '\0' * 4096, ['raw'])]))
+        self.assertRaises(dmgfile.Error, dmgfile.openvolume, path)
+
+
+class VolumeTest(ImageTest):
+
+    def setUp(self):
+        self.volume = dmgfile.openvolume(self.path)
+
+    def tearDown(self):
+        self.volume.close()
+
+    def test_listing(self):
+        self.assertEqual(sorted(self.volume.listdir('')),
+                         ['Applications', 'Filler', 'Foo.app', 'Read Me'])
+        self.assertEqual(
+            sorted(self.volume.listdir('Foo.app/Contents/Resources')),
+            ['Caf\xc3\xa9', 'Loop', 'a:b', 'big.txt', 'tiny'])
+        self.assertEqual(len(self.volume.listdir('Filler')), 40)
+        self.assertRaises(hfsplus.Error, self.volume.listdir, 'Read Me')
+
+    def test_namelist(self):
+        expected = []
+        for spec in mkdmg.SPECS:
+            if spec[0].startswith('.journal'):
+                continue
+            expected.append(spec[0] + '/' if spec[1] == 'dir' else spec[0])
+        self.assertEqual(sorted(self.volume.namelist()), sorted(expected))
+
+    def test_walk(self):
+        walked = dict((dirpath, (sorted(dirnames), sorted(filenames)))
+                      for (dirpath, dirnames, filenames)
+                      in self.volume.walk('Foo.app'))
+        self.assertEqual(walked['Foo.app/Contents'],
+                         (['MacOS', 'Resources'], ['Current', 'Info.plist']))
+        self.assertEqual(walked['Foo.app/Contents/MacOS'], ([], ['Foo']))
+
+    def test_read_file(self):
+        # scattered over every other block
+        self.assertEqual(self.volume.read('Foo.app/Contents/MacOS/Foo'),
+                         mkdmg.EXECUTABLE)
+        self.assertEqual(self.volume.read('Foo.app/Contents/Resources/a:b'),
+                         'colon')
+        self.assertEqual(
+            self.volume.open('Foo.app/Contents/Resources/Caf\xc3\xa9').read(),
+            'accented')
+        self.assertRaises(hfsplus.Error, self.volume.read, 'Foo.app')
+        self.assertRaises(hfsplus.Error, self.volume.read, 'Missing')
+
+    def test_private_files_hidden(self):
+        self.assertFalse(self.volume.exists('.journal'))
+        self.assertFalse(self.volume.exists(mkdmg.PRIVATE_DATA))
+
+    def test_symlink(self):
+        self.assertTrue(self.volume.islink('Foo.app/Contents/Current'))
+        self.assertTrue(self.volume.isdir('Foo.app/Contents/Current'))
+        self.assertEqual(self.volume.read('Foo.app/Contents/Current/Foo'),
+                         mkdmg.EXECUTABLE)
+        self.assertEqual(
+            self.volume.read('Foo.app/Contents/Current/../Info.plist'),
+            mkdmg.INFO_PLIST)
+
+    def test_absolute_symlink(self):
+        # points off the volume
+        self.assertTrue(self.volume.islink('Applications'))
+        self.assertFalse(self.volume.exists('Applications'))
+
+    def test_symlink_loop(self):
+        self.assertRaises(hfsplus.Error, self.volume.read,
+                          'Foo.app/Contents/Resources/Loop')
+
+    def test_hardlink(self):
+        self.assertTrue(self.volume.isfile('Read Me'))
+        self.assertEqual(self.volume.read('Read Me'), 'hard link contents')
+
+    def test_decmpfs_type3(self):
+        self.assertEqual(self.volume.read('Foo.app/Contents/Info.plist'),
+                         mkdmg.INFO_PLIST)
+        self.assertEqual(self.volume.read('Filler/f039'), 'filler 39')
+
+    def test_decmpfs_type3_stored(self):
+        self.assertEqual(self.volume.read('Foo.app/Contents/Resources/tiny'),
+                         'tiny stored')
+
+    def test_corrupted_metadata(self):
+        rng = random.Random(19)
+        volume = self.volume
+        regions = [(1024, 1536)]
+        for tree in [volume.catalog, volume.extents_tree,
+                     volume.attributes_tree]:
+            regions.extend((start * volume.block_size,
+                            (start + count) * volume.block_size)
+                           for (start, count) in tree.fork[1])
+        for dummy_case in range(300):
+            damaged = bytearray(self.raw_volume)
+            for dummy_byte in range(rng.randint(1, 6)):
+                (start, end) = rng.choice(regions)
+                damaged[rng.randrange(start, end)] = rng.randrange(256)
+            try:
+                with hfsplus.HFSVolume(cStringIO.StringIO(str(damaged))) as \
+                        damaged_volume:
+                    for name in damaged_volume.namelist():
+                        if not name.endswith('/'):
+                            damaged_volume.read(name)
+            except hfsplus.Error:
+                pass
+
+    def test_decmpfs_type4(self):
+        # four resource fork blocks, the second one stored
+        self.assertEqual(
+            self.volume.read('Foo.app/Contents/Resources/big.txt'),
+            mkdmg.BIG_TEXT)
+
+
+if __name__ == '__main__':
+    unittest.main()
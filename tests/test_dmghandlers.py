@@ -0,0 +1,76 @@
+"""Disk image handlers on volumes that fail part way through reading."""
+
+import unittest
+
+from tests import support
+import bigfiximport
+from bigfiximport import (AdobeMacUpdateHandler, BigFixImportError,
+                          CopyFromDmgHandler, ImportJob)
+from munkilib import dmgfile, hfsplus
+
+
+class DamagedVolume(object):
+    """A volume that opens, but whose catalog can't be read."""
+
+    closed = False
+
+    def walk(self):
+        raise hfsplus.Error('Corrupt B-tree node 7')
+
+    def namelist(self):
+        raise hfsplus.Error('Corrupt B-tree node 7')
+
+    def close(self):
+        self.closed = True
+
+
+class DmgHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.volume = DamagedVolume()
+        self.openvolume = dmgfile.openvolume
+        self.foundation = bigfiximport.DARWIN_FOUNDATION_AVAILABLE
+        dmgfile.openvolume = lambda file_path: self.volume
+        self.job = ImportJob('/tmp/Foo.dmg')
+        self.job.fileinfo = {'base_file_name': 'Foo'}
+
+    def tearDown(self):
+        dmgfile.openvolume = self.openvolume
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = self.foundation
+
+    def assertReadError(self, callable, *args):
+        try:
+            callable(*args)
+        except BigFixImportError, err:
+            self.assertTrue('Corrupt B-tree node 7' in str(err), str(err))
+        else:
+            self.fail('BigFixImportError not raised')
+        self.assertTrue(self.volume.closed)
+
+    def test_copyfromdmg_read_error(self):
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = False
+        self.assertReadError(CopyFromDmgHandler().extract, None, self.job)
+
+    def test_copyfromdmg_mounts_on_read_error(self):
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = True
+        handler = CopyFromDmgHandler()
+        handler.find_mounted_app = lambda file_path: (None, None)
+        self.assertEqual(handler.extract(None, self.job), None)
+        self.assertTrue(self.volume.closed)
+
+    def test_adobemac_read_error(self):
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = False
+        self.assertReadError(AdobeMacUpdateHandler().extract_adobe_info,
+                             None, self.job)
+
+    def test_adobemac_mounts_on_read_error(self):
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = True
+        handler = AdobeMacUpdateHandler()
+        handler.extract_mounted_adobe_info = lambda importer, job: {'mounted': True}
+        self.assertEqual(handler.extract_adobe_info(None, self.job),
+                         {'mounted': True})
+        self.assertTrue(self.volume.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Importer.extract merges the values it adds with the handler's."""
+
+import unittest
+
+from tests import support
+import bigfiximport
+from bigfiximport import ImportHandler, ImportJob, Importer
+
+
+class FixedHandler(ImportHandler):
+    name = 'fixed'
+    default_template = 'test.bes'
+
+    def __init__(self, info):
+        self.info = info
+
+    def extract(self, importer, job):
+        return dict(self.info)
+
+
+class WhereFromsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.foundation = bigfiximport.DARWIN_FOUNDATION_AVAILABLE
+        self.wherefroms = bigfiximport.getkMDItemWhereFroms
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = True
+        bigfiximport.getkMDItemWhereFroms = \
+            lambda file_path, default: 'https://browser.example/download'
+
+    def tearDown(self):
+        bigfiximport.DARWIN_FOUNDATION_AVAILABLE = self.foundation
+        bigfiximport.getkMDItemWhereFroms = self.wherefroms
+
+    def extract(self, info):
+        importer = Importer.__new__(Importer)
+        importer.find_handler = lambda job: FixedHandler(info)
+        job = ImportJob('/tmp/Update.dmg')
+        job.fileinfo = {'file_is_local': True}
+        return importer.extract(job).info
+
+    def test_where_from_url(self):
+        self.assertEqual(self.extract({})['url'],
+                         'https://browser.example/download')
+
+    def test_handler_url_is_kept(self):
+        info = self.extract({'url': 'https://adobe.example/direct.dmg'})
+        self.assertEqual(info['url'], 'https://adobe.example/direct.dmg')
+
+
+if __name__ == '__main__':
+    unittest.main()
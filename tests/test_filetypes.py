@@ -0,0 +1,260 @@
+"""File types recognized from contents, and the handlers they are routed to."""
+
+import os
+import plistlib
+import shutil
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from tests import support
+from bigfiximport import Importer, ImportJob, classify_file, HANDLERS
+from munkilib import bplist, filetypes
+
+FIXTURES_DIR = support.FIXTURES_DIR
+
+XML_PLIST = plistlib.writePlistToString({'name': 'Foo', 'version': '1.0'})
+
+OLE_MAGIC = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def mz_image(signature):
+    """An MZ stub whose e_lfanew points at the given signature."""
+    head = bytearray(128)
+    head[0:2] = 'MZ'
+    struct.pack_into('<I', head, 0x3c, 64)
+    head[64:64 + len(signature)] = signature
+    return str(head)
+
+
+def udif_image(size):
+    """size bytes of image data followed by a koly trailer."""
+    return '\0' * size + 'koly' + struct.pack('>II', 4, 512) + '\0' * 500
+
+
+def ole_file(clsid, first_dir_sector=1, sector_shift=9):
+    """An OLE header and a root directory entry with the given CLSID."""
+    header = bytearray(512)
+    header[0:8] = OLE_MAGIC
+    struct.pack_into('<H', header, 0x1e, sector_shift)
+    struct.pack_into('<I', header, 0x30, first_dir_sector)
+    root = bytearray(128)
+    root[0:10] = 'R\0o\0o\0t\0 \0'
+    root[80:96] = clsid
+    offset = (first_dir_sector + 1) * 512
+    return str(header).ljust(offset, '\0') + str(root).ljust(512, '\0')
+
+
+class IdentifyTest(unittest.TestCase):
+
+    def test_udif(self):
+        data = udif_image(1000)
+        self.assertEqual(filetypes.identify(data[:4096], data[-512:]), 'udif')
+        # the trailer must be the last 512 bytes
+        self.assertEqual(filetypes.identify(data[:-1], data[-513:-1]), None)
+        self.assertEqual(filetypes.identify('koly', 'koly'), None)
+
+    def test_xar(self):
+        self.assertEqual(filetypes.identify('xar!\0\x1c\0\x01', ''), 'xar')
+
+    def test_zip(self):
+        for signature in ['PK\x03\x04', 'PK\x05\x06', 'PK\x07\x08']:
+            self.assertEqual(filetypes.identify(signature + '\0' * 26, ''),
+                             'zip')
+
+    def test_ole_without_file(self):
+        data = ole_file(filetypes.MSI_CLSIDS.keys()[0])
+        self.assertEqual(filetypes.identify(data, data[-512:]), 'ole')
+
+    def test_plist(self):
+        self.assertEqual(filetypes.identify(bplist.writeplist([1]), ''),
+                         'plist')
+        self.assertEqual(filetypes.identify(XML_PLIST, ''), 'plist')
+        self.assertEqual(
+            filetypes.identify('\xef\xbb\xbf\n  ' + XML_PLIST, ''), 'plist')
+        self.assertEqual(filetypes.identify('<plist version="1.0">', ''),
+                         'plist')
+        self.assertEqual(
+            filetypes.identify('<?xml version="1.0"?><root/>', ''), None)
+
+    def test_unknown(self):
+        self.assertEqual(filetypes.identify('', ''), None)
+        self.assertEqual(filetypes.identify('#!/bin/sh\n', '#!/bin/sh\n'),
+                         None)
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def handler_for(self, path, package=False, adobe=False):
+        job = ImportJob(path)
+        job.fileinfo = classify_file(path)
+        importer = Importer.__new__(Importer)
+        importer.package = package
+        importer.adobe = adobe
+        for handler in HANDLERS:
+            if handler.matches(importer, job):
+                return handler.name
+        return None
+
+    def assertType(self, path, file_type, mime=None):
+        descriptor = filetypes.classify(path)
+        self.assertEqual(descriptor['type'], file_type)
+        self.assertEqual(descriptor['mime'],
+                         mime or filetypes.MIME_TYPES.get(file_type))
+        if os.path.isfile(path):
+            self.assertEqual(descriptor['size'], os.path.getsize(path))
+
+    def test_udif(self):
+        # a trailer in the head, and one read from the end of the file
+        for size in [1000, 20000]:
+            path = self.write('Foo-%d.dmg' % size, udif_image(size))
+            self.assertType(path, 'udif')
+            self.assertEqual(self.handler_for(path), 'copyfromdmg')
+            self.assertEqual(self.handler_for(path, adobe=True), 'adobemac')
+
+    def test_udif_by_contents(self):
+        path = self.write('download', udif_image(20000))
+        self.assertType(path, 'udif')
+        self.assertEqual(classify_file(path)['file_mime'],
+                         'application/x-apple-diskimage')
+        self.assertEqual(self.handler_for(path), 'copyfromdmg')
+
+    def test_xar(self):
+        for name in ['Foo.pkg', 'FooSuite.pkg']:
+            path = os.path.join(FIXTURES_DIR, 'xar', name)
+            self.assertType(path, 'xar')
+            self.assertEqual(self.handler_for(path, package=True),
+                             'flatpackage')
+            self.assertEqual(self.handler_for(path), None)
+
+    def test_zip(self):
+        path = os.path.join(self.tempdir, 'Foo.zip')
+        zf = zipfile.ZipFile(path, 'w')
+        zf.writestr('Foo/readme.txt', 'Foo')
+        zf.close()
+        self.assertType(path, 'zip')
+        self.assertEqual(self.handler_for(path), None)
+
+    def test_empty_zip(self):
+        path = os.path.join(self.tempdir, 'Empty.zip')
+        zipfile.ZipFile(path, 'w').close()
+        self.assertType(path, 'zip')
+
+    def test_adobe_zip(self):
+        path = os.path.join(self.tempdir, 'PhotoshopCC-16.1.2-x64.zip')
+        zf = zipfile.ZipFile(path, 'w')
+        zf.writestr('PhotoshopCC/AdobePatchInstaller.exe', mz_image('PE\0\0'))
+        zf.writestr('PhotoshopCC/payloads/UpdateManifest.xml', '<manifest/>')
+        zf.close()
+        self.assertType(path, 'zip')
+        self.assertEqual(self.handler_for(path, adobe=True), 'adobewindows')
+
+    def test_msi(self):
+        path = os.path.join(FIXTURES_DIR, 'msi', 'product.msi')
+        self.assertType(path, 'msi')
+        self.assertEqual(self.handler_for(path), 'windowsmsi')
+
+    def test_msp_and_mst(self):
+        with open(os.path.join(FIXTURES_DIR, 'msi', 'product.msi'),
+                  'rb') as f:
+            data = f.read()
+        msi_clsid = [clsid for (clsid, file_type)
+                     in filetypes.MSI_CLSIDS.items() if file_type == 'msi'][0]
+        self.assertEqual(data.count(msi_clsid), 1)
+        for (clsid, file_type) in filetypes.MSI_CLSIDS.items():
+            path = self.write('product.' + file_type,
+                              data.replace(msi_clsid, clsid))
+            self.assertType(path, file_type)
+            if file_type != 'msi':
+                self.assertEqual(self.handler_for(path), None)
+
+    def test_directory_past_head(self):
+        # the root entry is read from the file, not the first 4KB
+        for (clsid, file_type) in filetypes.MSI_CLSIDS.items():
+            path = self.write('far.' + file_type,
+                              ole_file(clsid, first_dir_sector=20))
+            self.assertType(path, file_type)
+
+    def test_other_ole(self):
+        path = self.write('Report.doc', ole_file('\0' * 16))
+        self.assertType(path, 'ole')
+        self.assertEqual(self.handler_for(path), None)
+        # too short to hold a header, and a bad sector size
+        self.assertType(self.write('short.msi', OLE_MAGIC + '\0' * 100),
+                        'ole')
+        self.assertType(self.write(
+            'bad.msi', ole_file(filetypes.MSI_CLSIDS.keys()[0],
+                                sector_shift=10)), 'ole')
+
+    def test_pe(self):
+        path = self.write('setup.exe', mz_image('PE\0\0'))
+        self.assertType(path, 'pe')
+        self.assertEqual(self.handler_for(path), 'windowsexe')
+
+    def test_ne(self):
+        path = self.write('setup16.exe', mz_image('NE'))
+        self.assertType(path, 'mz', 'application/x-msdownload')
+        self.assertEqual(self.handler_for(path), 'windowsexe')
+
+    def test_plist(self):
+        for (name, data) in [('binary.plist', bplist.writeplist([1])),
+                             ('xml.plist', XML_PLIST)]:
+            path = self.write(name, data)
+            self.assertType(path, 'plist')
+            self.assertEqual(self.handler_for(path, package=True), None)
+
+    def test_bundle_package(self):
+        path = os.path.join(self.tempdir, 'FooSuite.mpkg')
+        os.makedirs(os.path.join(path, 'Contents'))
+        self.assertEqual(filetypes.classify(path),
+                         {'type': None, 'mime': None, 'size': None})
+        self.assertTrue(classify_file(path)['file_name_isfolder'])
+        self.assertEqual(self.handler_for(path, package=True),
+                         'bundlepackage')
+        self.assertEqual(self.handler_for(path), None)
+
+    def test_directory(self):
+        path = os.path.join(self.tempdir, 'Foo.app')
+        os.mkdir(path)
+        self.assertEqual(filetypes.classify(path)['type'], None)
+        self.assertEqual(self.handler_for(path, package=True), None)
+
+    def test_unknown(self):
+        path = self.write('notes.txt', 'Nothing to install.\n')
+        self.assertType(path, None)
+        self.assertEqual(classify_file(path)['file_mime'], 'text/plain')
+        self.assertEqual(self.handler_for(path, package=True, adobe=True),
+                         None)
+        # named like an installer, but not one
+        path = self.write('Foo.dmg', 'Nothing to install.\n')
+        self.assertType(path, None)
+        self.assertEqual(self.handler_for(path), None)
+
+    def test_empty(self):
+        for name in ['empty', 'empty.exe', 'empty.msi', 'empty.pkg']:
+            path = self.write(name, '')
+            self.assertEqual(filetypes.classify(path),
+                             {'type': None, 'mime': None, 'size': 0})
+            self.assertEqual(self.handler_for(path, package=True), None)
+
+    def test_missing(self):
+        self.assertEqual(
+            filetypes.classify(os.path.join(self.tempdir, 'missing.dmg')),
+            {'type': None, 'mime': None, 'size': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Import-time budget and lazy backend loading for bigfiximport."""
+
+import __builtin__
+import subprocess
+import sys
+import unittest
+
+from tests import support
+
+# bigfiximport must import in less than this many seconds
+IMPORT_BUDGET = 0.1
+
+BACKENDS = ['jinja2', 'requests', 'besapi', 'hachoir_core', 'hachoir_metadata',
+            'hachoir_parser', 'pkg_resources', 'munkilib.munkicommon',
+            'munkilib.adobeutils', 'munkilib.FoundationPlist']
+
+PROBE = '''
+import sys, time
+start = time.time()
+import bigfiximport
+elapsed = time.time() - start
+print elapsed
+print ' '.join(name for name in %r if name in sys.modules)
+''' % BACKENDS
+
+
+def run_probe():
+    """Imports bigfiximport in a fresh interpreter; returns (seconds, loaded backends)."""
+    output = subprocess.check_output([sys.executable, '-B', '-c', PROBE],
+                                     cwd=support.REPO_DIR)
+    lines = output.splitlines()
+    return (float(lines[0]), lines[1].split() if len(lines) > 1 else [])
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def test_import_loads_no_backends(self):
+        (dummy_elapsed, loaded) = run_probe()
+        self.assertEqual(loaded, [])
+
+    def test_import_time_budget(self):
+        # best of three, so a busy machine doesn't fail the test
+        elapsed = min(run_probe()[0] for dummy_run in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET,
+                        'importing bigfiximport took %.3fs' % elapsed)
+
+    def test_version_does_not_load_backends(self):
+        output = subprocess.check_output(
+            [sys.executable, '-B', '-c',
+             'import sys, bigfiximport\n'
+             'try:\n'
+             '    bigfiximport.main(["bigfiximport.py", "--version"])\n'
+             'except SystemExit:\n'
+             '    pass\n'
+             'print " ".join(name for name in %r if name in sys.modules)' % BACKENDS],
+            cwd=support.REPO_DIR, stderr=subprocess.STDOUT)
+        self.assertEqual(output.splitlines()[-1].strip(), '')
+
+
+class LazyModuleTest(unittest.TestCase):
+
+    def test_munkilib_loads_without_patching_import(self):
+        real_import = __builtin__.__import__
+        self.assertTrue(support.bigfiximport.munkicommon.getOsVersion)
+        self.assertIs(__builtin__.__import__, real_import)
+
+    def test_missing_modules_still_raise(self):
+        support.bigfiximport.munkicommon.getOsVersion
+        with self.assertRaises(ImportError):
+            __import__('bigfiximport_no_such_module')
+
+    def test_only_listed_modules_are_stubbed(self):
+        name = 'bigfiximport_no_such_module'
+        support.bigfiximport.stub_missing_modules([name, name + '.child'])
+        try:
+            self.assertIsInstance(sys.modules[name], support.bigfiximport.DummyModule)
+            self.assertIs(sys.modules[name].child, sys.modules[name + '.child'])
+            self.assertFalse(support.bigfiximport.module_available(name))
+        finally:
+            sys.modules.pop(name, None)
+            sys.modules.pop(name + '.child', None)
+        self.assertTrue(support.bigfiximport.module_available('os'))
+
+
+if __name__ == '__main__':
+    unittest.main()
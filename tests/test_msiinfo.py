@@ -0,0 +1,141 @@
+# encoding: utf-8
+"""msiinfo on the MSI fixtures and on databases built by mkmsi."""
+
+import imp
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+from munkilib import msiinfo
+
+MSI_DIR = os.path.join(support.FIXTURES_DIR, 'msi')
+mkmsi = imp.load_source('mkmsi', os.path.join(MSI_DIR, 'mkmsi.py'))
+
+
+def fixture(name):
+    return os.path.join(MSI_DIR, name)
+
+
+class FixtureTest(unittest.TestCase):
+
+    def test_property_table(self):
+        info = msiinfo.getmsiinfo(fixture('product.msi'))
+        self.assertEqual(info['ProductName'], u'Example Widget')
+        self.assertEqual(info['ProductVersion'], u'2.5.1')
+        self.assertEqual(info['ProductCode'],
+                         u'{6F330B47-2577-43AD-9095-1861BA25889B}')
+        self.assertEqual(info['UpgradeCode'],
+                         u'{2C8B6E13-4A3C-4F5A-9D3E-7B1F0C2A6D41}')
+        self.assertEqual(info['Manufacturer'], u'Example Software, Inc.')
+        self.assertEqual(info['properties'], dict(mkmsi.PRODUCT_PROPERTIES))
+
+    def test_summaryinformation(self):
+        summary = msiinfo.getmsiinfo(fixture('product.msi'))['summary']
+        self.assertEqual(summary, {
+            'title': u'Installation Database',
+            'subject': u'Example Widget',
+            'author': u'Example Software, Inc.',
+            'keywords': u'Installer, MSI, Database',
+            'comments': u'This installer database contains the logic and '
+                        u'data required to install Example Widget.',
+            'template': u'x64;1033',
+            'revision_number': u'{1D3F66C2-5A0B-4E4F-8C0A-29E1D5B7F0AE}',
+            'page_count': 200,
+            'word_count': 2,
+            'creating_application':
+                u'Windows Installer XML Toolset (3.10.3.3007)',
+        })
+
+    def test_no_summaryinformation(self):
+        info = msiinfo.getmsiinfo(fixture('nosummary.msi'))
+        self.assertEqual(info['summary'], {})
+        self.assertFalse('UpgradeCode' in info)
+        self.assertEqual(info['ProductVersion'], u'2.5.1')
+
+    def test_stream_names(self):
+        for name in [u'_StringPool', u'Property', u'Binary.cab']:
+            self.assertEqual(
+                msiinfo.decodestreamname(mkmsi.streamname(name, True)),
+                u'!' + name)
+        self.assertEqual(msiinfo.decodestreamname(u'\x05SummaryInformation'),
+                         u'\x05SummaryInformation')
+
+
+class GeneratedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, data):
+        path = os.path.join(self.tempdir, 'generated.msi')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_long_string_pool(self):
+        # IDs past 0xFFFF need three byte references; the long value
+        # needs the extended length entry
+        license_text = u'Permission is hereby granted. ' * 3000
+        properties = mkmsi.PRODUCT_PROPERTIES + [(u'LicenseText',
+                                                   license_text)]
+        path = self.write(mkmsi.database(properties, strings=[None] * 0x10000,
+                                         long_refs=True))
+        info = msiinfo.getmsiinfo(path)
+        self.assertEqual(info['properties'], dict(properties))
+        self.assertEqual(len(info['properties'][u'LicenseText']), 90000)
+
+    def test_difat_and_mini_stream_spill(self):
+        # 15000 sectors of cabinet need more FAT sectors than the header
+        # lists; the filler streams spread the tables over several
+        # sectors of the mini stream and of the MiniFAT
+        filler = [(mkmsi.streamname(u'Binary.filler%d' % i), chr(i) * 3000)
+                  for i in range(4)]
+        cabinet = (mkmsi.streamname(u'Binary.cab'), '\0' * (15000 * 512))
+        path = self.write(mkmsi.database(mkmsi.PRODUCT_PROPERTIES,
+                                         summary=mkmsi.PRODUCT_SUMMARY,
+                                         streams=filler + [cabinet]))
+        with open(path, 'rb') as f:
+            compound_file = msiinfo.CompoundFile(f)
+            self.assertTrue(compound_file.num_difat_sectors > 0)
+            self.assertTrue(compound_file.num_minifat_sectors > 1)
+            self.assertTrue(compound_file.root['size'] > 4 * 512)
+        self.assertEqual(msiinfo.getmsiinfo(path),
+                         msiinfo.getmsiinfo(fixture('product.msi')))
+
+    def test_not_compound_file(self):
+        path = self.write('PK\x03\x04' + '\0' * 1020)
+        self.assertRaises(msiinfo.Error, msiinfo.getmsiinfo, path)
+
+    def test_truncated(self):
+        with open(fixture('product.msi'), 'rb') as f:
+            data = f.read()
+        for length in range(0, len(data), 64):
+            path = self.write(data[:length])
+            try:
+                msiinfo.getmsiinfo(path)
+            except msiinfo.Error:
+                pass
+
+    def test_corrupted(self):
+        rng = random.Random(15)
+        with open(fixture('product.msi'), 'rb') as f:
+            data = f.read()
+        for dummy_case in range(300):
+            damaged = bytearray(data)
+            for dummy_byte in range(rng.randint(1, 8)):
+                damaged[rng.randrange(len(damaged))] = rng.randrange(256)
+            path = self.write(str(damaged))
+            try:
+                msiinfo.getmsiinfo(path)
+            except msiinfo.Error:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
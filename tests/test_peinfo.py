@@ -0,0 +1,207 @@
+# encoding: utf-8
+"""peinfo and the Windows EXE handler on the PE fixtures."""
+
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+
+from tests import support
+import bigfiximport
+from bigfiximport import (BigFixImportError, Importer, ImportJob,
+                          WindowsExeHandler, get_pe_metadata)
+from munkilib import peinfo
+
+PE_DIR = os.path.join(support.FIXTURES_DIR, 'pe')
+
+# The values windowsexe.bes was written against, as hachoir_metadata
+# named them.
+HACHOIR_KEYS = ['title', 'author', 'version', 'copyright', 'comment',
+                'format_version']
+
+
+def fixture(name):
+    return os.path.join(PE_DIR, name)
+
+
+class GetPEInfoTest(unittest.TestCase):
+
+    def test_version_resource(self):
+        info = peinfo.getpeinfo(fixture('setup.exe'))
+        self.assertEqual(info['file_version'], '2.5.1.300')
+        self.assertEqual(info['product_version'], '2.5.1.0')
+        self.assertEqual(info['strings']['ProductName'], u'Example Widget')
+        self.assertEqual(info['strings']['ProductVersion'], u'2.5.1')
+        self.assertEqual(info['strings']['CompanyName'],
+                         u'Example Software, Inc.')
+        self.assertEqual(info['strings']['LegalCopyright'],
+                         u'\xa9 2015 Example Software, Inc.')
+        self.assertEqual(len(info['strings']), 9)
+        self.assertEqual((info['machine'], info['subsystem']),
+                         ('x86', 'Windows GUI'))
+        self.assertFalse(info['is_dll'] or info['is_64bit'])
+        self.assertEqual(info['installer_type'], None)
+
+    def test_64bit_dll(self):
+        # VarFileInfo comes before StringFileInfo in this one
+        info = peinfo.getpeinfo(fixture('tools64.dll'))
+        self.assertEqual((info['machine'], info['is_dll'], info['is_64bit']),
+                         ('x64', True, True))
+        self.assertEqual(info['file_version'], '7.0.0.12')
+        self.assertEqual(info['product_version'], '7.0.0.0')
+        self.assertEqual(sorted(info['strings']),
+                         ['CompanyName', 'FileDescription', 'LegalTrademarks'])
+
+    def test_no_version_resource(self):
+        info = peinfo.getpeinfo(fixture('noversion.exe'))
+        self.assertEqual(info['strings'], {})
+        self.assertFalse('file_version' in info)
+
+    def test_wrappers(self):
+        for (name, installer_type, silent_args) in [
+                ('nsis.exe', 'nsis', '/S'),
+                ('nsis-overlay.exe', 'nsis', '/S'),
+                ('inno.exe', 'inno', '/VERYSILENT /SUPPRESSMSGBOXES /NORESTART'),
+                ('wixburn.exe', 'wixburn', '/quiet /norestart'),
+                ('msi-overlay.exe', 'msi', '/qn')]:
+            info = peinfo.getpeinfo(fixture(name))
+            self.assertEqual((info['installer_type'], info['silent_args']),
+                             (installer_type, silent_args), name)
+
+    def test_not_pe(self):
+        self.assertRaises(peinfo.Error, peinfo.getpeinfo,
+                          os.path.join(PE_DIR, 'mkpe.py'))
+
+    def test_nested_too_deeply(self):
+        count = 100
+        data = ''.join(struct.pack('<HHHH', 8 * (count - i), 0, 0, 0)
+                       for i in range(count))
+        self.assertRaises(peinfo.Error, peinfo.parsenode, data, 0)
+
+
+class DamagedImageTest(unittest.TestCase):
+    """Damaged images raise peinfo.Error and nothing else."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def getpeinfo(self, data):
+        path = os.path.join(self.tempdir, 'damaged.exe')
+        with open(path, 'wb') as f:
+            f.write(data)
+        try:
+            peinfo.getpeinfo(path)
+        except peinfo.Error:
+            pass
+
+    def test_truncated(self):
+        for name in ['setup.exe', 'tools64.dll']:
+            with open(fixture(name), 'rb') as f:
+                data = f.read()
+            for length in range(0, len(data), 4):
+                self.getpeinfo(data[:length])
+
+    def test_corrupted(self):
+        rng = random.Random(14)
+        with open(fixture('setup.exe'), 'rb') as f:
+            data = f.read()
+        for dummy_case in range(500):
+            damaged = bytearray(data)
+            for dummy_byte in range(rng.randint(1, 8)):
+                damaged[rng.randrange(len(damaged))] = rng.randrange(256)
+            self.getpeinfo(str(damaged))
+
+
+class HachoirValue(object):
+
+    def __init__(self, text):
+        self.text = text
+
+
+class HachoirItem(object):
+
+    def __init__(self, key, text):
+        self.key = key
+        self.values = [HachoirValue(text)]
+
+
+class WindowsExeHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.hachoir = bigfiximport.HACHOIR_AVAILABLE
+        self.gethachoir = bigfiximport.getHachoirMetaData
+        self.importer = Importer.__new__(Importer)
+        self.importer.verbosity = 0
+        self.importer.hash_chunk_size = 2**16
+
+    def tearDown(self):
+        bigfiximport.HACHOIR_AVAILABLE = self.hachoir
+        bigfiximport.getHachoirMetaData = self.gethachoir
+        shutil.rmtree(self.tempdir)
+
+    def extract(self, path):
+        job = ImportJob(path)
+        job.fileinfo = bigfiximport.classify_file(path)
+        return WindowsExeHandler().extract(self.importer, job)
+
+    def test_hachoir_keys(self):
+        metadata = get_pe_metadata(fixture('setup.exe'))
+        self.assertEqual(dict((key, metadata[key]) for key in HACHOIR_KEYS), {
+            'title': u'Example Widget',
+            'author': u'Example Software, Inc.',
+            'version': u'2.5.1',
+            'copyright': u'\xa9 2015 Example Software, Inc.',
+            'comment': u'Installs Example Widget',
+            'format_version': u'Portable Executable: EXE',
+        })
+
+    def test_fallback_keys(self):
+        metadata = get_pe_metadata(fixture('tools64.dll'))
+        self.assertEqual(metadata['title'], u'Example Widget Tools')
+        self.assertEqual(metadata['copyright'],
+                         u'Widget is a trademark of Example Software')
+        self.assertEqual(metadata['version'], '7.0.0.0')
+        self.assertEqual(metadata['format_version'],
+                         u'Portable Executable: DLL')
+
+    def test_template_values(self):
+        from jinja2 import Environment, meta
+
+        with open(os.path.join(support.REPO_DIR, 'templates',
+                               'windowsexe.bes')) as f:
+            source = f.read().decode('utf-8')
+        used = meta.find_undeclared_variables(Environment().parse(source))
+        values = self.extract(fixture('setup.exe'))
+        # url is only known for downloaded files
+        self.assertEqual(sorted(used - set(values) - set(['url'])), [])
+
+    def test_damaged_image_uses_hachoir(self):
+        with open(fixture('setup.exe'), 'rb') as f:
+            data = f.read()
+        path = os.path.join(self.tempdir, 'setup.exe')
+        with open(path, 'wb') as f:
+            f.write(data[:0x300])
+
+        bigfiximport.HACHOIR_AVAILABLE = True
+        bigfiximport.getHachoirMetaData = lambda file_path: [
+            HachoirItem('title', u'Widget'), HachoirItem('version', u'2.5')]
+        values = self.extract(path)
+        self.assertEqual((values['title'], values['version']),
+                         (u'Widget', u'2.5'))
+
+    def test_damaged_image_without_hachoir(self):
+        path = os.path.join(self.tempdir, 'setup.exe')
+        with open(path, 'wb') as f:
+            f.write(open(fixture('setup.exe'), 'rb').read()[:0x300])
+        bigfiximport.HACHOIR_AVAILABLE = False
+        self.assertRaises(BigFixImportError, self.extract, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""Importer.post, post_bundle and refresh_task_index on REST errors."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from ConfigParser import SafeConfigParser
+
+from tests import support
+from bigfiximport import BigFixImportError, ImportJob, Importer, refresh_task_index
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content=''):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 400
+        self.reason = 'Reason'
+        self.url = 'https://bigfix.example/api/x'
+        self.content = self.text = content
+
+
+class FakeConnection(object):
+    """Answers each request with the next queued response."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, path, data=None, **kwargs):
+        self.requests.append((method, path))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+
+def created(*tasks):
+    elements = ''.join('<Task><Name>%s</Name><ID>%s</ID></Task>' % task for task in tasks)
+    return FakeResponse(200, '<BESAPI>%s</BESAPI>' % elements)
+
+
+class PostTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        config = SafeConfigParser()
+        config.add_section('bigfiximport')
+        config.set('bigfiximport', 'TASK_INDEX', os.path.join(self.tempdir, 'tasks.db'))
+        config.set('bigfiximport', 'DIGEST_CACHE', '')
+        self.importer = Importer(config=config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def job(self, sha256='a' * 64, version='1.0'):
+        job = ImportJob('/tmp/installer-%s.pkg' % sha256[:4])
+        job.template = 'test.bes'
+        job.info = {'sha256': sha256, 'version': version}
+        job.rendered = u'<BES><Task><Title>x</Title></Task></BES>'
+        return job
+
+    def post(self, job, *responses):
+        self.importer._connection = FakeConnection(*responses)
+        return self.importer.post(job, 'site')
+
+    def test_created(self):
+        job = self.post(self.job(), created(('Task', '10')))
+        self.assertEqual((job.action, job.task_id), ('created', '10'))
+        self.assertEqual(self.importer.task_index.get('site', 'a' * 64)['task_id'], '10')
+
+    def test_failed_create_is_not_recorded(self):
+        job = self.post(self.job(), FakeResponse(400, 'Bad template'))
+        self.assertEqual(job.action, 'failed')
+        self.assertIn('HTTP 400', job.error)
+        self.assertIsNone(self.importer.task_index.get('site', 'a' * 64))
+
+    def test_failed_update_is_retried(self):
+        self.post(self.job(), created(('Task', '10')))
+        entry = self.importer.task_index.get('site', 'a' * 64)
+
+        job = self.post(self.job(version='2.0'), FakeResponse(500))
+        self.assertEqual(job.action, 'failed')
+        self.assertEqual(self.importer.task_index.get('site', 'a' * 64), entry)
+
+        # the same import is attempted again rather than reported unchanged
+        job = self.post(self.job(version='2.0'), FakeResponse(200, ''))
+        self.assertEqual(job.action, 'updated')
+        self.assertEqual(self.importer._connection.requests, [('PUT', 'task/site/10')])
+
+    def test_deleted_task_is_dropped_from_index(self):
+        self.post(self.job(), created(('Task', '10')))
+        job = self.post(self.job(version='2.0'), FakeResponse(404))
+        self.assertEqual(job.action, 'failed')
+        self.assertIsNone(self.importer.task_index.get('site', 'a' * 64))
+
+    def test_bundle_error_fails_every_job(self):
+        jobs = [self.job('b' * 64), self.job('c' * 64)]
+        self.importer._connection = FakeConnection(FakeResponse(400))
+        self.importer.post_bundle(jobs, 'site')
+        self.assertEqual([job.action for job in jobs], ['failed', 'failed'])
+        self.assertIsNone(self.importer.task_index.get('site', 'b' * 64))
+
+    def test_gateway_error_finds_created_task(self):
+        # the server created the task, but the reply was lost
+        job = self.post(self.job(), FakeResponse(502), created(('Task', '10')),
+                        FakeResponse(200, '<Task>sha256:%s</Task>' % ('a' * 64)))
+        self.assertEqual((job.action, job.task_id), ('created', '10'))
+        self.assertEqual(self.importer._connection.requests,
+                         [('POST', 'tasks/site'), ('GET', 'tasks/site'),
+                          ('GET', 'task/site/10')])
+        self.assertIsNotNone(self.importer.task_index.get('site', 'a' * 64)['task_hash'])
+
+    def test_gateway_error_without_task_fails(self):
+        job = self.post(self.job(), FakeResponse(504), created())
+        self.assertEqual(job.action, 'failed')
+        self.assertIn('HTTP 504', job.error)
+        self.assertIsNone(self.importer.task_index.get('site', 'a' * 64))
+
+    def test_dropped_connection_finds_created_task(self):
+        self.importer._connection = FakeConnection(
+            IOError('Connection aborted'), created(('Task', '10')),
+            FakeResponse(200, '<Task>sha256:%s</Task>' % ('a' * 64)))
+        job = self.importer.post(self.job(), 'site')
+        self.assertEqual((job.action, job.task_id), ('created', '10'))
+
+    def test_bundle_gateway_error_finds_created_tasks(self):
+        jobs = [self.job('b' * 64), self.job('c' * 64)]
+        self.importer._connection = FakeConnection(
+            FakeResponse(502), created(('One', '11')),
+            FakeResponse(200, '<Task>sha256:%s</Task>' % ('b' * 64)))
+        self.importer.post_bundle(jobs, 'site')
+        self.assertEqual([job.action for job in jobs], ['created', 'failed'])
+        self.assertEqual(jobs[0].task_id, '11')
+
+    def test_bundle_jobs_without_ids_fail(self):
+        jobs = [self.job('b' * 64), self.job('c' * 64)]
+        self.importer._connection = FakeConnection(created(('One', '11')))
+        self.importer.post_bundle(jobs, 'site')
+        self.assertEqual([job.action for job in jobs], ['created', 'failed'])
+        self.assertIsNone(self.importer.task_index.get('site', 'c' * 64))
+
+    def test_refresh_index_error_raises(self):
+        self.importer.task_index.put('site', 'a' * 64, '10', 'Task')
+        self.importer._connection = FakeConnection(FakeResponse(401))
+        with self.assertRaises(BigFixImportError):
+            refresh_task_index(self.importer, 'site')
+        self.assertEqual(self.importer.task_index.task_ids('site'), set(['10']))
+
+
+if __name__ == '__main__':
+    unittest.main()
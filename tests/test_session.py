@@ -0,0 +1,89 @@
+"""BigFixSession only retries requests that can't create a task twice."""
+
+import collections
+import unittest
+
+from tests import support
+from bigfiximport import BigFixSession
+
+try:
+    import requests
+    from requests.packages.urllib3.exceptions import (MaxRetryError,
+                                                      NewConnectionError,
+                                                      ProtocolError)
+except ImportError:
+    requests = None
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSession(object):
+    """Answers each request with the next queued response or error."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, data=None, **kwargs):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def refused():
+    reason = NewConnectionError(None, 'Connection refused')
+    return requests.ConnectionError(MaxRetryError(None, '/api/tasks/site', reason))
+
+
+def dropped():
+    reason = ProtocolError('Connection aborted.')
+    return requests.ConnectionError(reason)
+
+
+@unittest.skipIf(requests is None, 'requests is not installed')
+class RetryTest(unittest.TestCase):
+
+    def request(self, method, *responses):
+        session = BigFixSession.__new__(BigFixSession)
+        session.rootserver = 'https://bigfix.example:52311'
+        session.retries = 2
+        session.backoff = 0
+        session.latencies = collections.deque()
+        session.session = FakeSession(*responses)
+        self.session = session.session
+        return session.request(method, 'tasks/site', data='<BES/>')
+
+    def test_get_retries_gateway_errors(self):
+        response = self.request('GET', FakeResponse(502), FakeResponse(200))
+        self.assertEqual((response.status_code, self.session.calls), (200, 2))
+
+    def test_put_retries_gateway_errors(self):
+        response = self.request('PUT', FakeResponse(503), FakeResponse(200))
+        self.assertEqual((response.status_code, self.session.calls), (200, 2))
+
+    def test_post_returns_gateway_errors(self):
+        response = self.request('POST', FakeResponse(502), FakeResponse(200))
+        self.assertEqual((response.status_code, self.session.calls), (502, 1))
+
+    def test_post_retries_refused_connection(self):
+        response = self.request('POST', refused(), FakeResponse(200))
+        self.assertEqual((response.status_code, self.session.calls), (200, 2))
+
+    def test_post_raises_dropped_connection(self):
+        self.assertRaises(requests.ConnectionError, self.request, 'POST',
+                          dropped(), FakeResponse(200))
+        self.assertEqual(self.session.calls, 1)
+
+    def test_get_retries_dropped_connection(self):
+        response = self.request('GET', dropped(), FakeResponse(200))
+        self.assertEqual((response.status_code, self.session.calls), (200, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
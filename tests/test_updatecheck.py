@@ -0,0 +1,445 @@
+"""Catalog lookups and receipt analysis against the code they replaced."""
+
+import os
+import plistlib
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+from munkilib import munkicommon, updatecheck
+
+# Shapes of real-world pkginfo versions: plain, padded with zeros, with a
+# build number, dated, and with alpha/beta suffixes.
+VERSION_FORMS = [
+    lambda rng: '%d.%d' % (rng.randint(0, 20), rng.randint(0, 9)),
+    lambda rng: '%d.%d.%d' % (rng.randint(0, 20), rng.randint(0, 9),
+                              rng.randint(0, 20)),
+    lambda rng: '%d.%d.0.0' % (rng.randint(0, 20), rng.randint(0, 9)),
+    lambda rng: '%d.%02d' % (rng.randint(0, 20), rng.randint(0, 20)),
+    lambda rng: '%d.%db%d' % (rng.randint(0, 20), rng.randint(0, 9),
+                              rng.randint(1, 5)),
+    lambda rng: '%d.%d (%d)' % (rng.randint(0, 20), rng.randint(0, 9),
+                                rng.randint(100, 9999)),
+    lambda rng: '20%02d.%d' % (rng.randint(0, 16), rng.randint(1, 12)),
+    lambda rng: '%d.%d.%d-rc%d' % (rng.randint(0, 20), rng.randint(0, 9),
+                                   rng.randint(0, 9), rng.randint(1, 3)),
+]
+
+
+def make_catalog(names, versions_per_name, items_per_version, seed):
+    """
+    Returns a shuffled list of pkginfo items, items_per_version of each of
+    versions_per_name versions for each of names names. About one item
+    in five requires an OS newer than 10.10.
+    """
+    rng = random.Random(seed)
+    items = []
+    for number in xrange(names):
+        name = 'Item%04d' % number
+        versions = set()
+        while len(versions) < versions_per_name:
+            versions.add(rng.choice(VERSION_FORMS)(rng))
+        for vers in versions:
+            for dummy_copy in xrange(items_per_version):
+                item = {'name': name, 'version': vers}
+                if rng.random() < 0.2:
+                    item['minimum_os_version'] = '10.11'
+                items.append(item)
+    rng.shuffle(items)
+    return items
+
+
+def baseline_latest(itemsmatchingname):
+    """The item indexes of a name, latest first, as getItemDetail sorted
+    them before makeCatalogDB did."""
+    def compare_version_keys(a, b):
+        return cmp(munkicommon.MunkiLooseVersion(b),
+                   munkicommon.MunkiLooseVersion(a))
+
+    versionlist = itemsmatchingname.keys()
+    versionlist.sort(compare_version_keys)
+    indexlist = []
+    for versionkey in versionlist:
+        indexlist.extend(itemsmatchingname[versionkey])
+    return indexlist
+
+
+def make_receipt_catalog(items, receipts, seed):
+    """
+    Returns a catalog of pkginfo items for items / 5 names, and a
+    dictionary of installed receipts and their versions. Each item has one
+    or two receipts of its own, and sometimes one shared with other names.
+    The given number of the catalog's receipts are installed, plus one
+    that no item claims.
+    """
+    rng = random.Random(seed)
+    names = items // 5
+    shared = ['com.example.shared.%d' % number for number in xrange(200)]
+    catalogitems = []
+    for dummy_number in xrange(items):
+        name = 'item%d' % rng.randrange(names)
+        vers = '%d.%d.%d' % (rng.randint(1, 9), rng.randint(0, 9),
+                             rng.randint(0, 9))
+        itemreceipts = [{'packageid': 'com.example.%s.%s' % (name, part),
+                         'version': vers}
+                        for part in ('main', 'extra')[:rng.randint(1, 2)]]
+        if rng.random() < 0.3:
+            itemreceipts.append({'packageid': rng.choice(shared),
+                                 'version': vers})
+        catalogitems.append({'name': name, 'version': vers,
+                             'receipts': itemreceipts})
+
+    pkgids = sorted(set(receipt['packageid'] for item in catalogitems
+                        for receipt in item['receipts']))
+    installedpkgs = dict(
+        (pkgid, '%d.%d.%d' % (rng.randint(1, 9), rng.randint(0, 9),
+                              rng.randint(0, 9)))
+        for pkgid in rng.sample(pkgids, min(receipts, len(pkgids))))
+    installedpkgs['com.example.orphan'] = '1.0'
+    return (catalogitems, installedpkgs)
+
+
+def baseline_analyze_installed_pkgs(catalogs, installedpkgs):
+    """The PKGDATA analyzeInstalledPkgs built before it counted receipt
+    ownership, for the given CATALOG and INSTALLEDPKGS. This is the old
+    code, except that receipts are looked up in the installedpkgs dict
+    rather than in a list of its keys."""
+    itemname_to_pkgid = {}
+    pkgid_to_itemname = {}
+    for catalogname in catalogs.keys():
+        for item in catalogs[catalogname]['items']:
+            name = item.get('name')
+            if not name:
+                continue
+            if item.get('receipts'):
+                if not name in itemname_to_pkgid:
+                    itemname_to_pkgid[name] = {}
+
+                for receipt in item['receipts']:
+                    if 'packageid' in receipt:
+                        pkgid = receipt['packageid']
+                        vers = receipt['version']
+                        if not pkgid in itemname_to_pkgid[name]:
+                            itemname_to_pkgid[name][pkgid] = []
+                        if not vers in itemname_to_pkgid[name][pkgid]:
+                            itemname_to_pkgid[name][pkgid].append(vers)
+
+                        if not pkgid in pkgid_to_itemname:
+                            pkgid_to_itemname[pkgid] = {}
+                        if not name in pkgid_to_itemname[pkgid]:
+                            pkgid_to_itemname[pkgid][name] = []
+                        if not vers in pkgid_to_itemname[pkgid][name]:
+                            pkgid_to_itemname[pkgid][name].append(vers)
+
+    installed = []
+    partiallyinstalled = []
+    installedpkgsmatchedtoname = {}
+    for name in itemname_to_pkgid.keys():
+        somepkgsfound = False
+        allpkgsfound = True
+        for pkgid in itemname_to_pkgid[name].keys():
+            if pkgid in installedpkgs:
+                somepkgsfound = True
+                if not name in installedpkgsmatchedtoname:
+                    installedpkgsmatchedtoname[name] = []
+                installedpkgsmatchedtoname[name].append(pkgid)
+            else:
+                allpkgsfound = False
+        if allpkgsfound:
+            installed.append(name)
+        elif somepkgsfound:
+            partiallyinstalled.append(name)
+
+    for name in partiallyinstalled:
+        pkgsforthisname = installedpkgsmatchedtoname[name]
+        allotherpkgs = []
+        for othername in installed:
+            allotherpkgs.extend(installedpkgsmatchedtoname[othername])
+        for othername in partiallyinstalled:
+            if othername != name:
+                allotherpkgs.extend(installedpkgsmatchedtoname[othername])
+        uniquepkgs = list(set(pkgsforthisname) - set(allotherpkgs))
+        if uniquepkgs:
+            installed.append(name)
+
+    partiallyinstalled = [item for item in partiallyinstalled
+                          if item not in installed]
+
+    references = {}
+    for name in installed:
+        for pkgid in installedpkgsmatchedtoname[name]:
+            if not pkgid in references:
+                references[pkgid] = []
+            references[pkgid].append(name)
+
+    orphans = [pkgid for pkgid in installedpkgs.keys()
+               if pkgid not in references]
+
+    matched_orphans = []
+    for pkgid in orphans:
+        if pkgid in pkgid_to_itemname:
+            best_match = updatecheck.bestVersionMatch(
+                installedpkgs[pkgid], pkgid_to_itemname[pkgid])
+            if best_match:
+                matched_orphans.append(best_match)
+
+    for name in matched_orphans:
+        if name not in installed:
+            installed.append(name)
+        if name in partiallyinstalled:
+            partiallyinstalled.remove(name)
+        for pkgid in installedpkgsmatchedtoname[name]:
+            if not pkgid in references:
+                references[pkgid] = []
+            if not name in references[pkgid]:
+                references[pkgid].append(name)
+
+    return {'receipts_for_name': installedpkgsmatchedtoname,
+            'installed_names': installed,
+            'pkg_references': references}
+
+
+class LatestItemTest(unittest.TestCase):
+    """A 50,000 item catalog: 2,500 names with 10 versions of 2 items."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pkgdb = updatecheck.makeCatalogDB(make_catalog(2500, 10, 2, 21))
+        cls.expected = dict(
+            (name, baseline_latest(itemsmatchingname))
+            for (name, itemsmatchingname) in cls.pkgdb['named'].iteritems())
+
+    def setUp(self):
+        self.catalog = updatecheck.CATALOG
+        self.machine = updatecheck.MACHINE
+        updatecheck.CATALOG = {'testing': self.pkgdb}
+        updatecheck.MACHINE = {'munki_version': '2.3.0', 'os_vers': '10.10.5',
+                               'arch': 'x86_64', 'x86_64_capable': True}
+
+    def tearDown(self):
+        updatecheck.CATALOG = self.catalog
+        updatecheck.MACHINE = self.machine
+
+    def test_catalog_size(self):
+        self.assertEqual(len(self.pkgdb['items']), 50000)
+
+    def test_latest_order(self):
+        self.assertEqual(sorted(self.pkgdb['latest']), sorted(self.expected))
+        for (name, indexlist) in self.expected.iteritems():
+            self.assertEqual(self.pkgdb['latest'][name], indexlist, name)
+
+    def test_getitemdetail_latest(self):
+        items = self.pkgdb['items']
+        for (name, indexlist) in self.expected.iteritems():
+            expected = None
+            for index in indexlist:
+                if 'minimum_os_version' not in items[index]:
+                    expected = items[index]
+                    break
+            detail = updatecheck.getItemDetail(name, ['testing'])
+            self.assertTrue(detail is expected, name)
+
+
+class AnalyzeInstalledPkgsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = updatecheck.CATALOG
+        self.installedpkgs = updatecheck.INSTALLEDPKGS
+        self.pkgdata = updatecheck.PKGDATA
+        updatecheck.PKGDATA = {}
+
+    def tearDown(self):
+        updatecheck.CATALOG = self.catalog
+        updatecheck.INSTALLEDPKGS = self.installedpkgs
+        updatecheck.PKGDATA = self.pkgdata
+
+    def analyze(self, catalogitems, installedpkgs):
+        updatecheck.CATALOG = {
+            'testing': updatecheck.makeCatalogDB(catalogitems)}
+        updatecheck.INSTALLEDPKGS = dict(installedpkgs)
+        updatecheck.analyzeInstalledPkgs()
+        return updatecheck.PKGDATA
+
+    def test_same_as_baseline(self):
+        """30,000 items and 5,000 installed receipts."""
+        (catalogitems, installedpkgs) = make_receipt_catalog(30000, 5000, 25)
+        pkgdata = self.analyze(catalogitems, installedpkgs)
+        expected = baseline_analyze_installed_pkgs(updatecheck.CATALOG,
+                                                   installedpkgs)
+        self.assertTrue(len(expected['installed_names']) > 1000)
+        self.assertEqual(pkgdata['installed_names'],
+                         expected['installed_names'])
+        self.assertEqual(pkgdata['receipts_for_name'],
+                         expected['receipts_for_name'])
+        self.assertEqual(pkgdata['pkg_references'],
+                         expected['pkg_references'])
+
+    def test_installed_item_without_packageids(self):
+        catalogitems = [
+            {'name': 'Foo', 'version': '1.0',
+             'receipts': [{'filename': 'Foo.pkg', 'version': '1.0'}]},
+            {'name': 'Bar', 'version': '2.0',
+             'receipts': [{'packageid': 'com.example.bar', 'version': '2.0'}]},
+        ]
+        pkgdata = self.analyze(catalogitems, {'com.example.bar': '2.0'})
+        self.assertEqual(sorted(pkgdata['installed_names']), ['Bar', 'Foo'])
+        self.assertEqual(pkgdata['pkg_references'],
+                         {'com.example.bar': ['Bar']})
+
+
+class CatalogDBTest(unittest.TestCase):
+    """Databases getCatalogs saves in ManagedInstallDir/catalogdb."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tempdir, 'catalogs'))
+        self.catalogitems = make_catalog(200, 3, 1, 23)
+        for item in self.catalogitems[:20]:
+            item['update_for'] = 'Item0000'
+        for item in self.catalogitems[20:30]:
+            item['autoremove'] = True
+        plistlib.writePlist(self.catalogitems, self.catalogpath)
+        self.builds = []
+        self.saved = dict(
+            (name, getattr(updatecheck, name))
+            for name in ['CATALOG', 'CATALOG_DB_VERSION', 'makeCatalogDB',
+                         'getResourceIfChangedAtomically'])
+        self.saved_munkicommon = dict(
+            (name, getattr(munkicommon, name))
+            for name in ['pref', 'display_detail', 'display_debug1',
+                         'display_debug2', 'display_error'])
+        prefs = {'ManagedInstallDir': self.tempdir,
+                 'SoftwareRepoURL': 'http://munki.example.com/repo'}
+        munkicommon.pref = prefs.get
+        munkicommon.display_detail = lambda *args: None
+        munkicommon.display_debug1 = lambda *args: None
+        munkicommon.display_debug2 = lambda *args: None
+        munkicommon.display_error = lambda *args: self.fail(args)
+        updatecheck.CATALOG = {}
+        updatecheck.getResourceIfChangedAtomically = (
+            lambda *args, **kwargs: False)
+
+        def counted_make_catalog_db(catalogitems):
+            self.builds.append(len(catalogitems))
+            return self.saved['makeCatalogDB'](catalogitems)
+
+        updatecheck.makeCatalogDB = counted_make_catalog_db
+
+    def tearDown(self):
+        for (name, value) in self.saved.items():
+            setattr(updatecheck, name, value)
+        for (name, value) in self.saved_munkicommon.items():
+            setattr(munkicommon, name, value)
+        shutil.rmtree(self.tempdir)
+
+    @property
+    def catalogpath(self):
+        return os.path.join(self.tempdir, 'catalogs', 'testing')
+
+    @property
+    def dbpath(self):
+        return os.path.join(self.tempdir, 'catalogdb', 'testing')
+
+    def get_catalog(self):
+        """The database of the testing catalog, as the next run sees it."""
+        updatecheck.CATALOG.clear()
+        updatecheck.getCatalogs(['testing'])
+        return updatecheck.CATALOG['testing']
+
+    def expected(self):
+        return self.saved['makeCatalogDB'](
+            plistlib.readPlist(self.catalogpath))
+
+    def assertRebuilt(self):
+        del self.builds[:]
+        self.assertEqual(self.get_catalog(), self.expected())
+        self.assertEqual(self.builds, [len(self.catalogitems)])
+        # and saved again for the run after
+        del self.builds[:]
+        self.assertEqual(self.get_catalog(), self.expected())
+        self.assertEqual(self.builds, [])
+
+    def test_round_trip(self):
+        pkgdb = updatecheck.makeCatalogDB(self.catalogitems)
+        catalog_hash = munkicommon.getsha256hash(self.catalogpath)
+        os.makedirs(os.path.dirname(self.dbpath))
+        updatecheck.writeCatalogDB(pkgdb, self.dbpath, catalog_hash)
+        loaded = updatecheck.readCatalogDB(self.dbpath, catalog_hash)
+        self.assertEqual(loaded, pkgdb)
+        self.assertEqual(len(loaded['updaters']), 20)
+        # updaters are items of the catalog, not copies of them
+        for item in loaded['updaters']:
+            self.assertTrue(
+                any(item is other for other in loaded['items']))
+
+    def test_saved_database_used(self):
+        self.assertEqual(self.get_catalog(), self.expected())
+        self.assertEqual(self.builds, [len(self.catalogitems)])
+        self.assertTrue(os.path.exists(self.dbpath))
+        del self.builds[:]
+        self.assertEqual(self.get_catalog(), self.expected())
+        self.assertEqual(self.builds, [])
+
+    def test_changed_catalog(self):
+        self.get_catalog()
+        self.catalogitems.append({'name': 'Item0000', 'version': '99.0'})
+        plistlib.writePlist(self.catalogitems, self.catalogpath)
+        self.assertRebuilt()
+        self.assertEqual(updatecheck.getItemDetail(
+            'Item0000', ['testing'])['version'], '99.0')
+
+    def test_db_version_bumped(self):
+        self.get_catalog()
+        updatecheck.CATALOG_DB_VERSION += 1
+        self.assertRebuilt()
+
+    def test_not_a_saved_database(self):
+        catalog_hash = munkicommon.getsha256hash(self.catalogpath)
+        self.get_catalog()
+        snapshot = updatecheck.FoundationPlist.readPlist(self.dbpath)
+        missing = dict(snapshot)
+        del missing['latest']
+        for damaged in [['a list'], missing,
+                        dict(snapshot, items='not a list'),
+                        dict(snapshot, named=[]),
+                        dict(snapshot, updaters=[len(self.catalogitems)]),
+                        dict(snapshot, updaters=['0']),
+                        dict(snapshot, updaters={'0': 0})]:
+            updatecheck.FoundationPlist.writeBinaryPlist(damaged, self.dbpath)
+            self.assertEqual(
+                updatecheck.readCatalogDB(self.dbpath, catalog_hash), None)
+            self.assertRebuilt()
+
+    def test_truncated(self):
+        self.get_catalog()
+        with open(self.dbpath, 'rb') as f:
+            data = f.read()
+        for length in range(0, len(data), len(data) // 50):
+            with open(self.dbpath, 'wb') as f:
+                f.write(data[:length])
+            self.assertRebuilt()
+
+    def test_corrupted(self):
+        rng = random.Random(23)
+        self.get_catalog()
+        with open(self.dbpath, 'rb') as f:
+            data = f.read()
+        for dummy_case in range(100):
+            damaged = bytearray(data)
+            for dummy_byte in range(rng.randint(1, 8)):
+                damaged[rng.randrange(len(damaged))] = rng.randrange(256)
+            with open(self.dbpath, 'wb') as f:
+                f.write(str(damaged))
+            updatecheck.CATALOG.clear()
+            updatecheck.getCatalogs(['testing'])
+            self.assertTrue('testing' in updatecheck.CATALOG)
+
+        with open(self.dbpath, 'wb') as f:
+            f.write('not a plist')
+        self.assertRebuilt()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# encoding: utf-8
+"""versionSortKey orders versions exactly as MunkiLooseVersion does."""
+
+import unittest
+
+from tests import support
+from munkilib import munkicommon
+
+# Versions as they turn up in pkginfo, receipts and Info.plists.
+REAL_WORLD_VERSIONS = [
+    # plain and padded with trailing zeros
+    '0', '0.0', '0.0.0.0', '1', '1.0', '1.0.0', '1.0.0.0.0', '1.1',
+    '10.6', '10.6.0', '10.6.8', '10.9.5', '10.10', '10.10.0', '10.11',
+    '2.3.0.0.0', '3.0.0', '3', '7.1.0.1234', '15.0.0.152', '45.0.2454.85',
+    '11.0.0.63', '2013', '2015.06.01', '20150601',
+    # leading zeros
+    '01', '1.00', '1.01', '1.02', '1.2', '1.10', '1.010', '2.0.01',
+    '0.0.0.1', '08.1', '8.1',
+    # mixed alpha and numeric
+    '1.0a', '1.0a1', '1.0b2', '1.0B2', '1.0b10', '1.0.a', '1a', '1.a',
+    '1.0.0a', '2.0-rc1', '2.0_rc1', '2.0 rc1', '2.0rc2', '5.0.1-beta',
+    '3.6.28-1', 'r123', 'r99', 'build 42', 'Build 42', '12.1 (1234)',
+    '12.1 (987)', '4.2.1 (Universal)', '6.0 Update 1', '1.2.3-beta+exp.sha.5114f85',
+    'v1.0', 'V1.0', 'alpha', 'beta', 'latest',
+    # placeholders
+    'NO VERSION', '', 'a', 'A', '...', '1..2', '.1', '1.', '-1', '1.-1',
+    ' 1', '1 ', '\t1.2',
+    # unicode, as read from plists
+    u'1.2', u'1.2.0', u'10.6', u'caf\xe9 1.0', u'2.0β', u'2.0β1',
+    u'–', 'caf\xc3\xa9 1.0',
+]
+
+
+def reference_cmp(a, b):
+    return cmp(munkicommon.MunkiLooseVersion(a),
+               munkicommon.MunkiLooseVersion(b))
+
+
+class VersionSortKeyTest(unittest.TestCase):
+
+    def assertSameOrder(self):
+        for a in REAL_WORLD_VERSIONS:
+            for b in REAL_WORLD_VERSIONS:
+                self.assertEqual(
+                    cmp(munkicommon.versionSortKey(a),
+                        munkicommon.versionSortKey(b)),
+                    reference_cmp(a, b), '%r vs %r' % (a, b))
+
+    def test_pairs(self):
+        self.assertSameOrder()
+
+    def test_pairs_cached(self):
+        # a second pass answers from the cache
+        self.assertSameOrder()
+        self.assertSameOrder()
+
+    def test_pairs_with_evictions(self):
+        cache_size = munkicommon.VERSION_KEY_CACHE_SIZE
+        munkicommon.VERSION_KEY_CACHE_SIZE = 8
+        munkicommon._version_keys = {}
+        munkicommon._old_version_keys = {}
+        try:
+            self.assertSameOrder()
+            self.assertTrue(len(munkicommon._version_keys) <= 8)
+        finally:
+            munkicommon.VERSION_KEY_CACHE_SIZE = cache_size
+
+    def test_sort(self):
+        self.assertEqual(
+            sorted(REAL_WORLD_VERSIONS, key=munkicommon.versionSortKey,
+                   reverse=True),
+            sorted(REAL_WORLD_VERSIONS, cmp=lambda a, b: reference_cmp(b, a)))
+
+    def test_equal_keys(self):
+        for (a, b) in [('10.6', '10.6.0'), ('1', '1.0.0.0.0'),
+                       (u'1.2', '1.2.0'), ('0', ''), ('01', '1')]:
+            self.assertEqual(munkicommon.versionSortKey(a),
+                             munkicommon.versionSortKey(b))
+
+
+if __name__ == '__main__':
+    unittest.main()
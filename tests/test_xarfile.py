@@ -0,0 +1,231 @@
+"""xarfile and the munkicommon flat package readers on generated packages."""
+
+import imp
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+from munkilib import munkicommon, xarfile
+
+XAR_DIR = os.path.join(support.FIXTURES_DIR, 'xar')
+mkxar = imp.load_source('mkxar', os.path.join(XAR_DIR, 'mkxar.py'))
+
+
+def fixture(name):
+    return os.path.join(XAR_DIR, name)
+
+
+def toc(members):
+    """The `xar -tf` listing of a fixture: directories before contents."""
+    listing = []
+
+    def walk(children, prefix):
+        for (name, dummy_data, dummy_encoding, grandchildren) in children:
+            listing.append(prefix + name)
+            if grandchildren is not None:
+                walk(grandchildren, prefix + name + '/')
+
+    walk(mkxar.tree(members), '')
+    return listing
+
+
+def expanded_package_info(pkgname, tmpdir):
+    """
+    getFlatPackageInfo as it was before xarfile: each member it needs is
+    extracted to tmpdir, as `xar -xf` did, and parsed from there.
+    """
+    pkgpath = fixture(pkgname)
+    members = dict((path, data) for (path, data, dummy_encoding)
+                   in mkxar.FIXTURES[pkgname])
+
+    def extract(toc_entry):
+        path = os.path.join(tmpdir, toc_entry)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(members[toc_entry])
+        return path
+
+    infoarray = []
+    listing = toc(mkxar.FIXTURES[pkgname])
+    for toc_entry in listing:
+        if toc_entry.startswith('PackageInfo') and len(infoarray) == 0:
+            infoarray = munkicommon.parsePkgRefs(extract(toc_entry))
+            break
+        elif toc_entry.endswith('.pkg/PackageInfo'):
+            infoarray.extend(munkicommon.parsePkgRefs(extract(toc_entry)))
+    if len(infoarray) == 0:
+        for toc_entry in [item for item in listing
+                          if item.startswith('Distribution')]:
+            infoarray = munkicommon.parsePkgRefs(extract(toc_entry),
+                                                 path_to_pkg=pkgpath)
+            break
+    return infoarray
+
+
+class PatchedWarningsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.warnings = []
+        self.display_warning = munkicommon.display_warning
+        self.display_error = munkicommon.display_error
+        munkicommon.display_warning = self.warnings.append
+        munkicommon.display_error = self.warnings.append
+
+    def tearDown(self):
+        munkicommon.display_warning = self.display_warning
+        munkicommon.display_error = self.display_error
+        shutil.rmtree(self.tempdir)
+
+
+class XarArchiveTest(unittest.TestCase):
+
+    def test_namelist(self):
+        for (pkgname, members) in mkxar.FIXTURES.items():
+            with xarfile.XarArchive(fixture(pkgname)) as archive:
+                self.assertEqual(archive.namelist(), toc(members))
+
+    def test_read(self):
+        encodings = set()
+        for (pkgname, members) in mkxar.FIXTURES.items():
+            with xarfile.XarArchive(fixture(pkgname)) as archive:
+                for (path, data, encoding) in members:
+                    self.assertEqual(archive.read(path), data)
+                    self.assertEqual(archive.getmember(path)['encoding'],
+                                     mkxar.ENCODINGS[encoding][0])
+                    encodings.add(encoding)
+                self.assertRaises(xarfile.Error, archive.read, 'Missing')
+        self.assertEqual(sorted(encodings), ['bzip2', 'gzip', 'raw'])
+
+    def test_read_directory(self):
+        with xarfile.XarArchive(fixture('FooSuite.pkg')) as archive:
+            self.assertEqual(archive.getmember('Foo.pkg')['type'],
+                             'directory')
+            self.assertEqual(archive.read('Foo.pkg'), '')
+
+
+class FlatPackageInfoTest(PatchedWarningsTest):
+
+    def test_same_as_expanded(self):
+        for pkgname in mkxar.FIXTURES:
+            self.assertEqual(
+                munkicommon.getFlatPackageInfo(fixture(pkgname)),
+                expanded_package_info(pkgname,
+                                      os.path.join(self.tempdir, pkgname)),
+                pkgname)
+        self.assertEqual(self.warnings, [])
+
+    def test_receipts(self):
+        self.assertEqual(
+            munkicommon.getReceiptInfo(fixture('FooSuite.pkg')),
+            [{'packageid': 'com.example.foo', 'version': '1.2.3',
+              'installed_size': 1400},
+             {'packageid': 'com.example.bar', 'version': '2.0',
+              'installed_size': 52}])
+
+    def test_installer_info(self):
+        self.assertEqual(
+            munkicommon.getFlatPkgInstallerInfo(fixture('Foo.pkg')),
+            {'RestartAction': 'RequireRestart', 'installed_size': 1400,
+             'description': ''})
+        self.assertEqual(
+            munkicommon.getFlatPkgInstallerInfo(fixture('FooSuite.pkg')),
+            {'RestartAction': 'RequireRestart', 'installed_size': 1452,
+             'display_name': 'Foo Suite',
+             'description': 'Installs Foo and Bar.'})
+
+
+class DamagedArchiveTest(PatchedWarningsTest):
+
+    def damaged(self, pkgname, change):
+        with open(fixture(pkgname), 'rb') as f:
+            data = bytearray(f.read())
+        path = os.path.join(self.tempdir, pkgname)
+        with open(path, 'wb') as f:
+            f.write(str(change(data)))
+        return path
+
+    def heap_position(self, pkgname, member=None):
+        with xarfile.XarArchive(fixture(pkgname)) as archive:
+            offset = archive.getmember(member)['offset'] if member else 0
+            return archive.heap_offset + offset
+
+    def test_bad_member_checksum(self):
+        position = self.heap_position('Foo.pkg', 'PackageInfo')
+
+        def change(data):
+            data[position + 10] ^= 0xff
+            return data
+
+        path = self.damaged('Foo.pkg', change)
+        with xarfile.XarArchive(path) as archive:
+            self.assertEqual(archive.read('Bom'),
+                             mkxar.FIXTURES['Foo.pkg'][0][1])
+            self.assertRaises(xarfile.Error, archive.read, 'PackageInfo')
+        self.assertEqual(munkicommon.getFlatPackageInfo(path), [])
+        self.assertEqual(munkicommon.getFlatPkgInstallerInfo(path), None)
+
+    def test_bad_raw_member_checksum(self):
+        position = self.heap_position('FooSuite.pkg', 'Distribution')
+
+        def change(data):
+            data[position + 50] ^= 0x01
+            return data
+
+        path = self.damaged('FooSuite.pkg', change)
+        with xarfile.XarArchive(path) as archive:
+            self.assertRaises(xarfile.Error, archive.read, 'Distribution')
+
+    def test_bad_toc_checksum(self):
+        position = self.heap_position('Foo.pkg')
+
+        def change(data):
+            data[position] ^= 0xff
+            return data
+
+        path = self.damaged('Foo.pkg', change)
+        self.assertRaises(xarfile.Error, xarfile.XarArchive, path)
+        self.assertEqual(munkicommon.getFlatPackageInfo(path), [])
+
+    def test_truncated_heap(self):
+        position = self.heap_position('Foo.pkg', 'PackageInfo')
+        path = self.damaged('Foo.pkg', lambda data: data[:position + 10])
+        with xarfile.XarArchive(path) as archive:
+            self.assertEqual(archive.read('Payload'), mkxar.PAYLOAD)
+            self.assertRaises(xarfile.Error, archive.read, 'PackageInfo')
+
+        # the TOC checksum at the start of the heap
+        position = self.heap_position('Foo.pkg')
+        path = self.damaged('Foo.pkg', lambda data: data[:position + 10])
+        self.assertRaises(xarfile.Error, xarfile.XarArchive, path)
+
+    def test_truncated_toc(self):
+        for length in [0, 10, 28, 100]:
+            path = self.damaged('FooSuite.pkg', lambda data: data[:length])
+            self.assertRaises(xarfile.Error, xarfile.XarArchive, path)
+
+    def test_corrupted(self):
+        rng = random.Random(17)
+        with open(fixture('FooSuite.pkg'), 'rb') as f:
+            size = len(f.read())
+        for dummy_case in range(200):
+            def change(data):
+                for dummy_byte in range(rng.randint(1, 4)):
+                    data[rng.randrange(size)] = rng.randrange(256)
+                return data
+
+            path = self.damaged('FooSuite.pkg', change)
+            try:
+                with xarfile.XarArchive(path) as archive:
+                    for name in archive.namelist():
+                        archive.read(name)
+            except xarfile.Error:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()